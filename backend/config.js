@@ -19,6 +19,13 @@ const config = {
   python: {
     path: process.env.PYTHON_PATH || 'python3'
   },
+
+  // 상주형 검색 엔진 서버 (search-engine-py/search_server.py)
+  // 비워 두면 기존처럼 요청마다 Python 스크립트를 실행합니다.
+  searchEngine: {
+    url: process.env.SEARCH_ENGINE_URL || '',
+    timeoutMs: parseInt(process.env.SEARCH_ENGINE_TIMEOUT_MS || '30000', 10)
+  },
   
   // Server Configuration
   server: {
@@ -4,6 +4,8 @@ const router = express.Router();
 const multer = require('multer');
 const path = require('path');
 const fs = require('fs');
+const { spawn } = require('child_process');
+const { callSearchEngine } = require('../services/searchEngineClient');
 
 // 프로필 이미지 업로드 설정 (uploads/children)
 const profileStorage = multer.diskStorage({
@@ -433,6 +435,50 @@ router.put('/:childId', async (req, res) => {
   }
 });
 
+// 아동의 일지 벡터 임베딩 일괄 삭제 (일지마다 스크립트를 실행하지 않고 child_id 범위를 한 번에 삭제)
+async function deleteChildVectorEmbeddings(childId) {
+  const payload = { child_id: parseInt(childId) };
+  const served = await callSearchEngine('delete', payload);
+  if (served) return served;
+
+  return new Promise((resolve, reject) => {
+    const pythonScriptPath = path.join(__dirname, '..', 'search-engine-py', 'delete_diary.py');
+
+    const pythonProcess = spawn('python', [pythonScriptPath], {
+      stdio: ['pipe', 'pipe', 'pipe'],
+      cwd: path.join(__dirname, '..', 'search-engine-py'),
+      env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
+    });
+
+    let dataString = '';
+    let errorString = '';
+
+    pythonProcess.stdout.on('data', (data) => {
+      dataString += data.toString();
+    });
+
+    pythonProcess.stderr.on('data', (data) => {
+      errorString += data.toString();
+    });
+
+    pythonProcess.on('close', (code) => {
+      if (code !== 0) {
+        return reject(new Error(`Python 삭제 스크립트 실행 실패 (code: ${code}): ${errorString}`));
+      }
+      try {
+        resolve(JSON.parse(dataString.trim()));
+      } catch (parseError) {
+        reject(new Error(`결과 파싱 실패: ${parseError.message}`));
+      }
+    });
+
+    pythonProcess.on('error', reject);
+
+    pythonProcess.stdin.write(JSON.stringify(payload), 'utf8');
+    pythonProcess.stdin.end();
+  });
+}
+
 // 아동 정보 삭제 (물리 삭제 + 관련 일지 정리)
 router.delete('/:childId', (req, res) => {
   try {
@@ -480,6 +526,10 @@ router.delete('/:childId', (req, res) => {
                 res.status(500).json({ success: false, message: '서버 오류가 발생했습니다.' })
               );
             }
+            // 벡터 임베딩 정리 (실패해도 아동 삭제는 성공으로 처리)
+            deleteChildVectorEmbeddings(childId)
+              .then((embeddingResult) => console.log('아동 일지 벡터 임베딩 삭제 결과:', embeddingResult.message))
+              .catch((embeddingError) => console.error('❌ 아동 일지 벡터 임베딩 삭제 중 오류:', embeddingError.message));
             return res
               .status(200)
               .json({ success: true, message: '아동 정보가 성공적으로 삭제되었습니다.' });
@@ -8,6 +8,7 @@ const fs = require('fs');
 const { spawn } = require('child_process');
 const axios = require('axios');
 const { normalizeGeminiModel, getGeminiRestEndpoint } = require('../services/modelFactory');
+const { callSearchEngine } = require('../services/searchEngineClient');
 const { MULTIMODAL_AGENT_DEFAULT_CONFIG, MULTIMODAL_AGENT_PROMPT } = require('../services/multimodalAgent');
 
 // multer 설정: uploads/diaries 폴더에 저장
@@ -45,6 +46,9 @@ try {
 
 // 벡터 임베딩 생성 함수
 async function generateVectorEmbedding(diaryData) {
+  const served = await callSearchEngine('upsert', diaryData);
+  if (served) return served;
+
   return new Promise((resolve, reject) => {
     const pythonScriptPath = path.join(__dirname, '..', 'search-engine-py', 'upsert_diary.py');
     
@@ -608,6 +612,9 @@ router.put('/:diaryId', async (req, res) => {
 
 // 벡터 임베딩 삭제 함수
 async function deleteVectorEmbedding(diaryId) {
+  const served = await callSearchEngine('delete', { diary_id: parseInt(diaryId) });
+  if (served) return served;
+
   return new Promise((resolve, reject) => {
     const pythonScriptPath = path.join(__dirname, '..', 'search-engine-py', 'delete_diary.py');
     
@@ -4,6 +4,7 @@ const axios = require('axios');
 const path = require('path');
 const { spawn } = require('child_process');
 const config = require('../config');
+const { callSearchEngine, pickSearchScope } = require('../services/searchEngineClient');
 
 let multerInstance = null;
 function getMulter() {
@@ -94,6 +95,9 @@ function buildSystemPromptFromSpec({ systemPrompt, spec }) {
 
 // 일반 RAG 검색을 위한 Python 스크립트 실행 함수 (search_diaries.py 재사용)
 async function runPythonSearchScript(queryData) {
+  const served = await callSearchEngine('search', queryData);
+  if (served) return served;
+
   return new Promise((resolve, reject) => {
     try {
       const scriptPath = path.join(__dirname, '..', 'search-engine-py', 'search_diaries.py');
@@ -261,7 +265,7 @@ router.post('/', async (req, res) => {
       if (queryForRag) {
         const limit = (req.body && typeof req.body.limit !== 'undefined') ? Number(req.body.limit) : 3;
         const score_threshold = (req.body && typeof req.body.score_threshold !== 'undefined') ? Number(req.body.score_threshold) : 0.0;
-        const searchResult = await runPythonSearchScript({ query: queryForRag, limit, score_threshold });
+        const searchResult = await runPythonSearchScript({ query: queryForRag, limit, score_threshold, ...pickSearchScope(req.body) });
         console.log('[RAG][question] query:', queryForRag, 'limit:', limit, 'threshold:', score_threshold);
         console.log('[RAG][question] raw result:', JSON.stringify(searchResult)?.slice(0, 500) + '...');
         if (searchResult?.success && Array.isArray(searchResult.results)) {
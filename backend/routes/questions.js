@@ -3,6 +3,7 @@ const router = express.Router();
 const db = require('../db'); // DB 연결 가져오기
 const { spawn } = require('child_process');
 const path = require('path');
+const { callSearchEngine } = require('../services/searchEngineClient');
 
 // 테스트 라우트
 router.get('/test', (req, res) => {
@@ -414,6 +415,17 @@ router.post('/kdst-rag', async (req, res) => {
       });
     }
     
+    // 상주형 검색 엔진 서버가 있으면 우선 사용
+    const served = await callSearchEngine('kdst', { questions, child_id: childId });
+    if (served) {
+      return res.status(200).json({
+        success: true,
+        childId: childId,
+        message: 'KDST RAG 검색 완료',
+        ragResult: served
+      });
+    }
+    
     // Python RAG 모듈 실행
     const pythonScriptPath = path.join(__dirname, '..', 'search-engine-py', 'kdst_rag_module.py');
     console.log('   - Python 스크립트 경로:', pythonScriptPath);
@@ -490,7 +502,7 @@ router.post('/kdst-rag', async (req, res) => {
     });
     
     // Python 프로세스에 질문 데이터 전송 (UTF-8 인코딩)
-    const inputData = JSON.stringify({ questions: questions });
+    const inputData = JSON.stringify({ questions: questions, child_id: childId });
     pythonProcess.stdin.write(inputData, 'utf8');
     pythonProcess.stdin.end();
     
@@ -535,6 +547,18 @@ router.post('/kdst-rag/single', async (req, res) => {
     // 단일 질문을 배열로 변환하여 기존 API 재사용
     req.body.questions = [question];
     
+    // 상주형 검색 엔진 서버가 있으면 우선 사용
+    const served = await callSearchEngine('kdst', { questions: [question], child_id: childId });
+    if (served) {
+      return res.status(200).json({
+        success: true,
+        childId: childId,
+        question: question,
+        message: '단일 KDST RAG 검색 완료',
+        result: served.results?.[0] || null
+      });
+    }
+    
     // 기존 RAG API 로직 재사용 (위의 코드와 동일)
     const pythonScriptPath = path.join(__dirname, '..', 'search-engine-py', 'kdst_rag_module.py');
     
@@ -599,7 +623,7 @@ router.post('/kdst-rag/single', async (req, res) => {
       }
     });
     
-    const inputData = JSON.stringify({ questions: [question] });
+    const inputData = JSON.stringify({ questions: [question], child_id: childId });
     pythonProcess.stdin.write(inputData, 'utf8');
     pythonProcess.stdin.end();
     
@@ -718,7 +742,8 @@ router.post('/kdst-rag/save-json', async (req, res) => {
     // Python 프로세스에 데이터 전송 (UTF-8 인코딩)
     const inputData = JSON.stringify({ 
       questions: questions,
-      output_filename: outputFilename 
+      output_filename: outputFilename,
+      child_id: childId
     });
     pythonProcess.stdin.write(inputData, 'utf8');
     pythonProcess.stdin.end();
@@ -4,9 +4,13 @@ const { runReportAgent, REPORT_OUTPUT_SCHEMA } = require('../services/reportAgen
 const path = require('path');
 const { spawn } = require('child_process');
 const config = require('../config');
+const { callSearchEngine, pickSearchScope } = require('../services/searchEngineClient');
 
 // KDST RAG 검색을 위한 Python 스크립트 실행 함수
-async function runKDSTRAGScript(questions) {
+async function runKDSTRAGScript(questions, scope = {}) {
+  const served = await callSearchEngine('kdst', { questions, ...scope });
+  if (served) return served;
+
   return new Promise((resolve, reject) => {
     try {
       const scriptPath = path.join(__dirname, '..', 'search-engine-py', 'kdst_rag_module.py');
@@ -45,8 +49,8 @@ async function runKDSTRAGScript(questions) {
         }
       });
 
-      // stdin으로 질문 전달
-      const inputData = JSON.stringify({ questions });
+      // stdin으로 질문 전달 (검색 범위 포함)
+      const inputData = JSON.stringify({ questions, ...scope });
       pythonProcess.stdin.write(inputData, 'utf8');
       pythonProcess.stdin.end();
     } catch (err) {
@@ -57,6 +61,9 @@ async function runKDSTRAGScript(questions) {
 
 // Python 검색 스크립트 실행 함수
 async function runPythonSearchScript(queryData) {
+  const served = await callSearchEngine('search', queryData);
+  if (served) return served;
+
   return new Promise((resolve, reject) => {
     const scriptPath = path.join(__dirname, '..', 'search-engine-py', 'search_diaries.py');
     
@@ -114,7 +121,10 @@ router.post('/rag-search', async (req, res) => {
     const searchResult = await runPythonSearchScript({
       query: query,
       limit: limit,
-      score_threshold: score_threshold
+      score_threshold: score_threshold,
+      mode: req.body.mode,  // dense | hybrid | prefilter (생략 시 dense)
+      timings: req.body.timings,  // true이면 단계별 소요 시간(ms) 포함
+      ...pickSearchScope(req.body)
     });
     console.log('[RAG][report] query:', query, 'limit:', limit, 'threshold:', score_threshold);
     console.log('[RAG][report] raw result:', JSON.stringify(searchResult)?.slice(0, 500) + '...');
@@ -125,6 +135,7 @@ router.post('/rag-search', async (req, res) => {
         query: query,
         results: searchResult.results,
         total_found: searchResult.total_found,
+        timings: searchResult.timings,
         message: `VectorDB에서 ${searchResult.total_found}개의 유사한 일기를 찾았습니다.`
       });
     } else {
@@ -175,7 +186,8 @@ router.post('/rag-report', async (req, res) => {
     const searchResult = await runPythonSearchScript({
       query: query,
       limit: limit,
-      score_threshold: score_threshold
+      score_threshold: score_threshold,
+      ...pickSearchScope(req.body)
     });
     console.log('[RAG][report] query:', query, 'limit:', limit, 'threshold:', score_threshold);
     console.log('[RAG][report] raw result:', JSON.stringify(searchResult)?.slice(0, 500) + '...');
@@ -260,7 +272,7 @@ router.post('/kdst-rag-search', async (req, res) => {
     console.log(`[${new Date().toISOString()}] KDST RAG 검색 요청: ${questions.length}개 문제`);
     
     // Python 스크립트 실행
-    const result = await runKDSTRAGScript(questions);
+    const result = await runKDSTRAGScript(questions, pickSearchScope(req.body));
     
     console.log(`[${new Date().toISOString()}] KDST RAG 검색 완료`);
     
@@ -295,7 +307,7 @@ router.post('/kdst-report-context', async (req, res) => {
     console.log(`[${new Date().toISOString()}] KDST 보고서 컨텍스트 생성 요청: ${questions.length}개 문제`);
     
     // Python 스크립트 실행
-    const result = await runKDSTRAGScript(questions);
+    const result = await runKDSTRAGScript(questions, pickSearchScope(req.body));
     
     if (result.success) {
       // 보고서 작성용 컨텍스트 생성
@@ -381,7 +393,7 @@ router.post('/kdst-generate-report', async (req, res) => {
     console.log(`[${new Date().toISOString()}] KDST 보고서 생성 요청: ${questions.length}개 문제`);
     
     // 1단계: KDST RAG 검색으로 컨텍스트 생성
-    const ragResult = await runKDSTRAGScript(questions);
+    const ragResult = await runKDSTRAGScript(questions, pickSearchScope(req.body));
     
     if (!ragResult.success) {
       return res.status(500).json({
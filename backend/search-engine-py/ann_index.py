@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+근사 최근접 이웃(ANN) 검색: NumPy 기반 IVF-flat 인덱스
+LiveVectorIndex의 행을 구면 k-means 중심점(list)별로 나누어 두고,
+쿼리와 가까운 n_probe개 list의 행만 정확히 채점합니다.
+
+- 업서트로 추가/갱신된 행은 가장 가까운 중심점에 바로 배정 (O(n_lists·dim))
+- 중심점은 my_local_qdrant_db/ann_ivf.npz에 저장하고, 불러올 때 모든 행을 다시 배정
+  (서버가 내려가 있는 동안 CLI로 바뀐 벡터도 올바른 list에 들어가도록)
+
+실행:
+  python ann_index.py build               # diary_embeddings.db로 학습 후 저장
+  python ann_index.py bench [--rows N]    # 정확 검색 대비 recall@k / 지연시간 측정 (JSON 출력)
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from request_timings import record_scan
+from vector_search import LiveVectorIndex, normalize_rows, top_k_indices
+from vector_store import EMBEDDING_DB_PATH, load_live_index
+
+ANN_INDEX_PATH = os.path.join(os.path.dirname(EMBEDDING_DB_PATH), 'ann_ivf.npz')
+
+# 학습에 사용할 최대 표본 수
+TRAIN_SAMPLE_SIZE = 50000
+
+
+def default_n_lists(n_rows):
+    return int(min(4096, max(1, round(np.sqrt(n_rows)))))
+
+
+def default_n_probe(n_lists):
+    return int(min(n_lists, max(8, n_lists // 10)))
+
+
+def spherical_kmeans(vectors, n_lists, iterations=10, seed=0):
+    """정규화된 벡터에 대한 구면 k-means (코사인 유사도 기준) 중심점"""
+    rng = np.random.default_rng(seed)
+    n_lists = min(n_lists, vectors.shape[0])
+    centroids = vectors[rng.choice(vectors.shape[0], n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_lists)
+        empty = counts == 0
+        if empty.any():
+            # 빈 list는 임의의 표본으로 다시 시작
+            sums[empty] = vectors[rng.choice(vectors.shape[0], int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFFlatIndex:
+    """LiveVectorIndex 위에 얹는 IVF-flat 후보 생성기"""
+
+    def __init__(self, base, centroids, n_probe=None):
+        self.base = base
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.n_probe = n_probe or default_n_probe(len(self.centroids))
+        self.assignment = np.full(0, -1, dtype=np.int32)
+        self._lists = [[] for _ in range(len(self.centroids))]
+        self._list_arrays = {}
+        # 갱신으로 list를 옮긴 행이 있으면 후보에 중복이 생길 수 있음
+        self._has_moves = False
+
+    @classmethod
+    def train(cls, base, n_lists=None, n_probe=None, iterations=10, seed=0):
+        """base의 살아 있는 행으로 중심점을 학습하고 모든 행을 배정"""
+        rows = np.flatnonzero(base._alive[:base._size])
+        if rows.size == 0:
+            raise ValueError("학습할 벡터가 없습니다.")
+        n_lists = n_lists or default_n_lists(rows.size)
+        rng = np.random.default_rng(seed)
+        sample = rows if rows.size <= TRAIN_SAMPLE_SIZE else rng.choice(rows, TRAIN_SAMPLE_SIZE, replace=False)
+        centroids = spherical_kmeans(base.matrix[sample], n_lists, iterations, seed)
+        index = cls(base, centroids, n_probe)
+        index.rebuild()
+        return index
+
+    def _nearest(self, vectors):
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def _ensure_assignment(self, size):
+        if self.assignment.shape[0] < size:
+            grown = np.full(max(size, self.assignment.shape[0] * 2, 64), -1, dtype=np.int32)
+            grown[:self.assignment.shape[0]] = self.assignment
+            self.assignment = grown
+
+    def _set_lists(self, assignment, rows):
+        self._lists = [[] for _ in range(len(self.centroids))]
+        for row, list_id in zip(rows.tolist(), assignment.tolist()):
+            self._lists[list_id].append(row)
+        self._list_arrays = {}
+        self._has_moves = False
+
+    def rebuild(self, batch_size=65536):
+        """모든 살아 있는 행을 가장 가까운 중심점에 다시 배정"""
+        size = self.base._size
+        self.assignment = np.full(max(size, 64), -1, dtype=np.int32)
+        rows = np.flatnonzero(self.base._alive[:size])
+        for start in range(0, rows.size, batch_size):
+            chunk = rows[start:start + batch_size]
+            self.assignment[chunk] = self._nearest(self.base.matrix[chunk])
+        self._set_lists(self.assignment[rows], rows)
+
+    def add(self, row):
+        """업서트된 한 행을 배정 (갱신이면 이전 list의 항목은 검색 시 걸러짐)"""
+        self._ensure_assignment(row + 1)
+        list_id = int(self._nearest(self.base.matrix[row:row + 1])[0])
+        if self.assignment[row] != list_id:
+            self._has_moves = self._has_moves or self.assignment[row] != -1
+            self.assignment[row] = list_id
+            self._lists[list_id].append(row)
+            self._list_arrays.pop(list_id, None)
+
+    def reindex(self, live_rows):
+        """LiveVectorIndex.compact() 이후 행 번호 재배치를 반영 (live_rows: 예전 행 번호, 새 순서)"""
+        assignment = self.assignment[live_rows]
+        self.assignment = np.full(max(live_rows.size, 64), -1, dtype=np.int32)
+        self.assignment[:live_rows.size] = assignment
+        self._set_lists(assignment, np.arange(live_rows.size))
+
+    def _list_rows(self, list_id):
+        rows = self._list_arrays.get(list_id)
+        if rows is None:
+            rows = np.asarray(self._lists[list_id], dtype=np.int64)
+            self._list_arrays[list_id] = rows
+        return rows
+
+    def candidates(self, query):
+        """정규화된 쿼리와 가까운 n_probe개 list의 살아 있는 행 번호"""
+        centroid_scores = self.centroids @ query
+        n_probe = min(self.n_probe, len(self.centroids))
+        if n_probe < len(self.centroids):
+            probe = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        else:
+            probe = np.arange(len(self.centroids))
+        rows = np.concatenate([self._list_rows(int(c)) for c in probe]) if len(probe) else np.zeros(0, np.int64)
+        if rows.size == 0:
+            return rows
+        # 갱신으로 다른 list로 옮겨간 행과 tombstone 행 제외
+        keep = np.isin(self.assignment[rows], probe) & self.base._alive[rows]
+        rows = rows[keep]
+        return np.unique(rows) if self._has_moves else rows
+
+    def search(self, query_vector, top_k, score_threshold=None):
+        query = normalize_rows(query_vector)[0]
+        rows = self.candidates(query)
+        record_scan(rows.size)
+        if rows.size == 0:
+            return []
+        scores = self.base._matrix[rows] @ query
+        hits = top_k_indices(scores, top_k, score_threshold)
+        return [(self.base.items[rows[i]], float(scores[i])) for i in hits]
+
+    def search_batch(self, query_vectors, top_k, score_threshold=None):
+        return [self.search(q, top_k, score_threshold) for q in normalize_rows(query_vectors)]
+
+    def save(self, path=ANN_INDEX_PATH):
+        """중심점을 원자적으로 저장"""
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, centroids=self.centroids, n_probe=self.n_probe)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, base, path=ANN_INDEX_PATH):
+        """저장된 중심점을 불러와 base의 모든 살아 있는 행을 현재 벡터 기준으로 배정"""
+        with np.load(path) as data:
+            index = cls(base, data['centroids'], int(data['n_probe']))
+        if index.centroids.shape[1] != base.dim:
+            raise ValueError("저장된 ANN 인덱스의 차원이 다릅니다.")
+        index.rebuild()
+        return index
+
+
+def synthetic_index(n_rows, dim=768, n_clusters=None, seed=0):
+    """군집 구조가 있는 합성 벡터로 LiveVectorIndex 생성 (벤치마크용)"""
+    rng = np.random.default_rng(seed)
+    n_clusters = n_clusters or max(1, n_rows // 100)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n_rows)
+    vectors = centers[labels] + rng.standard_normal((n_rows, dim)).astype(np.float32)
+    index = LiveVectorIndex(dim, capacity=n_rows)
+    for i, vec in enumerate(vectors):
+        index.upsert(i, vec, {'id': i})
+    return index, centers
+
+
+def benchmark(base, queries, top_k=10, probes=(1, 2, 4, 8, 16, 32, 64), n_lists=None):
+    """정확 검색 대비 n_probe별 recall@k와 쿼리당 지연시간(ms)"""
+    exact_ids = []
+    start = time.perf_counter()
+    for q in queries:
+        exact_ids.append({item['id'] for item, _ in base.search(q, top_k)})
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    start = time.perf_counter()
+    ivf = IVFFlatIndex.train(base, n_lists=n_lists)
+    train_s = time.perf_counter() - start
+
+    results = []
+    for n_probe in probes:
+        if n_probe > len(ivf.centroids):
+            break
+        ivf.n_probe = n_probe
+        hits = 0
+        start = time.perf_counter()
+        for q, truth in zip(queries, exact_ids):
+            hits += len(truth & {item['id'] for item, _ in ivf.search(q, top_k)})
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        results.append({
+            "n_probe": n_probe,
+            "recall_at_k": round(hits / max(1, sum(len(t) for t in exact_ids)), 4),
+            "latency_ms": round(elapsed_ms, 3),
+            "speedup": round(exact_ms / elapsed_ms, 2) if elapsed_ms else None
+        })
+    return {
+        "rows": len(base),
+        "dim": base.dim,
+        "top_k": top_k,
+        "n_lists": len(ivf.centroids),
+        "train_seconds": round(train_s, 3),
+        "exact_latency_ms": round(exact_ms, 3),
+        "ivf": results
+    }
+
+
+def main():
+    """메인 함수"""
+    parser = argparse.ArgumentParser(description='IVF-flat ANN 인덱스 학습/벤치마크')
+    parser.add_argument('command', choices=['build', 'bench'])
+    parser.add_argument('--rows', type=int, default=0, help='벤치마크용 합성 벡터 수 (0이면 diary_embeddings.db 사용)')
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--n-lists', type=int, default=None)
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'build':
+            base = load_live_index()
+            ivf = IVFFlatIndex.train(base, n_lists=args.n_lists)
+            ivf.save()
+            result = {
+                "success": True,
+                "message": "ANN 인덱스 저장 완료",
+                "rows": len(base),
+                "n_lists": len(ivf.centroids),
+                "n_probe": ivf.n_probe,
+                "path": ANN_INDEX_PATH
+            }
+        else:
+            rng = np.random.default_rng(1)
+            if args.rows:
+                base, centers = synthetic_index(args.rows, args.dim)
+                labels = rng.integers(0, len(centers), args.queries)
+                queries = centers[labels] + rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+            else:
+                base = load_live_index()
+                picks = rng.integers(0, base._size, args.queries)
+                queries = base.matrix[picks] + 0.05 * rng.standard_normal((args.queries, base.dim)).astype(np.float32)
+            result = {"success": True, **benchmark(base, queries, args.top_k, n_lists=args.n_lists)}
+    except Exception as e:
+        result = {"success": False, "message": f"ANN 인덱스 작업 실패: {str(e)}"}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+검색 엔진 벤치마크 (합성 한국어 일기 코퍼스)
+
+크기별(기본 1천/1만/10만 건)로 임시 디렉터리에 합성 일기 DB를 만들고 다음 항목을 측정합니다.
+- 데이터 로드 (전체 / 아이 한 명 범위)
+- 단일 검색 지연시간 (p50/p95)
+- KDST 40문항 배치 (DB 로드 포함 / 미리 로드한 인덱스 / 문항별 상위 일기 목록 생성과 읽기)
+- 업서트, 삭제 처리량 (배치 / 한 건씩)
+- 최대 RSS
+
+임베딩 모델 대신 텍스트의 문자 bigram 해시로 고정 벡터를 만드는 스텁 인코더를 사용하므로
+네트워크/모델 다운로드 없이 실행되고, 같은 시드면 같은 코퍼스와 벡터가 만들어집니다.
+(모델 추론 시간은 포함되지 않음, 인코딩 성능은 encode_scheduler.py bench / onnx_backend.py parity로 확인)
+
+크기마다 별도 프로세스(VECTOR_DB_DIR=임시 디렉터리, 쿼리/결과 캐시 비활성화)에서 실행하므로
+실제 DB는 건드리지 않으며, EMBEDDING_QUANTIZATION 같은 설정은 환경 변수로 그대로 전달됩니다.
+
+실행:
+  python benchmark.py                                       # 1000,10000,100000
+  python benchmark.py --sizes 1000,10000 --output before.json
+  python benchmark.py compare before.json after.json        # 항목별 변화율 (허용 범위를 넘게 나빠지면 종료 코드 1)
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from datetime import date, datetime, timedelta
+
+DEFAULT_SIZES = '1000,10000,100000'
+STUB_DIM = 768
+STUB_BUCKETS = 4096
+CHILDREN = 50
+
+# 결과 JSON에 함께 기록하는 설정
+RECORDED_ENV = (
+    'EMBEDDING_QUANTIZATION', 'EMBEDDING_RERANK_FACTOR', 'SEARCH_ENGINE_ANN',
+    'CHUNK_MAX_TOKENS', 'CHUNK_AGGREGATION', 'LEXICAL_CANDIDATES'
+)
+
+_MOMENTS = ['아침에', '오전에', '점심 먹고', '낮잠 자고 일어나서', '오후에', '저녁에', '잠들기 전에', '목욕하면서']
+_ACTIVITIES = [
+    '블록을 높이 쌓았어요', '그림책을 끝까지 봤어요', '놀이터에서 미끄럼틀을 탔어요', '공을 굴리며 놀았어요',
+    '처음으로 혼자 숟가락을 썼어요', '엄마 손을 잡고 걸었어요', '크레파스로 동그라미를 그렸어요',
+    '노래에 맞춰 춤을 췄어요', '퍼즐 세 조각을 맞췄어요', '이유식을 남김없이 먹었어요',
+    '친구에게 장난감을 양보했어요', '계단을 한 칸씩 올라갔어요', '뒤집기를 여러 번 했어요',
+    '"아빠"라고 또렷하게 말했어요', '컵으로 물을 마셨어요', '모래놀이를 하며 한참 놀았어요'
+]
+_FEELINGS = [
+    '기분이 아주 좋아 보였어요.', '많이 웃었어요.', '조금 칭얼거렸어요.', '피곤했는지 일찍 잠들었어요.',
+    '낯선 사람을 보고 울었어요.', '집중해서 오래 놀았어요.', '밤에 두 번 깼어요.', '밥투정을 했어요.'
+]
+_NOTES = [
+    '', '', '요즘 말이 부쩍 늘었어요.', '감기 기운이 있어 병원에 다녀왔어요.', '할머니 댁에 놀러 갔어요.',
+    '어린이집 선생님이 칭찬해 주셨어요.', '새 신발을 신고 신나 했어요.', '이가 새로 나려는지 자꾸 깨물어요.'
+]
+
+_QUESTION_DOMAINS = ['대근육운동', '소근육운동', '인지', '언어', '사회성', '자조']
+_QUESTION_SKILLS = [
+    '혼자서 계단을 오를 수 있나요?', '두 단어를 이어서 말할 수 있나요?', '블록을 세 개 이상 쌓을 수 있나요?',
+    '숟가락으로 음식을 떠먹을 수 있나요?', '다른 아이에게 관심을 보이나요?', '그림책의 그림을 손가락으로 가리키나요?',
+    '공을 앞으로 찰 수 있나요?', '크레파스로 선을 그을 수 있나요?', '간단한 심부름을 할 수 있나요?',
+    '이름을 부르면 돌아보나요?'
+]
+_QUERIES = [
+    '밤에 자주 깨요', '블록 놀이', '처음으로 말한 단어', '놀이터에서 놀았던 날', '밥을 잘 안 먹어요',
+    '친구와 장난감', '감기 걸려서 병원', '그림 그리기', '계단 오르기', '할머니 댁'
+]
+
+
+class StubEncoder:
+    """문자 bigram 해시 버킷 벡터의 합 (고정 시드). 단어가 겹치는 텍스트끼리 유사도가 높음"""
+
+    def __init__(self, dim=STUB_DIM, seed=0):
+        import numpy as np
+        from lexical_index import tokenize
+
+        self._np = np
+        self._tokenize = tokenize
+        self.table = np.random.default_rng(seed).standard_normal((STUB_BUCKETS, dim)).astype(np.float32)
+
+    def _vector(self, text):
+        buckets = [zlib.crc32(term.encode('utf-8')) % STUB_BUCKETS for term in self._tokenize(text)]
+        if not buckets:
+            buckets = [zlib.crc32(text.encode('utf-8')) % STUB_BUCKETS]
+        return self.table[buckets].sum(axis=0)
+
+    def encode(self, texts, batch_size=None):
+        if isinstance(texts, str):
+            return self._vector(texts)
+        return self._np.vstack([self._vector(text) for text in texts]) if texts else self.table[:0]
+
+
+def synthetic_diaries(count, start_id=1, seed=0):
+    """고정 시드 합성 일기 목록 (upsert_diary 입력 형식)"""
+    import random
+
+    rng = random.Random(seed)
+    diaries = []
+    for offset in range(count):
+        diary_id = start_id + offset
+        child_id = diary_id % CHILDREN + 1
+        sentences = [f"{rng.choice(_MOMENTS)} {rng.choice(_ACTIVITIES)}" for _ in range(rng.randint(1, 3))]
+        sentences.append(rng.choice(_FEELINGS))
+        note = rng.choice(_NOTES)
+        if note:
+            sentences.append(note)
+        diaries.append({
+            'id': diary_id,
+            'child_id': child_id,
+            'parent_id': (child_id + 1) // 2,
+            'date': (date(2024, 1, 1) + timedelta(days=rng.randrange(730))).isoformat(),
+            'content': ' '.join(sentences)
+        })
+    return diaries
+
+
+def kdst_questions(count=40):
+    return [
+        f"[{_QUESTION_DOMAINS[i % len(_QUESTION_DOMAINS)]}] {_QUESTION_SKILLS[i % len(_QUESTION_SKILLS)]}"
+        + (f" ({i // len(_QUESTION_SKILLS) + 1})" if i >= len(_QUESTION_SKILLS) else '')
+        for i in range(count)
+    ]
+
+
+def populate(diaries, encoder, batch_size=5000):
+    """합성 일기를 diary_embeddings.db에 한 번에 기록 (임베딩 포함)"""
+    from sqlite_pool import transaction
+    from upsert_diary import compose_diary_text
+    from vector_store import EMBEDDING_DB_PATH, encode_embedding, text_hash
+
+    with transaction(EMBEDDING_DB_PATH) as conn:
+        for start in range(0, len(diaries), batch_size):
+            batch = diaries[start:start + batch_size]
+            texts = [compose_diary_text(d) for d in batch]
+            vectors = encoder.encode(texts)
+            conn.executemany(
+                'INSERT INTO diary_embeddings (diary_id, text, embedding, date, parent_id, child_id, text_hash) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(d['id'], text, encode_embedding(vector), d['date'], d['parent_id'], d['child_id'], text_hash(text))
+                 for d, text, vector in zip(batch, texts, vectors)]
+            )
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - start) * 1000.0, result
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = min(len(ordered) - 1, max(0, int(round(q / 100.0 * (len(ordered) - 1)))))
+    return ordered[position]
+
+
+def latency_summary(values):
+    return {
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'mean_ms': round(sum(values) / len(values), 3),
+        'runs': len(values)
+    }
+
+
+def peak_rss_mb():
+    """프로세스 최대 RSS (MB, resource 모듈이 없는 Windows에서는 None)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux는 KB, macOS는 바이트 단위
+    return round(peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0), 1)
+
+
+def run_worker(rows, seed, queries, repeat, writes, hybrid):
+    """현재 프로세스(VECTOR_DB_DIR이 임시 디렉터리)에서 한 크기를 측정"""
+    import embedding_model
+    import kdst_topk
+    from delete_diary import delete_diary_embedding, delete_diary_embeddings
+    from kdst_rag_module import _process_kdst_questions, load_diary_embeddings, materialized_kdst_result
+    from search_diaries import build_search_index, load_search_data, search_similar_diaries
+    from upsert_diary import upsert_diaries, upsert_diary
+
+    encoder = StubEncoder(seed=seed)
+    embedding_model.set_encoder(encoder)
+    result = {'rows': rows}
+
+    populate_ms, _ = timed(lambda: populate(synthetic_diaries(rows, seed=seed), encoder))
+    result['populate_ms'] = round(populate_ms, 1)
+
+    scope = {'child_id': 1}
+    result['load_ms'] = latency_summary([timed(lambda: load_search_data(None))[0] for _ in range(repeat)])
+    result['load_child_ms'] = latency_summary([timed(lambda: load_search_data(scope))[0] for _ in range(repeat)])
+
+    index = build_search_index(load_search_data(None))
+    query_texts = [_QUERIES[i % len(_QUERIES)] + ('' if i < len(_QUERIES) else f" {i}") for i in range(queries)]
+    modes = ['dense', 'hybrid'] if hybrid else ['dense']
+    if hybrid:
+        from lexical_index import sync_lexical_index
+        from vector_store import EMBEDDING_DB_PATH
+
+        result['lexical_index_build_ms'] = round(timed(lambda: sync_lexical_index(EMBEDDING_DB_PATH))[0], 1)
+    for mode in modes:
+        latencies = []
+        for query in query_texts:
+            elapsed, response = timed(lambda: search_similar_diaries(None, index, query, 5, 0.0, mode))
+            if not response.get('success'):
+                raise RuntimeError(f"검색 실패: {response}")
+            latencies.append(elapsed)
+        result[f'search_{mode}_ms'] = latency_summary(latencies)
+
+    questions = kdst_questions(40)
+    result['kdst_40_ms'] = latency_summary(
+        [timed(lambda: _process_kdst_questions(questions, None, None, None))[0] for _ in range(repeat)]
+    )
+    embeddings, info = load_diary_embeddings(None)
+    result['kdst_40_preloaded_ms'] = latency_summary(
+        [timed(lambda: _process_kdst_questions(questions, embeddings, info, None))[0] for _ in range(repeat)]
+    )
+    result['kdst_40_child_ms'] = latency_summary(
+        [timed(lambda: _process_kdst_questions(questions, None, None, scope))[0] for _ in range(repeat)]
+    )
+    # 문항별 상위 일기 목록 (처음 한 번 생성, 이후 읽기만). 아래 업서트/삭제 처리량에는 목록 갱신 비용이 포함됨
+    if kdst_topk.KDST_TOPK_ENABLED:
+        result['kdst_topk_build_ms'] = round(timed(lambda: materialized_kdst_result(questions, None))[0], 1)
+        result['kdst_topk_build_child_ms'] = round(timed(lambda: materialized_kdst_result(questions, scope))[0], 1)
+        result['kdst_40_materialized_ms'] = latency_summary(
+            [timed(lambda: materialized_kdst_result(questions, None))[0] for _ in range(repeat)]
+        )
+        result['kdst_40_materialized_child_ms'] = latency_summary(
+            [timed(lambda: materialized_kdst_result(questions, scope))[0] for _ in range(repeat)]
+        )
+
+    batch = synthetic_diaries(writes, start_id=rows + 1, seed=seed + 1)
+    singles = synthetic_diaries(writes, start_id=rows + writes + 1, seed=seed + 2)
+    batch_ms, responses = timed(lambda: upsert_diaries(batch))
+    single_ms, single_responses = timed(lambda: [upsert_diary(d) for d in singles])
+    failed = [r for r in responses + single_responses if not r.get('success')]
+    if failed:
+        raise RuntimeError(f"업서트 실패: {failed[0]}")
+    delete_batch_ms, deleted = timed(lambda: delete_diary_embeddings([d['id'] for d in batch]))
+    delete_ms, single_deleted = timed(lambda: [delete_diary_embedding(d['id']) for d in singles])
+    if not all(r.get('success') for r in deleted + single_deleted):
+        raise RuntimeError("삭제 실패")
+    result['upsert_batch_per_sec'] = round(writes / (batch_ms / 1000.0), 1)
+    result['upsert_single_per_sec'] = round(writes / (single_ms / 1000.0), 1)
+    result['delete_batch_per_sec'] = round(writes / (delete_batch_ms / 1000.0), 1)
+    result['delete_per_sec'] = round(writes / (delete_ms / 1000.0), 1)
+
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_size(rows, args):
+    """크기 하나를 별도 프로세스에서 측정 (모듈이 import 시점에 읽는 VECTOR_DB_DIR 등을 새로 적용)"""
+    workdir = tempfile.mkdtemp(prefix=f'diary-bench-{rows}-')
+    env = dict(os.environ, VECTOR_DB_DIR=workdir, QUERY_CACHE_PERSIST='0', RESULT_CACHE='0')
+    command = [
+        sys.executable, os.path.abspath(__file__), 'worker', '--rows', str(rows), '--seed', str(args.seed),
+        '--queries', str(args.queries), '--repeat', str(args.repeat), '--writes', str(args.writes)
+    ] + (['--hybrid'] if args.hybrid else [])
+    try:
+        completed = subprocess.run(command, env=env, capture_output=True, text=True, encoding='utf-8')
+        if completed.returncode != 0:
+            return {'rows': rows, 'error': completed.stderr.strip()[-2000:]}
+        return json.loads(completed.stdout)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_metadata(args):
+    import numpy as np
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': args.seed,
+        'queries': args.queries,
+        'repeat': args.repeat,
+        'writes': args.writes,
+        'env': {name: os.environ[name] for name in RECORDED_ENV if name in os.environ}
+    }
+
+
+def flatten_metrics(result):
+    """{(행 수, 항목): 값} (지연시간은 p50/p95만 비교)"""
+    metrics = {}
+    for size in result.get('sizes', []):
+        for name, value in size.items():
+            if isinstance(value, dict):
+                for key in ('p50_ms', 'p95_ms'):
+                    if key in value:
+                        metrics[(size['rows'], f'{name}.{key}')] = value[key]
+            elif isinstance(value, (int, float)) and name != 'rows':
+                metrics[(size['rows'], name)] = value
+    return metrics
+
+
+def compare(old, new, tolerance):
+    """두 결과의 공통 항목 변화율. 처리량(_per_sec)은 클수록, 나머지는 작을수록 좋음"""
+    old_metrics, new_metrics = flatten_metrics(old), flatten_metrics(new)
+    rows = []
+    for key in sorted(old_metrics.keys() & new_metrics.keys()):
+        before, after = old_metrics[key], new_metrics[key]
+        change = (after - before) / before * 100.0 if before else 0.0
+        worse = -change if key[1].endswith('_per_sec') else change
+        rows.append({
+            'rows': key[0],
+            'metric': key[1],
+            'old': before,
+            'new': after,
+            'change_pct': round(change, 1),
+            'regression': worse > tolerance
+        })
+    return rows
+
+
+def main():
+    """메인 함수"""
+    parser = argparse.ArgumentParser(description='합성 일기 코퍼스로 검색 엔진 성능 측정')
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'compare', 'worker'])
+    parser.add_argument('files', nargs='*', help='compare: 이전 결과 JSON, 새 결과 JSON')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='일기 수 목록 (쉼표 구분)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=50, help='단일 검색 측정 횟수')
+    parser.add_argument('--repeat', type=int, default=3, help='로드/KDST 반복 횟수')
+    parser.add_argument('--writes', type=int, default=200, help='업서트/삭제 방식별 일기 수')
+    parser.add_argument('--hybrid', action='store_true', help='BM25 색인 생성과 hybrid 검색도 측정')
+    parser.add_argument('--output', help='결과 JSON 파일 (없으면 stdout만)')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='compare: 허용 악화 비율(%%)')
+    parser.add_argument('--rows', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        print(json.dumps(run_worker(args.rows, args.seed, args.queries, args.repeat, args.writes, args.hybrid)))
+        return
+
+    if args.command == 'compare':
+        if len(args.files) != 2:
+            parser.error('compare에는 결과 파일 두 개가 필요합니다')
+        with open(args.files[0], encoding='utf-8') as f_old, open(args.files[1], encoding='utf-8') as f_new:
+            rows = compare(json.load(f_old), json.load(f_new), args.tolerance)
+        regressions = [row for row in rows if row['regression']]
+        print(json.dumps({
+            'success': not regressions,
+            'tolerance_pct': args.tolerance,
+            'regressions': len(regressions),
+            'metrics': rows
+        }, ensure_ascii=False, indent=2))
+        sys.exit(1 if regressions else 0)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    result = {'metadata': run_metadata(args), 'sizes': []}
+    for rows in sizes:
+        print(f"{rows}건 측정 중...", file=sys.stderr)
+        result['sizes'].append(run_size(rows, args))
+    result['success'] = not any('error' in size for size in result['sizes'])
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+    if not result['success']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,45 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+"""
+기존 일기(MySQL parent_diaries)를 벡터 임베딩으로 변환하는 백필 스크립트
+
+- id 기준 keyset 페이지네이션으로 배치 단위 조회 (전체를 메모리에 올리지 않음)
+- 배치마다 model.encode 한 번 (긴 일기는 청크로 나눠 같은 배치에서 인코딩), executemany 저장, 쓰기 트랜잭션(BEGIN IMMEDIATE) 커밋
+- backfill_checkpoints 테이블에 마지막 id를 기록하여 중단 후 이어서 실행
+- 배치 인코딩이 실패하면 체크포인트를 넘기지 않고 중단하며, 실패한 일기 ID를 결과의 failed_ids로 반환
+  (다시 실행하면 그 배치부터 이어서 변환, 부분 변환이면 --ids로 재시도)
+
+실행:
+  python convert_existing_diaries.py                    # 체크포인트부터 이어서 전체 변환
+  python convert_existing_diaries.py --restart          # 처음부터 다시
+  python convert_existing_diaries.py --since 2025-08-01 # 해당 날짜 이후 작성된 일기만
+  python convert_existing_diaries.py --ids 12,15,20     # 지정한 일기만
+"""
+
+import startup_profile
+import argparse
 import json
 import sys
-import numpy as np
-from sentence_transformers import SentenceTransformer
-import sqlite3
+import time
 import os
 import mysql.connector
 from dotenv import load_dotenv
+import vector_segments
+import kdst_topk
+from result_cache import bump_generations
+from lexical_index import index_documents
+from diary_chunks import embed_texts, replace_chunks
+from vector_store import EMBEDDING_DB_PATH, encode_embedding, text_hash
+from sqlite_pool import transaction
+
+startup_profile.mark_imports_done()
 
 # 환경변수 로드
 load_dotenv('../.env.local')
 
-# 모델 로드
-model = SentenceTransformer('BM-K/KoSimCSE-roberta-multitask')
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_JOB_NAME = 'convert_existing_diaries'
 
 def get_mysql_connection():
     """MySQL 연결"""
@@ -30,95 +55,190 @@ def get_mysql_connection():
         print(f"MySQL 연결 실패: {e}", file=sys.stderr)
         return None
 
-def get_embedding(text):
-    """텍스트를 벡터로 변환"""
+def get_embeddings(texts, batch_size=DEFAULT_BATCH_SIZE):
+    """여러 텍스트를 한 번의 배치 인코딩으로 변환 → [(일기 벡터, [(청크 텍스트, 청크 벡터), ...]), ...]"""
     try:
-        embedding = model.encode(text)
-        return embedding.tolist()
+        return embed_texts(texts, batch_size)
     except Exception as e:
         print(f"임베딩 생성 실패: {e}", file=sys.stderr)
         return None
 
-def convert_existing_diaries():
-    """기존 일기들을 벡터 임베딩으로 변환"""
+def ensure_checkpoint_table(cursor):
+    """백필 체크포인트 테이블 준비"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+            job_name TEXT PRIMARY KEY,
+            last_id INTEGER,
+            converted INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def load_checkpoint(cursor, job_name):
+    cursor.execute('SELECT last_id, converted, failed FROM backfill_checkpoints WHERE job_name = ?', (job_name,))
+    row = cursor.fetchone()
+    return row if row else (0, 0, 0)
+
+def iter_diary_batches(mysql_conn, batch_size, after_id=0, since=None, ids=None):
+    """parent_diaries를 id 기준 keyset 페이지네이션으로 배치 단위 조회"""
+    cursor = mysql_conn.cursor(dictionary=True)
+    try:
+        if ids:
+            ids = sorted(set(ids))
+            for start in range(0, len(ids), batch_size):
+                chunk = ids[start:start + batch_size]
+                placeholders = ','.join(['%s'] * len(chunk))
+                cursor.execute(
+                    f'SELECT id, user_id, title, content, mood, created_at FROM parent_diaries WHERE id IN ({placeholders}) ORDER BY id',
+                    chunk
+                )
+                rows = cursor.fetchall()
+                if rows:
+                    yield rows
+            return
+
+        last_id = after_id
+        while True:
+            query = 'SELECT id, user_id, title, content, mood, created_at FROM parent_diaries WHERE id > %s'
+            params = [last_id]
+            if since:
+                query += ' AND created_at >= %s'
+                params.append(since)
+            query += ' ORDER BY id LIMIT %s'
+            params.append(batch_size)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1]['id']
+    finally:
+        cursor.close()
+
+def convert_existing_diaries(batch_size=DEFAULT_BATCH_SIZE, since=None, ids=None,
+                             job_name=DEFAULT_JOB_NAME, restart=False):
+    """기존 일기들을 벡터 임베딩으로 변환 (배치/체크포인트 기반)
+
+    since나 ids를 지정한 부분 변환은 체크포인트를 사용하지 않습니다.
+    """
     try:
         # MySQL 연결
         mysql_conn = get_mysql_connection()
         if not mysql_conn:
             return {"success": False, "message": "MySQL 연결 실패"}
         
-        cursor = mysql_conn.cursor(dictionary=True)
-        
-        # 기존 일기들 조회
-        cursor.execute('SELECT id, user_id, title, content, mood, created_at FROM parent_diaries ORDER BY id')
-        diaries = cursor.fetchall()
-        
-        if not diaries:
-            return {"success": False, "message": "변환할 일기가 없습니다."}
-        
-        print(f"총 {len(diaries)}개의 일기를 벡터 임베딩으로 변환합니다...")
-        
         # 벡터 DB 준비
-        db_path = os.path.join(os.path.dirname(__file__), 'my_local_qdrant_db', 'diary_embeddings.db')
+        db_path = EMBEDDING_DB_PATH
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         
-        vector_conn = sqlite3.connect(db_path)
-        vector_cursor = vector_conn.cursor()
-        
-        # 벡터 DB 테이블 생성
-        vector_cursor.execute('''
-            CREATE TABLE IF NOT EXISTS diary_embeddings (
-                id INTEGER PRIMARY KEY,
-                diary_id INTEGER UNIQUE,
-                text TEXT,
-                embedding BLOB,
-                date TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        use_checkpoint = not since and not ids
+        after_id, converted_count, failed_count = 0, 0, 0
+        with transaction(db_path) as vector_conn:
+            vector_cursor = vector_conn.cursor()
+            # 벡터 DB 테이블/인덱스는 연결을 열 때 준비됨, 체크포인트 테이블만 생성
+            ensure_checkpoint_table(vector_cursor)
+            if use_checkpoint:
+                if restart:
+                    vector_cursor.execute('DELETE FROM backfill_checkpoints WHERE job_name = ?', (job_name,))
+                after_id, converted_count, failed_count = load_checkpoint(vector_cursor, job_name)
+        if after_id:
+            print(f"체크포인트에서 이어서 변환합니다 (마지막 일기 ID: {after_id})")
         
-        converted_count = 0
-        failed_count = 0
+        started = time.perf_counter()
+        processed = 0
         
-        for diary in diaries:
-            try:
-                # 텍스트 준비 (제목 + 내용)
-                text = f"{diary.get('title', '')} {diary.get('content', '')}".strip()
+        for diaries in iter_diary_batches(mysql_conn, batch_size, after_id, since, ids):
+            # 텍스트 준비 (제목 + 내용)
+            batch = []
+            for diary in diaries:
+                text = f"{diary.get('title') or ''} {diary.get('content') or ''}".strip()
                 if not text:
                     print(f"일기 ID {diary['id']}: 텍스트가 비어있음")
                     failed_count += 1
                     continue
-                
-                # 벡터 임베딩 생성
-                embedding = get_embedding(text)
-                if embedding is None:
-                    print(f"일기 ID {diary['id']}: 임베딩 생성 실패")
-                    failed_count += 1
-                    continue
-                
-                # 벡터 DB에 저장
-                vector_cursor.execute('''
-                    INSERT OR REPLACE INTO diary_embeddings (diary_id, text, embedding, date)
-                    VALUES (?, ?, ?, ?)
-                ''', (diary['id'], text, json.dumps(embedding), str(diary['created_at'])[:10]))
-                
-                converted_count += 1
-                print(f"일기 ID {diary['id']}: 변환 완료 (텍스트 길이: {len(text)}, 임베딩 차원: {len(embedding)})")
-                
-            except Exception as e:
-                print(f"일기 ID {diary['id']}: 변환 실패 - {e}")
-                failed_count += 1
+                batch.append((diary, text))
+            
+            # 배치 단위 벡터 임베딩 생성
+            rows = []
+            chunk_rows = []
+            vectors = []
+            if batch:
+                embeddings = get_embeddings([text for _, text in batch], batch_size)
+                if embeddings is None:
+                    # 체크포인트를 이 배치 앞에 남겨 두고 중단 (다시 실행하면 이 배치부터 이어서 변환)
+                    failed_ids = [diary['id'] for diary, _ in batch]
+                    print(f"일기 ID {failed_ids[0]}~{failed_ids[-1]}: 임베딩 생성 실패, 변환을 중단합니다")
+                    mysql_conn.close()
+                    return {
+                        "success": False,
+                        "message": f"일기 ID {failed_ids[0]}~{failed_ids[-1]} 임베딩 생성 실패로 변환 중단",
+                        "processed": processed,
+                        "converted": converted_count,
+                        "failed": failed_count,
+                        "failed_ids": failed_ids
+                    }
+                rows = [
+                    (diary['id'], text, encode_embedding(embedding), str(diary['created_at'])[:10], text_hash(text))
+                    for (diary, text), (embedding, _) in zip(batch, embeddings)
+                ]
+                chunk_rows = [
+                    (diary['id'], [(chunk, encode_embedding(vec)) for chunk, vec in chunks])
+                    for (diary, _), (_, chunks) in zip(batch, embeddings)
+                ]
+                vectors = [(diary['id'], embedding) for (diary, _), (embedding, _) in zip(batch, embeddings)]
+            
+            # 배치 단위 저장 + 체크포인트 갱신을 한 쓰기 트랜잭션으로 (메모리 맵 세그먼트는 커밋 직전에 덧붙임)
+            with vector_segments.write_transaction(db_path, compact_if_needed=True) as (vector_conn, segment_entries):
+                vector_cursor = vector_conn.cursor()
+                vector_cursor.executemany('''
+                    INSERT INTO diary_embeddings (diary_id, text, embedding, date, text_hash)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(diary_id) DO UPDATE SET
+                        text = excluded.text,
+                        embedding = excluded.embedding,
+                        date = excluded.date,
+                        text_hash = excluded.text_hash,
+                        created_at = CURRENT_TIMESTAMP
+                ''', rows)
+                # 여러 아이의 일기가 바뀌므로 검색 결과 캐시 전체 무효화
+                if rows:
+                    bump_generations(vector_cursor, epoch=True)
+                    # KDST 문항별 목록은 일기별로 갱신하지 않으므로 버림 (다음 보고서 조회 때 다시 계산)
+                    kdst_topk.invalidate(vector_cursor)
+                    index_documents(vector_cursor, [(row[0], row[1]) for row in rows])
+                    for diary_id, chunks in chunk_rows:
+                        replace_chunks(vector_cursor, diary_id, chunks)
+                    segment_entries.extend(vectors)
+                if use_checkpoint:
+                    vector_cursor.execute('''
+                        INSERT INTO backfill_checkpoints (job_name, last_id, converted, failed)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT(job_name) DO UPDATE SET
+                            last_id = excluded.last_id,
+                            converted = excluded.converted,
+                            failed = excluded.failed,
+                            updated_at = CURRENT_TIMESTAMP
+                    ''', (job_name, diaries[-1]['id'], converted_count + len(rows), failed_count))
+            # 커밋된 뒤에만 변환 수에 반영
+            converted_count += len(rows)
+            
+            processed += len(diaries)
+            elapsed = time.perf_counter() - started
+            rate = processed / elapsed if elapsed > 0 else 0.0
+            print(f"일기 ID {diaries[-1]['id']}까지 변환 완료: {processed}개 처리 ({rate:.1f} rows/s)", flush=True)
         
-        vector_conn.commit()
-        vector_conn.close()
         mysql_conn.close()
         
+        elapsed = time.perf_counter() - started
         return {
             "success": True,
             "message": f"벡터 임베딩 변환 완료",
-            "total_diaries": len(diaries),
+            "processed": processed,
             "converted": converted_count,
-            "failed": failed_count
+            "failed": failed_count,
+            "elapsed_seconds": round(elapsed, 2),
+            "rows_per_second": round(processed / elapsed, 2) if elapsed > 0 else None
         }
         
     except Exception as e:
@@ -126,12 +246,22 @@ def convert_existing_diaries():
 
 def main():
     """메인 함수"""
+    parser = argparse.ArgumentParser(description='기존 일기 벡터 임베딩 백필')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--since', help='이 날짜(created_at) 이후 작성된 일기만 변환 (예: 2025-08-01)')
+    parser.add_argument('--ids', help='쉼표로 구분한 일기 ID 목록만 변환')
+    parser.add_argument('--job', default=DEFAULT_JOB_NAME, help='체크포인트 작업 이름')
+    parser.add_argument('--restart', action='store_true', help='체크포인트를 무시하고 처음부터 변환')
+    parser.add_argument('--profile-startup', action='store_true', help='모듈 import/모델 로드 시간 보고서를 결과에 포함')
+    args = parser.parse_args()
+    
     try:
+        ids = [int(x) for x in args.ids.split(',') if x.strip()] if args.ids else None
         print("기존 일기들을 벡터 임베딩으로 변환을 시작합니다...")
-        result = convert_existing_diaries()
+        result = convert_existing_diaries(args.batch_size, args.since, ids, args.job, args.restart)
         
         # 결과 출력
-        print(json.dumps(result, ensure_ascii=False, indent=2))
+        print(json.dumps(startup_profile.attach(result), ensure_ascii=False, indent=2))
         
     except Exception as e:
         print(json.dumps({"success": False, "message": f"예상치 못한 오류: {str(e)}"}))
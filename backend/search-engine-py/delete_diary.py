@@ -3,8 +3,15 @@
 
 import json
 import sys
-import sqlite3
 import os
+import request_timings
+import vector_segments
+import kdst_topk
+from result_cache import bump_generations
+from lexical_index import remove_document
+from diary_chunks import remove_chunks
+from ndjson_stream import STREAM_MODE, run_stream
+from sqlite_pool import DEFAULT_DB_PATH
 
 # UTF-8 인코딩 설정 (Windows 환경 대응)
 if sys.platform.startswith('win'):
@@ -14,45 +21,130 @@ if sys.platform.startswith('win'):
     # stdin도 UTF-8로 설정
     sys.stdin = codecs.getreader('utf-8')(sys.stdin.detach())
 
-def delete_diary_embedding(diary_id):
-    """벡터 DB에서 일기 임베딩을 삭제"""
+# 범위 삭제에 쓸 수 있는 키 (아이/부모 단위 정리)
+DELETE_SCOPE_KEYS = ('child_id', 'parent_id')
+
+def delete_diary_embeddings(diary_ids=(), scope=None):
+    """여러 일기 임베딩을 한 트랜잭션으로 삭제 → 일기별 결과 목록
+
+    diary_ids를 주면 입력 순서대로 결과를 반환하고 (없는 ID는 실패),
+    scope({'child_id': 5} / {'parent_id': 3})를 주면 범위의 일기를 모두 삭제하고 삭제한 일기마다 결과를 반환합니다.
+    """
+    with request_timings.span('write'):
+        return _delete_diary_embeddings(list(diary_ids), scope)
+
+def _delete_diary_embeddings(diary_ids, scope):
+    if not os.path.exists(DEFAULT_DB_PATH):
+        failure = {"success": False, "message": "벡터 DB가 존재하지 않습니다."}
+        return [dict(failure, diary_id=diary_id) for diary_id in diary_ids]
+    
+    results = []
     try:
-        # SQLite DB에서 삭제
-        db_path = os.path.join(os.path.dirname(__file__), 'my_local_qdrant_db', 'diary_embeddings.db')
-        
-        if not os.path.exists(db_path):
-            return {"success": False, "message": "벡터 DB가 존재하지 않습니다."}
-        
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # 기존 데이터 확인
-        cursor.execute('SELECT id FROM diary_embeddings WHERE diary_id = ?', (diary_id,))
-        existing = cursor.fetchone()
-        
-        if not existing:
-            conn.close()
-            return {"success": False, "message": f"일기 ID {diary_id}에 대한 벡터 임베딩을 찾을 수 없습니다."}
-        
-        # 삭제 실행
-        cursor.execute('DELETE FROM diary_embeddings WHERE diary_id = ?', (diary_id,))
-        deleted_rows = cursor.rowcount
-        
-        conn.commit()
-        conn.close()
+        # 세그먼트 삭제 표시는 segment_entries에 모아 두면 커밋 직전에 덧붙임 (numpy 없이 덧붙이기만 함)
+        with vector_segments.write_transaction(DEFAULT_DB_PATH) as (conn, segment_entries):
+            if scope:
+                keys = [key for key in DELETE_SCOPE_KEYS if scope.get(key) not in (None, '')]
+                if not keys:
+                    raise ValueError("삭제 범위(child_id/parent_id)가 없습니다.")
+                diary_ids = [row[0] for row in conn.execute(
+                    'SELECT diary_id FROM diary_embeddings WHERE ' + ' AND '.join(f'{key} = ?' for key in keys),
+                    [scope[key] for key in keys]
+                ).fetchall()]
+            
+            deleted, children, parents = [], [], []
+            for diary_id in diary_ids:
+                # 삭제할 행의 아이/부모 (검색 결과 캐시 무효화 대상)
+                existing = conn.execute(
+                    'SELECT child_id, parent_id FROM diary_embeddings WHERE diary_id = ?', (diary_id,)
+                ).fetchall()
+                if not existing:
+                    results.append({
+                        "success": False,
+                        "diary_id": diary_id,
+                        "message": f"일기 ID {diary_id}에 대한 벡터 임베딩을 찾을 수 없습니다."
+                    })
+                    continue
+                
+                # 삭제 실행
+                deleted_rows = conn.execute('DELETE FROM diary_embeddings WHERE diary_id = ?', (diary_id,)).rowcount
+                
+                # 청크, BM25 색인, KDST 문항별 목록에서도 삭제
+                remove_chunks(conn, diary_id)
+                remove_document(conn, diary_id)
+                kdst_topk.remove_diary(conn, diary_id)
+                
+                deleted.append(diary_id)
+                children += [row[0] for row in existing]
+                parents += [row[1] for row in existing]
+                results.append({
+                    "success": True, 
+                    "message": f"벡터 임베딩 삭제 완료",
+                    "diary_id": diary_id,
+                    "deleted_rows": deleted_rows
+                })
+            
+            if deleted:
+                # 삭제한 일기의 아이/부모 검색 결과 캐시 무효화
+                bump_generations(conn, children, parents)
+                segment_entries.extend((diary_id, None) for diary_id in deleted)
         
-        return {
-            "success": True, 
-            "message": f"벡터 임베딩 삭제 완료",
-            "diary_id": diary_id,
-            "deleted_rows": deleted_rows
-        }
+        return results
         
     except Exception as e:
-        return {"success": False, "message": f"벡터 DB 삭제 실패: {str(e)}"}
+        failure = {"success": False, "message": f"벡터 DB 삭제 실패: {str(e)}"}
+        return [dict(failure, diary_id=diary_id) for diary_id in diary_ids] or [failure]
+
+def delete_diary_embedding(diary_id):
+    """벡터 DB에서 일기 임베딩을 삭제 (delete_diary_embeddings에 ID 하나를 넘긴 결과)"""
+    return delete_diary_embeddings([diary_id])[0]
+
+def handle_delete_request(data):
+    """삭제 요청 하나를 처리
+
+    {"diary_id": 1}           일기 하나
+    {"diary_ids": [1, 2, 3]}  여러 일기 (한 트랜잭션, 일기별 결과)
+    {"child_id": 5}           아이(또는 parent_id로 부모)의 일기 전체 (diary_id 키가 없을 때만)
+    """
+    if not isinstance(data, dict):
+        return {"success": False, "message": "diary_id가 제공되지 않았습니다."}
+    if 'diary_id' in data:
+        if not data['diary_id']:
+            return {"success": False, "message": "diary_id가 제공되지 않았습니다."}
+        return delete_diary_embedding(data['diary_id'])
+    if isinstance(data.get('diary_ids'), list):
+        return batch_response(delete_diary_embeddings(data['diary_ids']))
+    scope = {key: data[key] for key in DELETE_SCOPE_KEYS if data.get(key) not in (None, '')}
+    if scope:
+        return batch_response(delete_diary_embeddings(scope=scope))
+    return {"success": False, "message": "diary_id가 제공되지 않았습니다."}
+
+def batch_response(results):
+    """일기별 결과 목록 → 일괄 삭제 응답 (모든 일기가 삭제됐을 때만 success)"""
+    deleted = sum(1 for result in results if result.get('success'))
+    return {
+        "success": deleted == len(results),
+        "message": f"벡터 임베딩 {deleted}개 삭제 완료",
+        "deleted": deleted,
+        "failed": len(results) - deleted,
+        "results": results
+    }
+
+def delete_diaries(batch):
+    """--stream 배치: 일기 하나짜리 요청들은 한 트랜잭션으로 삭제하고, 결과는 요청 순서대로 반환"""
+    results = [None] * len(batch)
+    singles = [
+        (position, data['diary_id']) for position, data in enumerate(batch)
+        if isinstance(data, dict) and data.get('diary_id')
+    ]
+    for (position, _), result in zip(singles, delete_diary_embeddings([diary_id for _, diary_id in singles])):
+        results[position] = result
+    return [result if result is not None else handle_delete_request(data) for data, result in zip(batch, results)]
 
 def main():
     """메인 함수"""
+    if STREAM_MODE:
+        run_stream(delete_diaries, 'delete')
+        return
     try:
         # stdin에서 JSON 데이터 읽기
         input_data = sys.stdin.read().strip()
@@ -60,19 +152,17 @@ def main():
             print(json.dumps({"success": False, "message": "입력 데이터가 없습니다."}))
             return
         
-        # JSON 파싱
-        data = json.loads(input_data)
-        diary_id = data.get('diary_id')
-        
-        if not diary_id:
-            print(json.dumps({"success": False, "message": "diary_id가 제공되지 않았습니다."}))
-            return
-        
-        # 벡터 DB에서 삭제
-        result = delete_diary_embedding(diary_id)
-        
-        # 결과 출력
-        print(json.dumps(result, ensure_ascii=False))
+        with request_timings.request('delete') as timings:
+            # JSON 파싱
+            with request_timings.span('parse'):
+                data = json.loads(input_data)
+            timings.report = request_timings.requested(data)
+            
+            # 벡터 DB에서 삭제 (여러 일기/범위 삭제는 한 트랜잭션)
+            result = handle_delete_request(data)
+            
+            # 결과 출력 (--timings/"timings": true이면 단계별 소요 시간 포함)
+            print(request_timings.dumps(result, ensure_ascii=False))
         
     except json.JSONDecodeError as e:
         print(json.dumps({"success": False, "message": f"JSON 파싱 실패: {str(e)}"}))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+긴 일기의 청크 임베딩 (diary_chunks 테이블)
+
+모델 최대 길이를 넘는 일기(날짜 + 내용 + 사진 캡션)는 뒷부분이 잘려 임베딩에 반영되지 않으므로,
+토큰 수 기준으로 문장 단위 청크(CHUNK_MAX_TOKENS, 앞 청크의 마지막 문장을 겹침)로 나눠 배치로 인코딩합니다.
+- diary_chunks(diary_id, chunk_index, text, embedding): 청크가 2개 이상인 일기만 저장
+- diary_embeddings.embedding: 청크 벡터 평균 (세그먼트/압축 인덱스/KDST는 일기당 벡터 하나를 그대로 사용)
+- 검색 시 청크가 있는 일기는 청크 유사도의 최댓값(CHUNK_AGGREGATION=max) 또는
+  상위 CHUNK_TOP_M개 평균(CHUNK_AGGREGATION=mean)으로 점수를 다시 매깁니다.
+
+delete_diary.py에서도 사용하므로 numpy/모델은 필요한 함수 안에서만 import합니다.
+"""
+
+import os
+import re
+
+from sqlite_pool import DEFAULT_DB_PATH
+
+CHUNK_MAX_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', '256'))
+CHUNK_OVERLAP_SENTENCES = int(os.getenv('CHUNK_OVERLAP_SENTENCES', '1'))
+CHUNK_AGGREGATION = os.getenv('CHUNK_AGGREGATION', 'max').lower()
+CHUNK_TOP_M = int(os.getenv('CHUNK_TOP_M', '2'))
+
+# 문장 끝(. ! ? 。 …) 뒤 공백이나 줄바꿈에서 나눔
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?。…])\s+|\n+')
+
+# 범위(scope) → (세대 문자열, ChunkIndex), 상주 서버에서 세대가 같으면 재사용
+_chunk_index_cache = {}
+
+
+def ensure_chunk_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS diary_chunks (
+            diary_id INTEGER NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            text TEXT,
+            embedding BLOB,
+            PRIMARY KEY (diary_id, chunk_index)
+        )
+    ''')
+
+
+def remove_chunks(cursor, diary_id):
+    """일기의 청크 삭제 (쓰기 트랜잭션 안에서 호출, 스키마는 sqlite_pool이 준비)"""
+    cursor.execute('DELETE FROM diary_chunks WHERE diary_id = ?', (diary_id,))
+
+
+def replace_chunks(cursor, diary_id, chunks):
+    """일기의 청크를 [(text, embedding_blob), ...]으로 교체 (빈 목록이면 삭제만)"""
+    remove_chunks(cursor, diary_id)
+    cursor.executemany(
+        'INSERT INTO diary_chunks (diary_id, chunk_index, text, embedding) VALUES (?, ?, ?, ?)',
+        [(diary_id, i, text, blob) for i, (text, blob) in enumerate(chunks)]
+    )
+
+
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_BOUNDARY.split(text) if s and s.strip()]
+
+
+def _split_long_sentence(sentence, count_tokens, max_tokens):
+    """한 문장이 max_tokens를 넘으면 어절 단위로 나눔 (띄어쓰기 없이 긴 어절은 문자 단위로 자름)"""
+    pieces, words = [], []
+    for word in sentence.split():
+        if len(word) > max_tokens and count_tokens(word) > max_tokens:
+            if words:
+                pieces.append(' '.join(words))
+                words = []
+            pieces.extend(word[i:i + max_tokens] for i in range(0, len(word), max_tokens))
+            continue
+        if words and count_tokens(' '.join(words + [word])) > max_tokens:
+            pieces.append(' '.join(words))
+            words = []
+        words.append(word)
+    if words:
+        pieces.append(' '.join(words))
+    return pieces
+
+
+def chunk_text(text, count_tokens, max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_SENTENCES):
+    """텍스트 → 청크 목록 (max_tokens 이하면 [text] 그대로)"""
+    # 문자 수가 토큰 수 상한이므로 짧은 일기는 토크나이저를 호출하지 않음
+    if len(text) <= max_tokens or count_tokens(text) <= max_tokens:
+        return [text]
+    sentences = []
+    for sentence in split_sentences(text):
+        if count_tokens(sentence) > max_tokens:
+            sentences.extend(_split_long_sentence(sentence, count_tokens, max_tokens))
+        else:
+            sentences.append(sentence)
+
+    chunks, current = [], []
+    for sentence in sentences:
+        if current and count_tokens(' '.join(current + [sentence])) > max_tokens:
+            chunks.append(' '.join(current))
+            # 문맥이 끊기지 않도록 앞 청크의 마지막 문장을 겹침 (청크 길이의 1/4 이하일 때만)
+            current = current[-overlap:] if overlap else []
+            if current and count_tokens(' '.join(current)) > max_tokens // 4:
+                current = []
+            while current and count_tokens(' '.join(current + [sentence])) > max_tokens:
+                current = current[1:]
+        current.append(sentence)
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+def token_counter(model):
+    """모델 토크나이저로 토큰 수를 세는 함수 (토크나이저가 없으면 문자 수)"""
+    tokenizer = getattr(model, 'tokenizer', None)
+    if tokenizer is None:
+        return len
+    return lambda text: len(tokenizer.tokenize(text))
+
+
+def chunk_token_limit(model, max_tokens=CHUNK_MAX_TOKENS):
+    """청크 최대 토큰 수 (모델 최대 길이에서 특수 토큰 2개를 뺀 값을 넘지 않음)"""
+    model_limit = getattr(model, 'max_seq_length', None)
+    return min(max_tokens, model_limit - 2) if model_limit else max_tokens
+
+
+def embed_texts(texts, batch_size=32):
+    """텍스트 목록을 청크로 나눠 한 번에 인코딩
+
+    반환: [(일기 벡터, [(청크 텍스트, 청크 벡터), ...]), ...]
+    청크가 하나뿐인 텍스트는 청크 목록이 비어 있고 일기 벡터만 사용합니다.
+    """
+    import numpy as np
+    from embedding_model import encode, get_encoder
+
+    model = get_encoder()
+    count_tokens = token_counter(model)
+    max_tokens = chunk_token_limit(model)
+    chunked = [chunk_text(text, count_tokens, max_tokens) for text in texts]
+    flat = [chunk for chunks in chunked for chunk in chunks]
+    vectors = np.asarray(encode(flat, batch_size=batch_size), dtype=np.float32).reshape(len(flat), -1)
+
+    results = []
+    position = 0
+    for chunks in chunked:
+        chunk_vectors = vectors[position:position + len(chunks)]
+        position += len(chunks)
+        if len(chunks) == 1:
+            results.append((chunk_vectors[0], []))
+            continue
+        norms = np.linalg.norm(chunk_vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        results.append(((chunk_vectors / norms).mean(axis=0), list(zip(chunks, chunk_vectors))))
+    return results
+
+
+def load_chunk_index(scope=None, db_path=DEFAULT_DB_PATH):
+    """범위 내 청크 인덱스 (청크가 없으면 None). 범위의 세대 번호가 같으면 이전에 읽은 인덱스를 재사용"""
+    from result_cache import current_generation
+    from sqlite_pool import connection
+    from vector_search import ChunkIndex
+    from vector_store import decode_embedding, scope_where_clause
+
+    if not os.path.exists(db_path):
+        return None
+    key = tuple(sorted((k, str(v)) for k, v in (scope or {}).items()))
+    generation = current_generation(scope, db_path)
+    cached = _chunk_index_cache.get(key)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+
+    where, params = scope_where_clause(scope)
+    with connection(db_path) as conn:
+        rows = conn.execute(
+            'SELECT diary_id, embedding FROM diary_chunks WHERE diary_id IN (SELECT diary_id FROM diary_embeddings'
+            + where + ')', params
+        ).fetchall()
+
+    index = ChunkIndex([decode_embedding(blob) for _, blob in rows], [diary_id for diary_id, _ in rows]) if rows else None
+    _chunk_index_cache[key] = (generation, index)
+    return index
+
+
+def chunk_scores(chunk_index, query_vector):
+    """{diary_id: 집계 점수} (청크 인덱스가 없으면 빈 dict)"""
+    if chunk_index is None:
+        return {}
+    return chunk_index.aggregate(query_vector, CHUNK_AGGREGATION, CHUNK_TOP_M)
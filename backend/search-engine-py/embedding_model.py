@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+임베딩 모델 지연 로드
+
+sentence_transformers(및 torch)는 import만으로 수 초가 걸리므로,
+모듈 최상위가 아니라 get_model()을 처음 호출할 때 import합니다.
+검색 결과가 없거나 입력이 잘못된 경우처럼 인코딩이 필요 없는 경로는 모델을 전혀 로드하지 않습니다.
+
+EMBEDDING_BACKEND=onnx이면 get_model()이 같은 모델을 ONNX로 내보낸 onnxruntime 인코더
+(onnx_backend.OnnxSentenceEncoder)를 반환합니다. 불러오지 못하면 torch 모델을 사용합니다.
+
+상주 서버는 set_encoder()로 인코딩 스케줄러(encode_scheduler.EncodeScheduler)를 설치하며,
+그 뒤로 encode() 호출은 동시 요청과 함께 마이크로 배치로 묶여 인코딩됩니다.
+"""
+
+import os
+import sys
+
+import request_timings
+import startup_profile
+
+MODEL_NAME = 'BM-K/KoSimCSE-roberta-multitask'
+
+# 추론 백엔드: torch (SentenceTransformer) | onnx (onnxruntime)
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch').lower()
+
+# 프로세스당 한 번만 로드 (상주 서버와 CLI 스크립트가 같은 인스턴스를 공유)
+_model = None
+_torch_model = None
+# encode()가 사용할 인코더 (None이면 모델을 직접 호출)
+_encoder = None
+
+
+def get_torch_model():
+    """PyTorch Sentence Transformer 모델을 싱글톤으로 반환"""
+    global _torch_model
+    if _torch_model is None:
+        with startup_profile.stage('import_sentence_transformers'):
+            from sentence_transformers import SentenceTransformer
+        with startup_profile.stage('model_load'):
+            _torch_model = SentenceTransformer(MODEL_NAME)
+        # torch 스레드 수는 프로세스 전체 설정이므로 모델을 로드할 때 한 번만 적용
+        from encode_scheduler import configure_torch_threads
+        configure_torch_threads()
+    return _torch_model
+
+
+def get_model():
+    """EMBEDDING_BACKEND에 맞는 인코딩 모델을 싱글톤으로 반환 (model.encode(texts, batch_size) 형태)"""
+    global _model
+    if _model is None:
+        with request_timings.span('model_load'):
+            _load_model()
+    return _model
+
+
+def _load_model():
+    global _model
+    if EMBEDDING_BACKEND == 'onnx':
+        try:
+            with startup_profile.stage('model_load'):
+                from onnx_backend import OnnxSentenceEncoder
+                _model = OnnxSentenceEncoder()
+        except Exception as e:
+            print(f"ONNX 백엔드 로드 실패, torch 모델 사용: {e}", file=sys.stderr)
+    if _model is None:
+        _model = get_torch_model()
+
+
+def set_encoder(encoder):
+    """encode()가 사용할 인코더 설치 (encoder.encode(texts) 형태, None이면 해제)"""
+    global _encoder
+    _encoder = encoder
+
+
+def get_encoder():
+    """encode()가 실제로 사용하는 인코더 (설치된 인코더가 없으면 모델). 토크나이저 조회용"""
+    return _encoder if _encoder is not None else get_model()
+
+
+def encode(texts, batch_size=32):
+    """문자열 하나 → (D,) 벡터, 문자열 목록 → (N, D) 행렬"""
+    if _encoder is not None:
+        with request_timings.span('encode'):
+            return _encoder.encode(texts)
+    model = get_model()
+    with request_timings.span('encode'):
+        return model.encode(texts, batch_size=batch_size)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+인코딩 스케줄러 (상주 서버용 동적 마이크로 배치)
+
+동시에 들어온 일기 저장/검색의 인코딩 요청을 하나의 큐에 모아,
+워커가 첫 요청을 받은 뒤 최대 ENCODE_MAX_WAIT_MS 동안(또는 ENCODE_MAX_BATCH개가 찰 때까지)
+기다린 요청을 model.encode 한 번으로 함께 인코딩합니다.
+CPU에서는 트랜스포머 한 번 호출의 고정 비용이 크므로, 한 건씩 인코딩할 때보다 초당 처리량이 높아집니다.
+
+- ENCODE_WORKERS (기본 1)       - 배치를 실행하는 워커 스레드 수 (torch 연산 중에는 GIL이 풀림)
+- ENCODE_MAX_BATCH (기본 32)    - 배치 최대 크기
+- ENCODE_MAX_WAIT_MS (기본 5)   - 첫 요청 이후 추가 요청을 기다리는 최대 시간
+- ENCODE_TORCH_THREADS (기본 CPU 코어 수 / 워커 수) - 워커당 torch intra-op 스레드 수
+  (워커 × 스레드가 코어 수를 넘으면 서로 경쟁하여 오히려 느려짐)
+  프로세스 전체 설정이므로 embedding_model이 torch 모델을 로드할 때 한 번만 적용합니다.
+
+배치 인코딩이 실패하면 배치의 텍스트를 하나씩 다시 인코딩하여, 실패한 텍스트의 요청만 오류를 받습니다.
+
+실행:
+  python encode_scheduler.py bench --texts 256 --concurrency 16   # 직렬 인코딩 대비 처리량 비교
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ENCODE_WORKERS = max(1, int(os.getenv('ENCODE_WORKERS', '1')))
+ENCODE_MAX_BATCH = max(1, int(os.getenv('ENCODE_MAX_BATCH', '32')))
+ENCODE_MAX_WAIT_MS = float(os.getenv('ENCODE_MAX_WAIT_MS', '5'))
+ENCODE_TORCH_THREADS = int(os.getenv('ENCODE_TORCH_THREADS', '0'))
+
+
+def configure_torch_threads(workers=ENCODE_WORKERS, threads=ENCODE_TORCH_THREADS):
+    """워커당 torch intra-op 스레드 수 설정 (embedding_model이 torch 모델 로드 후 한 번 호출). 적용한 값을 반환
+
+    따로 설정하지 않았고 워커가 하나이면 torch 기본값을 그대로 둡니다.
+    """
+    torch = sys.modules.get('torch')
+    if torch is None or (not threads and workers <= 1):
+        return None
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    torch.set_num_threads(threads)
+    return threads
+
+
+def torch_threads():
+    """현재 torch intra-op 스레드 수 (torch가 로드되지 않았으면 None)"""
+    torch = sys.modules.get('torch')
+    return torch.get_num_threads() if torch is not None else None
+
+
+class _EncodeRequest:
+    """큐에 들어가는 텍스트 한 건과 그 결과"""
+
+    __slots__ = ('text', 'vector', 'error', 'done')
+
+    def __init__(self, text):
+        self.text = text
+        self.vector = None
+        self.error = None
+        self.done = threading.Event()
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.vector
+
+
+class EncodeScheduler:
+    """동시 인코딩 요청을 마이크로 배치로 묶어 워커 풀에서 실행합니다"""
+
+    def __init__(self, model, workers=ENCODE_WORKERS, max_batch=ENCODE_MAX_BATCH,
+                 max_wait_ms=ENCODE_MAX_WAIT_MS):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._texts = 0
+        self._largest_batch = 0
+        self._workers = [
+            threading.Thread(target=self._run, name=f'encode-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def tokenizer(self):
+        return getattr(self.model, 'tokenizer', None)
+
+    @property
+    def max_seq_length(self):
+        return getattr(self.model, 'max_seq_length', None)
+
+    def encode(self, texts):
+        """문자열 하나 → (D,) 벡터, 문자열 목록 → (N, D) 행렬 (다른 스레드의 요청과 함께 배치 처리)"""
+        single = isinstance(texts, str)
+        requests = [_EncodeRequest(text) for text in ([texts] if single else texts)]
+        for request in requests:
+            self._queue.put(request)
+        vectors = [request.result() for request in requests]
+        if single:
+            return vectors[0]
+        return np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def _collect(self, first):
+        """첫 요청 이후 max_wait 동안 들어온 요청을 max_batch개까지 모음"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # 종료 신호는 다른 워커를 위해 되돌려 놓음
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                self._queue.put(None)
+                return
+            batch = self._collect(first)
+            # 같은 텍스트는 한 번만 인코딩
+            unique = list(dict.fromkeys(request.text for request in batch))
+            vectors, errors = self._encode_batch(unique)
+            for request in batch:
+                if request.text in vectors:
+                    request.vector = vectors[request.text]
+                else:
+                    request.error = errors[request.text]
+                request.done.set()
+            with self._stats_lock:
+                self._batches += 1
+                self._texts += len(batch)
+                self._largest_batch = max(self._largest_batch, len(batch))
+
+    def _encode_batch(self, texts):
+        """텍스트 목록 → ({텍스트: 벡터}, {텍스트: 예외}) (배치가 실패하면 텍스트마다 다시 시도)"""
+        try:
+            encoded = np.asarray(self.model.encode(texts, batch_size=len(texts)), dtype=np.float32)
+            return dict(zip(texts, encoded)), {}
+        except Exception as e:
+            if len(texts) == 1:
+                return {}, {texts[0]: e}
+        vectors, errors = {}, {}
+        for text in texts:
+            try:
+                vectors[text] = np.asarray(self.model.encode([text], batch_size=1), dtype=np.float32)[0]
+            except Exception as e:
+                errors[text] = e
+        return vectors, errors
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "workers": len(self._workers),
+                "torch_threads": torch_threads(),
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self._batches,
+                "texts": self._texts,
+                "avg_batch_size": round(self._texts / self._batches, 2) if self._batches else 0.0,
+                "largest_batch": self._largest_batch,
+                "queued": self._queue.qsize()
+            }
+
+    def close(self):
+        """대기 중인 요청을 처리한 뒤 워커 종료"""
+        self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+
+def benchmark(model, texts, concurrency, workers, max_batch, max_wait_ms):
+    """직렬 단건 인코딩과 스케줄러 동시 인코딩의 초당 임베딩 수 비교"""
+    model.encode(texts[0])  # 워밍업
+
+    start = time.perf_counter()
+    for text in texts:
+        model.encode(text)
+    serial = time.perf_counter() - start
+
+    scheduler = EncodeScheduler(model, workers=workers, max_batch=max_batch, max_wait_ms=max_wait_ms)
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(scheduler.encode, texts))
+        batched = time.perf_counter() - start
+        stats = scheduler.stats()
+    finally:
+        scheduler.close()
+
+    return {
+        "texts": len(texts),
+        "concurrency": concurrency,
+        "serial_per_sec": round(len(texts) / serial, 1),
+        "scheduled_per_sec": round(len(texts) / batched, 1),
+        "speedup": round(serial / batched, 2) if batched else None,
+        "scheduler": stats
+    }
+
+
+def main():
+    """메인 함수"""
+    parser = argparse.ArgumentParser(description='인코딩 스케줄러 처리량 확인')
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--texts', type=int, default=256)
+    parser.add_argument('--concurrency', type=int, default=16, help='동시에 인코딩을 요청하는 스레드 수')
+    parser.add_argument('--workers', type=int, default=ENCODE_WORKERS)
+    parser.add_argument('--max-batch', type=int, default=ENCODE_MAX_BATCH)
+    parser.add_argument('--max-wait-ms', type=float, default=ENCODE_MAX_WAIT_MS)
+    args = parser.parse_args()
+
+    try:
+        from embedding_model import get_model
+        texts = [f"{i}번째 일기: 오늘 아이가 블록을 {i % 7 + 1}개 쌓고 웃었어요" for i in range(args.texts)]
+        result = {"success": True, **benchmark(get_model(), texts, args.concurrency, args.workers,
+                                               args.max_batch, args.max_wait_ms)}
+    except Exception as e:
+        result = {"success": False, "message": f"처리량 측정 실패: {str(e)}"}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
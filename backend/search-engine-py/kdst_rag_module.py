@@ -6,6 +6,8 @@ KDST RAG 모듈 - ReportAgent에서 사용
 이 모듈을 import하여 KDST 문제에 대한 RAG 검색을 수행할 수 있습니다.
 """
 
+import startup_profile
+import request_timings
 import json
 import sys
 import os
@@ -17,45 +19,84 @@ if sys.platform.startswith('win'):
     sys.stderr = codecs.getwriter('utf-8')(sys.stderr.detach())
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import sqlite3
-from sklearn.metrics.pairwise import cosine_similarity
 from datetime import datetime
+from embedding_model import MODEL_NAME, encode
+from vector_store import EMBEDDING_DB_PATH, decode_embedding, encode_embedding, extract_scope, scope_where_clause, text_hash
+from sqlite_pool import connection, transaction
+from vector_search import ChunkIndex, VectorIndex, normalize_rows
+from quantized_index import QUANTIZATION_MODE, load_quantized_index
+from vector_segments import load_segment_index
+import question_cache
+from query_cache import get_query_embedding
+from result_cache import cached_result, current_generation
+from diary_chunks import CHUNK_AGGREGATION, CHUNK_TOP_M, load_chunk_index
+import kdst_topk
 
-# 모델 로드 (한 번만 로드)
-_model = None
+startup_profile.mark_imports_done()
 
-def get_model():
-    """Sentence Transformer 모델을 싱글톤으로 반환"""
-    global _model
-    if _model is None:
-        _model = SentenceTransformer('BM-K/KoSimCSE-roberta-multitask')
-    return _model
+# 문항별로 찾을 관련 일기 수
+KDST_TOP_K = 3
+
+# KDST 질문 일괄 인코딩 시 배치 크기
+KDST_ENCODE_BATCH_SIZE = int(os.getenv('KDST_ENCODE_BATCH_SIZE', '64'))
 
 def get_embedding(text):
-    """텍스트를 벡터로 변환"""
+    """텍스트를 벡터로 변환 (같은 쿼리는 쿼리 임베딩 캐시에서 가져옴)"""
     try:
-        model = get_model()
-        embedding = model.encode(text)
+        embedding = get_query_embedding(text, MODEL_NAME, encode)
         return embedding.tolist()
     except Exception as e:
         print(f"임베딩 생성 실패: {e}", file=sys.stderr)
         return None
 
-def load_diary_embeddings():
-    """벡터 DB에서 일기 임베딩들을 로드"""
+def get_embeddings(texts, batch_size=KDST_ENCODE_BATCH_SIZE):
+    """여러 텍스트를 한 번의 배치 인코딩으로 (N, D) 행렬로 변환"""
+    try:
+        return np.asarray(encode(list(texts), batch_size=batch_size), dtype=np.float32)
+    except Exception as e:
+        print(f"임베딩 생성 실패: {e}", file=sys.stderr)
+        return None
+
+def get_question_embeddings(questions, batch_size=KDST_ENCODE_BATCH_SIZE):
+    """KDST 문항 임베딩을 캐시에서 가져오고, 캐시에 없는 문항만 배치로 인코딩"""
     try:
-        db_path = os.path.join(os.path.dirname(__file__), 'my_local_qdrant_db', 'diary_embeddings.db')
+        return question_cache.get_question_embeddings(
+            questions,
+            MODEL_NAME,
+            lambda texts: encode(texts, batch_size=batch_size)
+        )
+    except Exception as e:
+        print(f"문항 임베딩 캐시 사용 실패, 직접 인코딩: {e}", file=sys.stderr)
+        return get_embeddings(questions, batch_size)
+
+def load_diary_embeddings(scope=None):
+    """벡터 DB에서 일기 임베딩들을 로드
+
+    scope: child_id/parent_id/date_from/date_to 중 일부 (SQLite 인덱스로 필터링)
+    EMBEDDING_QUANTIZATION이 설정되었거나 메모리 맵 세그먼트가 있으면 (N, D) 행렬 대신 VectorIndex를 반환합니다.
+    """
+    try:
+        db_path = EMBEDDING_DB_PATH
         
         if not os.path.exists(db_path):
             return None, None
         
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        # EMBEDDING_QUANTIZATION이 설정되면 압축 인덱스를 임베딩 대신 반환 (build_diary_index가 그대로 사용)
+        if QUANTIZATION_MODE:
+            index = load_quantized_index(QUANTIZATION_MODE, db_path, scope)
+            if len(index) == 0:
+                return None, None
+            return index, index.items
+        
+        # 메모리 맵 세그먼트가 있으면 memmap 위의 인덱스를 반환 (세그먼트가 없거나 오래되었으면 None)
+        index = load_segment_index(scope, db_path)
+        if index is not None:
+            return index, index.items
         
-        # 모든 일기 임베딩 로드
-        cursor.execute('SELECT diary_id, text, embedding, date FROM diary_embeddings')
-        rows = cursor.fetchall()
+        # 범위 내 일기 임베딩 로드 (범위가 없으면 전체)
+        where, params = scope_where_clause(scope)
+        with connection(db_path) as conn:
+            rows = conn.execute('SELECT diary_id, text, embedding, date FROM diary_embeddings' + where, params).fetchall()
         
         if not rows:
             return None, None
@@ -66,7 +107,7 @@ def load_diary_embeddings():
         
         for row in rows:
             diary_id, text, embedding_blob, date = row
-            embedding = json.loads(embedding_blob)
+            embedding = decode_embedding(embedding_blob)
             
             diary_texts.append(text)
             diary_embeddings.append(embedding)
@@ -76,39 +117,35 @@ def load_diary_embeddings():
                 'date': date
             })
         
-        conn.close()
-        return diary_embeddings, diary_info
+        return np.vstack(diary_embeddings), diary_info
         
     except Exception as e:
         print(f"일기 임베딩 로드 실패: {e}", file=sys.stderr)
         return None, None
 
+def build_diary_index(diary_embeddings, diary_info):
+    """일기 임베딩을 정규화된 행렬 인덱스로 변환"""
+    if isinstance(diary_embeddings, VectorIndex):
+        return diary_embeddings
+    return VectorIndex(diary_embeddings, diary_info)
+
 def find_similar_diaries(query, diary_embeddings, diary_info, top_k=3):
-    """쿼리와 가장 유사한 일기들을 찾기"""
+    """쿼리와 가장 유사한 일기들을 찾기 (diary_embeddings에 VectorIndex를 넘기면 재사용)"""
     try:
         # 쿼리 임베딩 생성
         query_embedding = get_embedding(query)
         if query_embedding is None:
             return []
         
-        # 코사인 유사도 계산
-        similarities = []
-        for i, diary_embedding in enumerate(diary_embeddings):
-            similarity = cosine_similarity([query_embedding], [diary_embedding])[0][0]
-            similarities.append((similarity, i))
-        
-        # 유사도 순으로 정렬 (높은 순)
-        similarities.sort(reverse=True)
-        
-        # 상위 k개 결과 반환
+        # 행렬곱 한 번으로 코사인 유사도 계산 후 상위 k개 결과 반환
+        index = build_diary_index(diary_embeddings, diary_info)
         top_results = []
-        for similarity, idx in similarities[:top_k]:
-            diary = diary_info[idx]
+        for diary, similarity in index.search(query_embedding, top_k):
             top_results.append({
                 'diary_id': diary['id'],
                 'text': diary['text'],
                 'date': diary['date'],
-                'similarity': float(similarity)
+                'similarity': similarity
             })
         
         return top_results
@@ -117,20 +154,183 @@ def find_similar_diaries(query, diary_embeddings, diary_info, top_k=3):
         print(f"유사 일기 검색 실패: {e}", file=sys.stderr)
         return []
 
-def process_kdst_questions(questions):
-    """KDST 문제들을 처리하여 RAG 결과 생성"""
+def kdst_item_hash(question):
+    """문항 목록의 키 (모델이 바뀌면 다른 문항으로 취급)"""
+    return text_hash(f"{MODEL_NAME}\n{question}")
+
+# 목록을 다시 계산하는 동안 범위에 쓰기가 있으면 다시 시도하는 횟수
+KDST_TOPK_REBUILD_ATTEMPTS = 3
+
+def _score_topk_lists(queries, scope):
+    """범위의 일기를 채점하여 문항별 상위 KDST_TOPK_DEPTH개 [(diary_id, similarity), ...]와 범위의 일기 수 (일기가 없으면 None)
+
+    쓰기 잠금 없이 읽습니다. 점수는 업서트 시 갱신과 같게 일기 벡터 코사인 유사도이며,
+    청크가 있는 일기는 청크 유사도 집계로 바꿉니다.
+    """
+    depth = kdst_topk.KDST_TOPK_DEPTH
+    where, params = scope_where_clause(scope)
+    with connection(EMBEDDING_DB_PATH) as conn:
+        rows = conn.execute('SELECT diary_id, embedding FROM diary_embeddings' + where, params).fetchall()
+        if not rows:
+            return None
+        chunk_rows = conn.execute(
+            'SELECT diary_id, embedding FROM diary_chunks WHERE diary_id IN (SELECT diary_id FROM diary_embeddings'
+            + where + ')', params
+        ).fetchall()
+    
+    index = VectorIndex(np.vstack([decode_embedding(blob) for _, blob in rows]), [{'id': diary_id} for diary_id, _ in rows])
+    if not chunk_rows:
+        pools = index.search_batch(queries, top_k=depth)
+        return [[(item['id'], similarity) for item, similarity in hits] for hits in pools], len(index)
+    
+    # 청크 일기는 rescore에서 모두 후보가 되므로, 나머지 일기 상위 depth개가 후보에 들도록 청크 일기 수만큼 넉넉히 뽑음
+    chunk_index = ChunkIndex([decode_embedding(blob) for _, blob in chunk_rows], [diary_id for diary_id, _ in chunk_rows])
+    pools = index.search_batch(queries, top_k=depth + len(chunk_index.diary_ids))
+    overrides = chunk_index.aggregate_batch(queries, CHUNK_AGGREGATION, CHUNK_TOP_M)
+    batch_hits = [index.rescore(hits, scores, depth) for hits, scores in zip(pools, overrides)]
+    return [[(item['id'], similarity) for item, similarity in hits] for hits in batch_hits], len(index)
+
+def _rebuild_topk_lists(bucket, scope, questions):
+    """범위의 일기를 채점하여 문항별 상위 KDST_TOPK_DEPTH개 목록을 다시 만듦 → 문항별 [(diary_id, similarity), ...]
+
+    읽기와 채점은 쓰기 잠금 밖에서 하고, 저장할 때만 짧은 쓰기 트랜잭션을 엽니다.
+    그 사이 범위의 세대 번호가 바뀌었으면 (업서트/삭제가 있었으면) 다시 계산하며,
+    계속 바뀌면 이번 결과만 반환하고 저장하지 않습니다. 범위에 일기가 없으면 None을 반환합니다.
+    """
+    question_embeddings = get_question_embeddings(questions)
+    if question_embeddings is None:
+        return None
+    queries = normalize_rows(question_embeddings)
+    items = [(kdst_item_hash(question), question, encode_embedding(query)) for question, query in zip(questions, queries)]
+    
+    for _ in range(KDST_TOPK_REBUILD_ATTEMPTS):
+        generation = current_generation(scope, EMBEDDING_DB_PATH)
+        scored = _score_topk_lists(queries, scope)
+        if scored is None:
+            return None
+        hits_per_item, size = scored
+        with transaction(EMBEDDING_DB_PATH) as conn:
+            if current_generation(scope, EMBEDDING_DB_PATH) != generation:
+                continue
+            kdst_topk.store_lists(conn, bucket, items, hits_per_item, truncated=size > kdst_topk.KDST_TOPK_DEPTH)
+        return hits_per_item
+    return hits_per_item
+
+def materialized_kdst_result(questions, scope=None):
+    """쓰기 시 갱신되는 문항별 상위 일기 목록(kdst_topk)에서 결과를 읽음 (검색하지 않음)
+
+    처음 요청된 문항이나 삭제로 부족해진 목록만 다시 계산합니다.
+    목록으로 둘 수 없는 범위(날짜 조건 등)이거나 범위에 일기가 없으면 None (호출한 쪽에서 검색)
+    """
+    bucket = kdst_topk.scope_bucket(scope)
+    if not kdst_topk.KDST_TOPK_ENABLED or bucket is None or not questions or not os.path.exists(EMBEDDING_DB_PATH):
+        return None
+    try:
+        item_hashes = [kdst_item_hash(question) for question in questions]
+        with request_timings.span('db_load'), connection(EMBEDDING_DB_PATH) as conn:
+            lists, stale = kdst_topk.read_lists(conn, bucket, item_hashes, KDST_TOP_K)
+        if stale:
+            with request_timings.span('score'):
+                stale_questions = list(dict.fromkeys(q for q, h in zip(questions, item_hashes) if h in stale))
+                rebuilt = _rebuild_topk_lists(bucket, scope, stale_questions)
+            if rebuilt is None:
+                return None
+            for question, hits in zip(stale_questions, rebuilt):
+                lists[kdst_item_hash(question)] = hits[:KDST_TOP_K]
+        
+        diary_ids = list({diary_id for hits in lists.values() for diary_id, _ in hits})
+        if not diary_ids:
+            # 범위에 일기가 없음 (검색 경로와 같은 실패 응답을 위해 None)
+            return None
+        with request_timings.span('db_load'), connection(EMBEDDING_DB_PATH) as conn:
+            diaries = {
+                diary_id: {'text': text, 'date': date}
+                for diary_id, text, date in conn.execute(
+                    f"SELECT diary_id, text, date FROM diary_embeddings WHERE diary_id IN ({','.join('?' * len(diary_ids))})",
+                    diary_ids
+                ).fetchall()
+            }
+    except Exception as e:
+        print(f"KDST 문항별 목록 사용 실패, 검색으로 처리: {e}", file=sys.stderr)
+        return None
+    
+    results = []
+    for question, item_hash in zip(questions, item_hashes):
+        results.append({
+            "문제": question,
+            "일기": [{
+                'diary_id': diary_id,
+                'text': diaries[diary_id]['text'],
+                'date': diaries[diary_id]['date'],
+                'similarity': similarity
+            } for diary_id, similarity in lists[item_hash] if diary_id in diaries]
+        })
+    
+    return {
+        "success": True,
+        "message": "KDST 문제 RAG 검색 완료",
+        "results": results,
+        "materialized": True
+    }
+
+def process_kdst_questions(questions, diary_embeddings=None, diary_info=None, scope=None):
+    """KDST 문제들을 처리하여 RAG 결과 생성
+
+    diary_embeddings/diary_info를 넘기면 (상주 서버의 캐시) DB를 다시 읽지 않습니다.
+    scope를 넘기면 해당 아이/부모/기간의 일기만 검색합니다.
+    DB에서 읽는 경우, 먼저 문항별 상위 일기 목록(kdst_topk)을 읽고, 쓸 수 없으면
+    범위의 일기가 바뀌지 않았을 때 이전 결과를 결과 캐시에서 바로 반환합니다.
+    """
+    if diary_embeddings is None:
+        result = materialized_kdst_result(questions, scope)
+        if result is not None:
+            return result
+        return cached_result(
+            'kdst', scope, questions, KDST_TOP_K, None,
+            lambda: _process_kdst_questions(questions, None, None, scope)
+        )
+    return _process_kdst_questions(questions, diary_embeddings, diary_info, scope)
+
+def _process_kdst_questions(questions, diary_embeddings, diary_info, scope):
     try:
         # 일기 임베딩 로드
-        diary_embeddings, diary_info = load_diary_embeddings()
+        if diary_embeddings is None:
+            with startup_profile.stage('db_load'), request_timings.span('db_load'):
+                diary_embeddings, diary_info = load_diary_embeddings(scope)
         
         if diary_embeddings is None:
             return {"success": False, "message": "일기 임베딩을 로드할 수 없습니다."}
         
-        results = []
+        # 인덱스는 한 번만 구성하여 모든 질문에 재사용
+        diary_index = build_diary_index(diary_embeddings, diary_info)
+        
+        # 모든 질문을 (캐시 또는 배치 인코딩 한 번으로) 임베딩하고 (Q×D)·(D×N) 행렬곱 한 번으로 채점
+        question_embeddings = get_question_embeddings(questions)
+        if question_embeddings is None:
+            return {"success": False, "message": "질문 임베딩 생성 실패"}
+        try:
+            with request_timings.span('db_load'):
+                chunk_index = load_chunk_index(scope)
+        except Exception as e:
+            print(f"청크 인덱스 로드 실패, 일기 벡터로만 검색: {e}", file=sys.stderr)
+            chunk_index = None
+        with request_timings.span('score'):
+            if chunk_index is None:
+                batch_hits = diary_index.search_batch(question_embeddings, top_k=KDST_TOP_K)
+            else:
+                # 긴 일기는 청크 유사도 집계로 다시 채점 (후보를 넉넉히 뽑은 뒤 상위 k개)
+                pools = diary_index.search_batch(question_embeddings, top_k=max(KDST_TOP_K * 4, 50))
+                overrides = chunk_index.aggregate_batch(question_embeddings, CHUNK_AGGREGATION, CHUNK_TOP_M)
+                batch_hits = [diary_index.rescore(hits, scores, KDST_TOP_K) for hits, scores in zip(pools, overrides)]
         
-        for question in questions:
-            # 유사한 일기 검색
-            similar_diaries = find_similar_diaries(question, diary_embeddings, diary_info, top_k=3)
+        results = []
+        for question, hits in zip(questions, batch_hits):
+            similar_diaries = [{
+                'diary_id': diary['id'],
+                'text': diary['text'],
+                'date': diary['date'],
+                'similarity': similarity
+            } for diary, similarity in hits]
             
             # 결과 저장
             result = {
@@ -148,13 +348,13 @@ def process_kdst_questions(questions):
     except Exception as e:
         return {"success": False, "message": f"KDST 문제 처리 실패: {str(e)}"}
 
-def get_kdst_rag_result(questions):
+def get_kdst_rag_result(questions, scope=None):
     """KDST 문제들에 대한 RAG 결과를 반환 (ReportAgent용)"""
-    return process_kdst_questions(questions)
+    return process_kdst_questions(questions, scope=scope)
 
-def get_single_kdst_rag_result(question):
+def get_single_kdst_rag_result(question, scope=None):
     """단일 KDST 문제에 대한 RAG 결과를 반환 (ReportAgent용)"""
-    return process_kdst_questions([question])
+    return process_kdst_questions([question], scope=scope)
 
 def format_kdst_result_for_report(rag_result):
     """RAG 결과를 보고서 작성용으로 포맷팅"""
@@ -194,11 +394,11 @@ def format_kdst_result_for_report(rag_result):
     
     return formatted_result
 
-def get_kdst_report_context(questions):
+def get_kdst_report_context(questions, scope=None):
     """ReportAgent에서 사용할 수 있는 KDST 보고서 컨텍스트 생성"""
     try:
-        # RAG 검색 수행
-        rag_result = get_kdst_rag_result(questions)
+        # RAG 검색 수행 (문항별 상위 일기 목록이 있으면 검색 없이 읽음)
+        rag_result = get_kdst_rag_result(questions, scope)
         
         if not rag_result.get("success"):
             return {
@@ -241,23 +441,27 @@ if __name__ == "__main__":
         if not sys.stdin.isatty():
             input_data = sys.stdin.read().strip()
             if input_data:
-                # JSON 파싱
-                data = json.loads(input_data)
-                questions = data.get('questions', [])
-                
-                if questions:
-                    # RAG 검색 수행
-                    result = get_kdst_rag_result(questions)
+                with request_timings.request('kdst') as timings:
+                    # JSON 파싱
+                    with request_timings.span('parse'):
+                        data = json.loads(input_data)
+                    questions = data.get('questions', [])
+                    # --timings 또는 "timings": true이면 단계별 소요 시간 포함
+                    timings.report = request_timings.requested(data)
                     
-                    # 결과를 JSON으로 출력 (Node.js에서 받을 수 있도록)
-                    output = json.dumps(result, ensure_ascii=False, indent=None)
-                    print(output, flush=True)
-                else:
-                    error_output = json.dumps({
-                        "success": False,
-                        "message": "질문이 제공되지 않았습니다."
-                    }, ensure_ascii=False)
-                    print(error_output, flush=True)
+                    if questions:
+                        # RAG 검색 수행 (child_id/parent_id/date_from/date_to가 있으면 해당 범위만)
+                        result = get_kdst_rag_result(questions, extract_scope(data))
+                        
+                        # 결과를 JSON으로 출력 (Node.js에서 받을 수 있도록, --profile-startup이면 시작 시간 보고서 포함)
+                        output = request_timings.dumps(startup_profile.attach(result), ensure_ascii=False, indent=None)
+                        print(output, flush=True)
+                    else:
+                        error_output = json.dumps({
+                            "success": False,
+                            "message": "질문이 제공되지 않았습니다."
+                        }, ensure_ascii=False)
+                        print(error_output, flush=True)
             else:
                 error_output = json.dumps({
                     "success": False,
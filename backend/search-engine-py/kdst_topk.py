@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+KDST 문항별 상위 일기 목록 (쓰기 시 갱신하는 materialized top-k)
+
+보고서는 항상 "고정된 K-DST 문항마다 이 아이의 가장 관련 있는 일기"를 찾으므로,
+(범위, 문항)별 상위 KDST_TOPK_DEPTH개 일기를 diary_embeddings.db에 저장해 두고 보고서 시점에는 읽기만 합니다.
+- kdst_items(item_hash, text, embedding): 한 번이라도 보고서에 쓰인 문항 (정규화된 문항 임베딩)
+- kdst_topk_lists(bucket, item_hash, truncated): 만들어 둔 목록. bucket은 'all' / 'child:<id>' / 'parent:<id>'
+- kdst_topk(bucket, item_hash, diary_id, similarity): 목록의 행 (항상 범위 내 유사도 상위 n개)
+
+쓰기 규칙 (upsert_diary/delete_diary의 쓰기 트랜잭션 안에서)
+- 업서트: 일기가 속한 범위의 목록이 있으면 (문항 수 × 차원) 행렬-벡터 곱 한 번으로 점수를 구해 넣고 DEPTH를 넘으면 최하위 삭제.
+  목록이 잘린 적(truncated) 있으면 목록 최솟값보다 낮은 일기는 넣지 않습니다 (목록 밖 일기와 순위를 알 수 없음).
+- 삭제: 일기의 행만 지움. 잘린 목록이 KDST_TOP_K개 미만으로 줄면 다음 조회 때 그 범위를 다시 계산합니다.
+- 백필처럼 목록을 갱신하지 않는 일괄 쓰기는 invalidate()로 전체 목록을 버립니다.
+
+delete_diary.py에서도 사용하므로 numpy는 필요한 함수 안에서만 import합니다.
+설정: KDST_TOPK=0이면 사용하지 않음 (보고서 시점에 검색), KDST_TOPK_DEPTH (기본 20)
+
+실행:
+  python kdst_topk.py status   # 범위/문항 목록 수, 저장된 행 수
+  python kdst_topk.py clear    # 전체 목록 삭제 (다음 보고서 조회 때 다시 계산)
+"""
+
+import json
+import os
+import sys
+
+from diary_chunks import CHUNK_AGGREGATION, CHUNK_TOP_M
+from sqlite_pool import DEFAULT_DB_PATH, connection, transaction
+
+KDST_TOPK_ENABLED = os.getenv('KDST_TOPK', '1').lower() not in ('0', 'false', 'no')
+KDST_TOPK_DEPTH = max(1, int(os.getenv('KDST_TOPK_DEPTH', '20')))
+
+# 문항 item_hash 튜플 → 문항 임베딩 행렬
+_item_matrix_cache = {}
+
+
+def ensure_topk_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS kdst_items (
+            item_hash TEXT PRIMARY KEY,
+            text TEXT,
+            embedding BLOB NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS kdst_topk_lists (
+            bucket TEXT NOT NULL,
+            item_hash TEXT NOT NULL,
+            truncated INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, item_hash)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS kdst_topk (
+            bucket TEXT NOT NULL,
+            item_hash TEXT NOT NULL,
+            diary_id INTEGER NOT NULL,
+            similarity REAL NOT NULL,
+            PRIMARY KEY (bucket, item_hash, diary_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_kdst_topk_diary ON kdst_topk (diary_id)')
+
+
+def scope_bucket(scope):
+    """검색 범위 → 목록 범위 키 (날짜 조건이나 아이+부모 조합처럼 목록으로 둘 수 없는 범위는 None)"""
+    scope = {key: value for key, value in (scope or {}).items() if value not in (None, '')}
+    if not scope:
+        return 'all'
+    if len(scope) == 1 and 'child_id' in scope:
+        return f"child:{scope['child_id']}"
+    if len(scope) == 1 and 'parent_id' in scope:
+        return f"parent:{scope['parent_id']}"
+    return None
+
+
+def diary_buckets(child_id, parent_id):
+    """일기가 속하는 목록 범위 키"""
+    buckets = ['all']
+    if child_id not in (None, ''):
+        buckets.append(f'child:{child_id}')
+    if parent_id not in (None, ''):
+        buckets.append(f'parent:{parent_id}')
+    return buckets
+
+
+def _item_matrix(cursor, item_hashes):
+    """문항 임베딩 (문항 수, 차원) 행렬
+
+    item_hash에 모델과 문항이 들어 있어 임베딩이 바뀌지 않으므로, 같은 문항 목록이면 만든 행렬을 프로세스 안에서 재사용합니다.
+    """
+    matrix = _item_matrix_cache.get(item_hashes)
+    if matrix is None:
+        import numpy as np
+        from vector_store import decode_embedding
+
+        vectors = dict(cursor.execute(
+            f"SELECT item_hash, embedding FROM kdst_items WHERE item_hash IN ({','.join('?' * len(item_hashes))})",
+            item_hashes
+        ).fetchall())
+        matrix = np.vstack([decode_embedding(vectors[h]) for h in item_hashes])
+        if len(_item_matrix_cache) >= 64:
+            _item_matrix_cache.clear()
+        _item_matrix_cache[item_hashes] = matrix
+    return matrix
+
+
+def remove_diary(cursor, diary_id):
+    """모든 목록에서 일기 삭제 (쓰기 트랜잭션 안에서 호출)"""
+    cursor.execute('DELETE FROM kdst_topk WHERE diary_id = ?', (diary_id,))
+
+
+def invalidate(cursor):
+    """전체 목록 삭제 (목록을 갱신하지 않는 일괄 쓰기 후). 문항 임베딩은 남겨 둠"""
+    cursor.execute('DELETE FROM kdst_topk')
+    cursor.execute('DELETE FROM kdst_topk_lists')
+
+
+def update_diary(cursor, diary_id, embedding, chunk_vectors=(), child_id=None, parent_id=None):
+    """업서트한 일기를 그 일기가 속한 범위의 목록에 반영 (쓰기 트랜잭션 안에서 호출). 넣은 행 수를 반환
+
+    점수는 검색과 같게 코사인 유사도이며, 청크가 있는 일기는 청크 유사도 집계(CHUNK_AGGREGATION)를 씁니다.
+    """
+    remove_diary(cursor, diary_id)
+    buckets = diary_buckets(child_id, parent_id)
+    # 목록별 (행 수, 최솟값)을 목록과 함께 한 번에 읽음
+    lists = cursor.execute(f'''
+        SELECT l.bucket, l.item_hash, l.truncated, COUNT(t.diary_id), MIN(t.similarity)
+        FROM kdst_topk_lists l LEFT JOIN kdst_topk t ON t.bucket = l.bucket AND t.item_hash = l.item_hash
+        WHERE l.bucket IN ({','.join('?' * len(buckets))})
+        GROUP BY l.bucket, l.item_hash
+    ''', buckets).fetchall()
+    if not lists:
+        return 0
+
+    from vector_search import ChunkIndex, normalize_rows
+
+    item_hashes = tuple(dict.fromkeys(item_hash for _, item_hash, _, _, _ in lists))
+    items = _item_matrix(cursor, item_hashes)
+    chunk_vectors = list(chunk_vectors or ())
+    if chunk_vectors:
+        aggregated = ChunkIndex(chunk_vectors, [diary_id] * len(chunk_vectors)).aggregate_batch(
+            items, CHUNK_AGGREGATION, CHUNK_TOP_M
+        )
+        scores = [row[diary_id] for row in aggregated]
+    else:
+        scores = (items @ normalize_rows(embedding)[0]).tolist()
+    score_of = dict(zip(item_hashes, scores))
+
+    inserts, overflow = [], []
+    for bucket, item_hash, truncated, count, lowest in lists:
+        score = float(score_of[item_hash])
+        if truncated and (count == 0 or score < lowest):
+            continue
+        inserts.append((bucket, item_hash, diary_id, score))
+        if count + 1 > KDST_TOPK_DEPTH:
+            overflow.append((bucket, item_hash))
+    cursor.executemany(
+        'INSERT OR REPLACE INTO kdst_topk (bucket, item_hash, diary_id, similarity) VALUES (?, ?, ?, ?)', inserts
+    )
+    if overflow:
+        cursor.executemany('''
+            DELETE FROM kdst_topk WHERE bucket = ? AND item_hash = ? AND diary_id = (
+                SELECT diary_id FROM kdst_topk WHERE bucket = ? AND item_hash = ? ORDER BY similarity, diary_id DESC LIMIT 1
+            )
+        ''', [(bucket, item_hash, bucket, item_hash) for bucket, item_hash in overflow])
+        cursor.executemany(
+            'UPDATE kdst_topk_lists SET truncated = 1 WHERE bucket = ? AND item_hash = ?', overflow
+        )
+    return len(inserts)
+
+
+def read_lists(conn, bucket, item_hashes, top_k):
+    """{item_hash: [(diary_id, similarity), ...]} 중 바로 쓸 수 있는 목록과, 다시 계산해야 하는 문항 목록
+
+    목록이 없거나, 잘린 목록이 top_k개 미만으로 줄었으면 다시 계산 대상입니다.
+    """
+    item_hashes = list(dict.fromkeys(item_hashes))
+    placeholders = ','.join('?' * len(item_hashes))
+    truncated = dict(conn.execute(
+        f'SELECT item_hash, truncated FROM kdst_topk_lists WHERE bucket = ? AND item_hash IN ({placeholders})',
+        [bucket] + item_hashes
+    ).fetchall())
+    rows = {item_hash: [] for item_hash in truncated}
+    for item_hash, diary_id, similarity in conn.execute(
+        f'SELECT item_hash, diary_id, similarity FROM kdst_topk WHERE bucket = ? AND item_hash IN ({placeholders}) '
+        'ORDER BY item_hash, similarity DESC',
+        [bucket] + item_hashes
+    ):
+        rows[item_hash].append((diary_id, similarity))
+    stale = [h for h in item_hashes if h not in truncated or (truncated[h] and len(rows[h]) < top_k)]
+    return {h: hits[:top_k] for h, hits in rows.items() if h not in stale}, stale
+
+
+def store_lists(conn, bucket, items, hits_per_item, truncated):
+    """다시 계산한 목록 저장 (쓰기 트랜잭션 안에서 호출)
+
+    items: [(item_hash, text, 정규화된 임베딩 BLOB)], hits_per_item: 문항별 [(diary_id, similarity), ...]
+    """
+    conn.executemany(
+        'INSERT OR REPLACE INTO kdst_items (item_hash, text, embedding) VALUES (?, ?, ?)', items
+    )
+    for (item_hash, _, _), hits in zip(items, hits_per_item):
+        conn.execute('DELETE FROM kdst_topk WHERE bucket = ? AND item_hash = ?', (bucket, item_hash))
+        conn.executemany(
+            'INSERT INTO kdst_topk (bucket, item_hash, diary_id, similarity) VALUES (?, ?, ?, ?)',
+            [(bucket, item_hash, diary_id, float(similarity)) for diary_id, similarity in hits]
+        )
+        conn.execute(
+            'INSERT OR REPLACE INTO kdst_topk_lists (bucket, item_hash, truncated) VALUES (?, ?, ?)',
+            (bucket, item_hash, int(truncated))
+        )
+
+
+def status(db_path=DEFAULT_DB_PATH):
+    with connection(db_path) as conn:
+        return {
+            "enabled": KDST_TOPK_ENABLED,
+            "depth": KDST_TOPK_DEPTH,
+            "items": conn.execute('SELECT COUNT(*) FROM kdst_items').fetchone()[0],
+            "buckets": conn.execute('SELECT COUNT(DISTINCT bucket) FROM kdst_topk_lists').fetchone()[0],
+            "lists": conn.execute('SELECT COUNT(*) FROM kdst_topk_lists').fetchone()[0],
+            "truncated_lists": conn.execute('SELECT COUNT(*) FROM kdst_topk_lists WHERE truncated = 1').fetchone()[0],
+            "rows": conn.execute('SELECT COUNT(*) FROM kdst_topk').fetchone()[0]
+        }
+
+
+def main():
+    """메인 함수"""
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    try:
+        if command == 'clear':
+            with transaction(DEFAULT_DB_PATH) as conn:
+                invalidate(conn)
+        elif command != 'status':
+            raise ValueError(f"알 수 없는 명령: {command} (status | clear)")
+        result = {"success": True, **status()}
+    except Exception as e:
+        result = {"success": False, "message": str(e)}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+BM25 역색인 (diary_embeddings.text, 한국어 문자 n-gram)
+
+형태소 분석기 없이도 조사/어미가 붙은 한국어 단어가 매칭되도록, 어절을 문자 bigram으로 나눠 색인합니다.
+  "밤에 자주 깨요" → 밤에 / 자주 / 깨요,  "수면패턴이" → 수면 면패 패턴 턴이
+2글자 이하 어절은 그대로 하나의 term이 됩니다.
+
+- lexical_postings(term, diary_id, tf), lexical_docs(diary_id, length) 테이블을 diary_embeddings.db에 둡니다.
+- 문서 수와 총 길이는 lexical_stats 한 행에 두고 lexical_docs 트리거가 갱신하므로, 검색마다 전체를 세지 않습니다.
+- upsert_diary/delete_diary/백필이 같은 쓰기 트랜잭션 안에서 문서 단위로 갱신합니다.
+  diary_embeddings 행이 추가/삭제되거나 텍스트가 바뀌면 트리거가 lexical_pending에 diary_id를 넣고
+  색인을 갱신하면 빠지므로, 색인을 거치지 않은 쓰기만 대기열에 남아 검색 시 sync_lexical_index가 반영합니다.
+- 대부분의 문서에 나오는 term(문서 빈도 > LEXICAL_MAX_DF_RATIO)은 점수에 거의 기여하지 않으므로 조회에서 제외합니다.
+
+실행:
+  python lexical_index.py rebuild          # 전체 재색인
+  python lexical_index.py search "밤잠"     # BM25 상위 결과 확인
+"""
+
+import json
+import math
+import re
+import sys
+import unicodedata
+from collections import Counter
+
+from sqlite_pool import DEFAULT_DB_PATH, connection, transaction
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+LEXICAL_MAX_DF_RATIO = 0.5
+
+_WORD_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """텍스트 → term 목록 (소문자화, 어절별 문자 bigram)"""
+    terms = []
+    for word in _WORD_PATTERN.findall(unicodedata.normalize('NFC', str(text or '')).lower()):
+        if len(word) <= 2:
+            terms.append(word)
+        else:
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+def ensure_lexical_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lexical_postings (
+            term TEXT NOT NULL,
+            diary_id INTEGER NOT NULL,
+            tf INTEGER NOT NULL,
+            PRIMARY KEY (term, diary_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_lexical_postings_diary ON lexical_postings (diary_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lexical_docs (
+            diary_id INTEGER PRIMARY KEY,
+            length INTEGER NOT NULL
+        )
+    ''')
+
+
+def ensure_lexical_stats(cursor):
+    """문서 수/총 길이 통계 행과 색인 대기열, 이를 갱신하는 트리거 (sqlite_pool 마이그레이션 v3)
+
+    이미 있는 DB는 색인되지 않은 일기와 삭제된 일기의 문서를 대기열에 넣어 첫 검색 때 반영합니다.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lexical_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            n_docs INTEGER NOT NULL,
+            total_length INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute(
+        'INSERT OR IGNORE INTO lexical_stats (id, n_docs, total_length) '
+        'SELECT 1, COUNT(*), COALESCE(SUM(length), 0) FROM lexical_docs'
+    )
+    # lexical_docs는 삭제 후 INSERT로만 바꾸므로 (INSERT OR REPLACE는 삭제 트리거가 실행되지 않음) 두 트리거로 충분
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS lexical_docs_stats_insert AFTER INSERT ON lexical_docs BEGIN
+            UPDATE lexical_stats SET n_docs = n_docs + 1, total_length = total_length + NEW.length WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS lexical_docs_stats_delete AFTER DELETE ON lexical_docs BEGIN
+            UPDATE lexical_stats SET n_docs = n_docs - 1, total_length = total_length - OLD.length WHERE id = 1;
+        END
+    ''')
+
+    cursor.execute('CREATE TABLE IF NOT EXISTS lexical_pending (diary_id INTEGER PRIMARY KEY)')
+    # 트리거 안의 INSERT OR IGNORE는 바깥 문장(upsert의 ON CONFLICT)의 충돌 처리로 바뀌므로, 없는 id만 골라 넣음
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS diary_embeddings_lexical_insert AFTER INSERT ON diary_embeddings BEGIN
+            INSERT INTO lexical_pending (diary_id) SELECT NEW.diary_id
+            WHERE NEW.diary_id IS NOT NULL AND NEW.diary_id NOT IN (SELECT diary_id FROM lexical_pending);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS diary_embeddings_lexical_update
+        AFTER UPDATE OF text, diary_id ON diary_embeddings BEGIN
+            INSERT INTO lexical_pending (diary_id) SELECT id FROM (SELECT OLD.diary_id AS id UNION SELECT NEW.diary_id)
+            WHERE id IS NOT NULL AND id NOT IN (SELECT diary_id FROM lexical_pending);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS diary_embeddings_lexical_delete AFTER DELETE ON diary_embeddings BEGIN
+            INSERT INTO lexical_pending (diary_id) SELECT OLD.diary_id
+            WHERE OLD.diary_id IS NOT NULL AND OLD.diary_id NOT IN (SELECT diary_id FROM lexical_pending);
+        END
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO lexical_pending (diary_id)
+        SELECT e.diary_id FROM diary_embeddings e
+        LEFT JOIN lexical_docs d ON d.diary_id = e.diary_id
+        WHERE d.diary_id IS NULL
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO lexical_pending (diary_id)
+        SELECT d.diary_id FROM lexical_docs d
+        LEFT JOIN diary_embeddings e ON e.diary_id = d.diary_id
+        WHERE e.diary_id IS NULL
+    ''')
+
+
+def remove_document(cursor, diary_id):
+    """문서의 posting 삭제 (쓰기 트랜잭션 안에서 호출)"""
+    cursor.execute('DELETE FROM lexical_postings WHERE diary_id = ?', (diary_id,))
+    cursor.execute('DELETE FROM lexical_docs WHERE diary_id = ?', (diary_id,))
+    cursor.execute('DELETE FROM lexical_pending WHERE diary_id = ?', (diary_id,))
+
+
+def index_documents(cursor, documents):
+    """(diary_id, text) 목록을 (재)색인 (쓰기 트랜잭션 안에서 호출, 스키마는 sqlite_pool이 준비)"""
+    postings = []
+    docs = []
+    # 같은 일기가 여러 번 있으면 마지막 텍스트로 색인
+    for diary_id, text in dict(documents).items():
+        remove_document(cursor, diary_id)
+        terms = tokenize(text)
+        postings.extend((term, diary_id, tf) for term, tf in Counter(terms).items())
+        docs.append((diary_id, len(terms)))
+    cursor.executemany('INSERT INTO lexical_postings (term, diary_id, tf) VALUES (?, ?, ?)', postings)
+    cursor.executemany('INSERT INTO lexical_docs (diary_id, length) VALUES (?, ?)', docs)
+
+
+def index_document(cursor, diary_id, text):
+    index_documents(cursor, [(diary_id, text)])
+
+
+def sync_lexical_index(db_path=DEFAULT_DB_PATH, batch_size=1000):
+    """대기열(lexical_pending)의 일기를 색인에 반영 (행이 있으면 재색인, 없으면 제거). 반영한 문서 수를 반환
+
+    대기열이 비어 있으면 조회 한 번으로 끝나고, 반영은 batch_size개씩 짧은 쓰기 트랜잭션으로 나눕니다.
+    """
+    with connection(db_path) as conn:
+        if conn.execute('SELECT 1 FROM lexical_pending LIMIT 1').fetchone() is None:
+            return 0
+    changed = 0
+    while True:
+        with transaction(db_path) as conn:
+            cursor = conn.cursor()
+            pending = [row[0] for row in cursor.execute(
+                'SELECT diary_id FROM lexical_pending LIMIT ?', (batch_size,)
+            ).fetchall()]
+            if not pending:
+                return changed
+            documents = cursor.execute(
+                f"SELECT diary_id, text FROM diary_embeddings WHERE diary_id IN ({','.join('?' * len(pending))})",
+                pending
+            ).fetchall()
+            index_documents(cursor, documents)
+            for diary_id in set(pending) - {row[0] for row in documents}:
+                remove_document(cursor, diary_id)
+            changed += len(pending)
+
+
+def bm25_search(conn, query, limit=50, scope_where='', scope_params=()):
+    """BM25 상위 (diary_id, score) 목록
+
+    scope_where/scope_params: vector_store.scope_where_clause 결과 (diary_embeddings 컬럼 조건)
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms or limit <= 0:
+        return []
+    cursor = conn.cursor()
+    stats = cursor.execute('SELECT n_docs, total_length FROM lexical_stats WHERE id = 1').fetchone()
+    if not stats or stats[0] <= 0:
+        return []
+    n_docs = stats[0]
+    avg_length = stats[1] / n_docs or 1.0
+
+    placeholders = ','.join('?' * len(terms))
+    doc_freq = dict(cursor.execute(
+        f'SELECT term, COUNT(*) FROM lexical_postings WHERE term IN ({placeholders}) GROUP BY term', terms
+    ).fetchall())
+    # 흔한 term은 제외하되, 모두 흔하면 가장 드문 term 몇 개는 남김
+    kept = [t for t in terms if t in doc_freq and doc_freq[t] <= n_docs * LEXICAL_MAX_DF_RATIO]
+    if not kept:
+        kept = sorted(doc_freq, key=doc_freq.get)[:3]
+    if not kept:
+        return []
+    idf = {t: math.log(1 + (n_docs - doc_freq[t] + 0.5) / (doc_freq[t] + 0.5)) for t in kept}
+
+    where = scope_where.replace(' WHERE ', ' AND ', 1) if scope_where else ''
+    join = ' JOIN diary_embeddings e ON e.diary_id = p.diary_id' if where else ''
+    rows = cursor.execute(
+        f'''SELECT p.term, p.diary_id, p.tf, d.length FROM lexical_postings p
+            JOIN lexical_docs d ON d.diary_id = p.diary_id{join}
+            WHERE p.term IN ({','.join('?' * len(kept))}){where}''',
+        kept + list(scope_params)
+    ).fetchall()
+
+    scores = {}
+    for term, diary_id, tf, length in rows:
+        norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+        scores[diary_id] = scores.get(diary_id, 0.0) + idf[term] * tf * (BM25_K1 + 1) / norm
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """여러 순위 목록(id 리스트)을 RRF 점수 {id: score}로 결합"""
+    fused = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return fused
+
+
+def main():
+    """메인 함수"""
+    command = sys.argv[1] if len(sys.argv) > 1 else 'rebuild'
+    try:
+        if command == 'rebuild':
+            with transaction(DEFAULT_DB_PATH) as conn:
+                for table in ('lexical_postings', 'lexical_docs', 'lexical_stats'):
+                    conn.execute(f'DROP TABLE IF EXISTS {table}')
+                # 빈 색인을 만들면 모든 일기가 대기열에 들어감
+                ensure_lexical_schema(conn.cursor())
+                ensure_lexical_stats(conn.cursor())
+            result = {"success": True, "message": "BM25 색인 재구성 완료", "indexed": sync_lexical_index()}
+        elif command == 'search' and len(sys.argv) > 2:
+            sync_lexical_index()
+            with connection(DEFAULT_DB_PATH) as conn:
+                hits = bm25_search(conn, sys.argv[2], limit=10)
+            result = {"success": True, "results": [{"diary_id": d, "bm25": round(s, 4)} for d, s in hits]}
+        else:
+            result = {"success": False, "message": "사용법: python lexical_index.py rebuild | search <쿼리>"}
+    except Exception as e:
+        result = {"success": False, "message": f"BM25 색인 작업 실패: {str(e)}"}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+diary_embeddings.db의 JSON 텍스트 임베딩을 float32 바이너리 형식으로 변환 (1회성)
+
+실행: python migrate_embeddings.py [DB 경로]
+이미 바이너리인 행은 건너뛰므로 여러 번 실행해도 안전합니다.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+
+from vector_store import EMBEDDING_DB_PATH, decode_embedding, encode_embedding, ensure_schema, is_binary_embedding
+
+
+def migrate_embeddings(db_path=EMBEDDING_DB_PATH):
+    """JSON 텍스트 임베딩을 바이너리로 제자리 변환"""
+    try:
+        if not os.path.exists(db_path):
+            return {"success": False, "message": "벡터 DB가 존재하지 않습니다."}
+
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        # 범위 검색용 컬럼/인덱스도 함께 준비
+        ensure_schema(cursor)
+        conn.commit()
+        cursor.execute('SELECT id, embedding FROM diary_embeddings')
+        rows = cursor.fetchall()
+
+        converted = 0
+        skipped = 0
+        failed = 0
+        bytes_before = 0
+        bytes_after = 0
+        updates = []
+
+        for row_id, blob in rows:
+            if blob is None or is_binary_embedding(blob):
+                skipped += 1
+                continue
+            try:
+                encoded = encode_embedding(decode_embedding(blob))
+            except Exception as e:
+                print(f"행 {row_id}: 변환 실패 - {e}", file=sys.stderr)
+                failed += 1
+                continue
+            bytes_before += len(blob)
+            bytes_after += len(encoded)
+            updates.append((encoded, row_id))
+            converted += 1
+
+        # 한 트랜잭션으로 반영 (중간 실패 시 전체 롤백)
+        with conn:
+            cursor.executemany('UPDATE diary_embeddings SET embedding = ? WHERE id = ?', updates)
+        if updates:
+            conn.execute('VACUUM')
+        conn.close()
+
+        return {
+            "success": True,
+            "message": "임베딩 바이너리 변환 완료",
+            "total_rows": len(rows),
+            "converted": converted,
+            "skipped": skipped,
+            "failed": failed,
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after
+        }
+
+    except Exception as e:
+        return {"success": False, "message": f"변환 실패: {str(e)}"}
+
+
+def main():
+    """메인 함수"""
+    db_path = sys.argv[1] if len(sys.argv) > 1 else EMBEDDING_DB_PATH
+    result = migrate_embeddings(db_path)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
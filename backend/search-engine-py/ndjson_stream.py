@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+--stream 모드 공용 처리 (NDJSON 요청/응답)
+
+스크립트를 --stream 옵션으로 실행하면 stdin의 한 줄 = JSON 요청 하나로 계속 읽고,
+한 줄 = JSON 응답 하나를 요청 순서대로 stdout에 씁니다. 프로세스를 한 번만 띄우고 파이프를 계속 열어 두면
+요청마다 프로세스를 새로 띄우고 모델/DB를 다시 읽는 비용이 없어집니다.
+
+- 요청의 "request_id"를 응답에 그대로 붙여 돌려줍니다 (없으면 1부터 시작하는 요청 순번).
+- 첫 요청이 온 뒤 STREAM_MAX_WAIT_MS 동안(최대 STREAM_BATCH_SIZE개) 들어온 요청을 한 배치로 묶어
+  스크립트의 배치 처리 함수에 넘깁니다 (업서트 인코딩 한 번, 검색 행렬곱 한 번 등).
+- 배치가 끝날 때마다 응답을 flush하므로, 호출 측은 요청 하나를 쓰고 응답 한 줄을 기다려도 됩니다.
+- "timings": true인 요청(또는 --timings)의 응답에는 그 요청이 속한 배치 전체의 단계별 소요 시간이 붙습니다
+  (counters.batch_size = 배치의 요청 수).
+
+  printf '%s\\n' '{"request_id": 1, "query": "밤잠"}' '{"request_id": 2, "query": "뒤집기"}' \\
+    | python search_diaries.py --stream
+"""
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import request_timings
+
+STREAM_BATCH_SIZE = max(1, int(os.getenv('STREAM_BATCH_SIZE', '64')))
+STREAM_MAX_WAIT_MS = float(os.getenv('STREAM_MAX_WAIT_MS', '2'))
+
+STREAM_MODE = '--stream' in sys.argv
+
+
+def _read_lines(stream, lines):
+    for line in stream:
+        lines.put(line)
+    lines.put(None)
+
+
+def iter_line_batches(stream, batch_size=STREAM_BATCH_SIZE, max_wait_ms=STREAM_MAX_WAIT_MS):
+    """입력 줄을 배치로 묶어 내보냄 (읽기 스레드를 두어 Windows 파이프에서도 대기 시간을 지킴)"""
+    lines = queue.Queue()
+    threading.Thread(target=_read_lines, args=(stream, lines), daemon=True).start()
+    finished = False
+    while not finished:
+        line = lines.get()
+        if line is None:
+            return
+        batch = [line]
+        deadline = time.monotonic() + max_wait_ms / 1000.0
+        while len(batch) < batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                line = lines.get(timeout=remaining) if remaining > 0 else lines.get_nowait()
+            except queue.Empty:
+                break
+            if line is None:
+                finished = True
+                break
+            batch.append(line)
+        yield batch
+
+
+def run_stream(handle_batch, endpoint='stream', stream=None, out=None):
+    """NDJSON 요청을 배치로 handle_batch(payloads) → 결과 목록(같은 순서)에 넘기고 응답을 순서대로 출력"""
+    stream = stream or sys.stdin
+    out = out or sys.stdout
+    sequence = 0
+    for lines in iter_line_batches(stream):
+        responses = []
+        payloads = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            sequence += 1
+            try:
+                payload = json.loads(line)
+                if not isinstance(payload, dict):
+                    raise ValueError("요청은 JSON 객체여야 합니다.")
+            except ValueError as e:
+                responses.append(({"request_id": sequence}, {"success": False, "message": f"JSON 파싱 실패: {str(e)}"}))
+                continue
+            response = {"request_id": payload.get('request_id', sequence)}
+            responses.append((response, None))
+            payloads.append((response, payload))
+
+        if payloads:
+            with request_timings.request(endpoint) as timings:
+                timings.count('batch_size', len(payloads))
+                try:
+                    results = handle_batch([payload for _, payload in payloads])
+                except Exception as e:
+                    results = [{"success": False, "message": f"예상치 못한 오류: {str(e)}"}] * len(payloads)
+            for (response, payload), result in zip(payloads, results):
+                response.update(result)
+                if request_timings.requested(payload):
+                    response['timings'] = timings.to_dict()
+
+        for response, error in responses:
+            if error is not None:
+                response.update(error)
+            out.write(json.dumps(response, ensure_ascii=False) + '\n')
+        out.flush()
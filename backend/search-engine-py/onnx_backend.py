@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ONNX Runtime 임베딩 백엔드 (CPU 추론용)
+
+PyTorch SentenceTransformer의 트랜스포머 부분을 ONNX로 내보내고, 같은 토크나이저/최대 길이/풀링
+(SentenceTransformer의 Pooling 설정을 그대로 기록)으로 onnxruntime에서 인코딩합니다.
+선택적으로 가중치를 int8 동적 양자화한 모델도 함께 만듭니다.
+
+- EMBEDDING_BACKEND=onnx         - embedding_model.get_model()이 이 백엔드를 반환 (기본 torch)
+- EMBEDDING_ONNX_QUANTIZED=1     - int8 동적 양자화 모델 사용
+- EMBEDDING_ONNX_THREADS         - onnxruntime intra-op 스레드 수 (기본 0 = onnxruntime 기본값)
+
+내보내기와 비교에는 torch/sentence_transformers, 실행에는 onnxruntime과 transformers(토크나이저)가 필요합니다.
+
+실행:
+  python onnx_backend.py export [--quantize]        # my_local_qdrant_db/onnx/에 저장
+  python onnx_backend.py parity [--quantized]       # torch 대비 코사인 일치도/지연시간 (기준 미달이면 종료 코드 1)
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+from vector_store import VECTOR_DB_DIR
+
+ONNX_MODEL_DIR = os.path.join(VECTOR_DB_DIR, 'onnx')
+ONNX_MODEL_FILE = 'model.onnx'
+ONNX_QUANTIZED_MODEL_FILE = 'model.int8.onnx'
+ONNX_CONFIG_FILE = 'pooling.json'
+
+ONNX_QUANTIZED = os.getenv('EMBEDDING_ONNX_QUANTIZED', '').lower() in ('1', 'true', 'int8')
+ONNX_THREADS = int(os.getenv('EMBEDDING_ONNX_THREADS', '0'))
+
+# parity 기준: torch 대비 문장별 최소 코사인 (float32 / int8 양자화)
+PARITY_MIN_COSINE = 0.999
+PARITY_MIN_COSINE_QUANTIZED = 0.98
+
+# parity 확인용 기본 문장 (KDST 문항 + 일기 문장)
+PARITY_SAMPLE_TEXTS = [
+    "엎드린 자세에서 뒤집는다.",
+    "등을 대고 누운 자세에서 엎드린 자세로 뒤집는다.",
+    "누워 있을 때 자기 손을 바라보며 논다.",
+    "장난감을 잡으려고 손을 뻗는다.",
+    "엄마 목소리를 듣고 고개를 돌린다.",
+    "2024-01-17 : 오늘 아이가 처음으로 혼자 뒤집기를 했어요",
+    "밤에 자주 깨서 한참을 울다가 다시 잠들었다",
+    "블록을 세 개 쌓고 박수를 치며 웃었다",
+    "이유식으로 당근죽을 먹였는데 절반 정도 먹었다",
+    "할머니를 보고 낯을 가리며 울음을 터뜨렸다",
+]
+
+
+def _pooling_config(st_model):
+    """SentenceTransformer 모듈 구성에서 풀링 방식/정규화 여부/최대 길이를 읽음"""
+    modules = list(st_model)
+    pooling = next((m for m in modules if type(m).__name__ == 'Pooling'), None)
+    mode = pooling.get_pooling_mode_str() if pooling is not None else 'mean'
+    return {
+        "pooling": mode,
+        "normalize": any(type(m).__name__ == 'Normalize' for m in modules),
+        "max_seq_length": int(st_model.max_seq_length or 512),
+    }
+
+
+def export_onnx(output_dir=ONNX_MODEL_DIR, quantize=False):
+    """현재 torch 모델을 ONNX로 내보냄 (quantize=True면 int8 동적 양자화본도 생성)"""
+    import torch
+    from embedding_model import MODEL_NAME, get_torch_model
+
+    st_model = get_torch_model()
+    config = _pooling_config(st_model)
+    if config['pooling'] not in ('mean', 'cls', 'max'):
+        raise ValueError(f"지원하지 않는 풀링 방식: {config['pooling']}")
+    transformer = st_model[0]
+    auto_model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer.save_pretrained(output_dir)
+    sample = tokenizer(["온닉스 내보내기용 문장"], return_tensors='pt')
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            auto_model,
+            (sample['input_ids'], sample['attention_mask']),
+            model_path,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['last_hidden_state'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'last_hidden_state': {0: 'batch', 1: 'sequence'},
+            },
+            opset_version=14,
+        )
+    files = [ONNX_MODEL_FILE]
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(model_path, os.path.join(output_dir, ONNX_QUANTIZED_MODEL_FILE), weight_type=QuantType.QInt8)
+        files.append(ONNX_QUANTIZED_MODEL_FILE)
+
+    config['model_name'] = MODEL_NAME
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    return {"output_dir": output_dir, "files": files, **config}
+
+
+class OnnxSentenceEncoder:
+    """SentenceTransformer.encode와 같은 형태로 호출하는 onnxruntime 인코더"""
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED, threads=ONNX_THREADS):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        model_path = os.path.join(model_dir, model_file)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"ONNX 모델이 없습니다: {model_path} (python onnx_backend.py export 먼저 실행)")
+        with open(os.path.join(model_dir, ONNX_CONFIG_FILE), encoding='utf-8') as f:
+            self.config = json.load(f)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = self.config['max_seq_length']
+        self.quantized = quantized
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def _pool(self, hidden, attention_mask):
+        mode = self.config['pooling']
+        if mode == 'cls':
+            return hidden[:, 0]
+        mask = attention_mask[..., None].astype(np.float32)
+        if mode == 'max':
+            return np.where(mask > 0, hidden, -1e9).max(axis=1)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def _encode_batch(self, texts):
+        tokens = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors='np')
+        inputs = {name: tokens[name].astype(np.int64) for name in ('input_ids', 'attention_mask') if name in self._input_names}
+        hidden = self.session.run(['last_hidden_state'], inputs)[0]
+        pooled = self._pool(hidden, tokens['attention_mask']).astype(np.float32)
+        if self.config.get('normalize'):
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            pooled = pooled / np.clip(norms, 1e-12, None)
+        return pooled
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        """문자열 하나 → (D,) 벡터, 문자열 목록 → (N, D) 행렬"""
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        # 길이순으로 묶어 패딩을 줄인 뒤 원래 순서로 되돌림
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            chunk = order[start:start + batch_size]
+            for i, vector in zip(chunk, self._encode_batch([texts[i] for i in chunk])):
+                vectors[i] = vector
+        matrix = np.vstack(vectors)
+        return matrix[0] if single else matrix
+
+
+def _parity_texts(limit):
+    """parity 확인용 문장 (기본 문장 + diary_embeddings.db의 일기 일부)"""
+    from vector_store import EMBEDDING_DB_PATH
+
+    texts = list(PARITY_SAMPLE_TEXTS)
+    if os.path.exists(EMBEDDING_DB_PATH):
+        conn = sqlite3.connect(EMBEDDING_DB_PATH)
+        try:
+            rows = conn.execute('SELECT text FROM diary_embeddings WHERE text IS NOT NULL LIMIT ?', (limit,)).fetchall()
+            texts.extend(row[0] for row in rows)
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            conn.close()
+    return texts
+
+
+def _latency_ms(encoder, texts, batch_size):
+    encoder.encode(texts[0])  # 워밍업
+    start = time.perf_counter()
+    for text in texts:
+        encoder.encode(text)
+    per_text = (time.perf_counter() - start) * 1000.0 / len(texts)
+    start = time.perf_counter()
+    encoder.encode(texts, batch_size=batch_size)
+    batch = (time.perf_counter() - start) * 1000.0
+    return round(per_text, 2), round(batch, 2)
+
+
+def parity_check(quantized=False, limit=200, batch_size=64):
+    """torch 백엔드 대비 임베딩 코사인과 문장 간 유사도 순위 일치도, 지연시간 비교"""
+    from embedding_model import get_torch_model
+
+    texts = _parity_texts(limit)
+    torch_model = get_torch_model()
+    onnx_model = OnnxSentenceEncoder(quantized=quantized)
+
+    def normalized(matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        return matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+    reference = normalized(torch_model.encode(texts, batch_size=batch_size))
+    candidate = normalized(onnx_model.encode(texts, batch_size=batch_size))
+    cosine = np.sum(reference * candidate, axis=1)
+    # 검색 결과에 직접 영향을 주는 문장 간 유사도와 최근접 이웃 비교
+    ref_scores = reference @ reference.T
+    cand_scores = candidate @ candidate.T
+    np.fill_diagonal(ref_scores, -np.inf)
+    np.fill_diagonal(cand_scores, -np.inf)
+    score_diff = np.abs(ref_scores - cand_scores)[np.isfinite(ref_scores)]
+
+    torch_single, torch_batch = _latency_ms(torch_model, texts, batch_size)
+    onnx_single, onnx_batch = _latency_ms(onnx_model, texts, batch_size)
+    return {
+        "texts": len(texts),
+        "quantized": quantized,
+        "min_cosine": round(float(cosine.min()), 5),
+        "mean_cosine": round(float(cosine.mean()), 5),
+        "max_score_diff": round(float(score_diff.max()), 5) if score_diff.size else 0.0,
+        "top1_agreement": round(float(np.mean(ref_scores.argmax(axis=1) == cand_scores.argmax(axis=1))), 4),
+        "latency_ms": {
+            "torch_per_text": torch_single,
+            "onnx_per_text": onnx_single,
+            "torch_batch": torch_batch,
+            "onnx_batch": onnx_batch,
+        }
+    }
+
+
+def main():
+    """메인 함수"""
+    parser = argparse.ArgumentParser(description='ONNX Runtime 임베딩 백엔드 내보내기/비교')
+    parser.add_argument('command', choices=['export', 'parity'])
+    parser.add_argument('--quantize', action='store_true', help='export: int8 동적 양자화 모델도 생성')
+    parser.add_argument('--quantized', action='store_true', help='parity: int8 모델로 비교')
+    parser.add_argument('--limit', type=int, default=200, help='parity: DB에서 가져올 일기 수')
+    parser.add_argument('--min-cosine', type=float, default=None,
+                        help=f'parity: 최소 코사인 기준 (기본 float32 {PARITY_MIN_COSINE}, int8 {PARITY_MIN_COSINE_QUANTIZED})')
+    args = parser.parse_args()
+
+    passed = True
+    try:
+        if args.command == 'export':
+            result = {"success": True, **export_onnx(quantize=args.quantize)}
+        else:
+            min_cosine = args.min_cosine if args.min_cosine is not None else \
+                (PARITY_MIN_COSINE_QUANTIZED if args.quantized else PARITY_MIN_COSINE)
+            check = parity_check(quantized=args.quantized, limit=args.limit)
+            passed = check['min_cosine'] >= min_cosine
+            result = {"success": passed, "min_cosine_required": min_cosine, **check}
+    except Exception as e:
+        passed = False
+        result = {"success": False, "message": f"ONNX 백엔드 작업 실패: {str(e)}"}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
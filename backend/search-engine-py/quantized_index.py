@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+압축 임베딩 인덱스: int8(행별 scale) 또는 float16
+정규화된 행렬을 압축해서 메모리에 보관하고, 압축된 값으로 전체를 채점해
+상위 top_k × EMBEDDING_RERANK_FACTOR개 후보만 float32 원본 벡터로 다시 정확히 채점합니다.
+
+- int8: 행마다 scale = max|x| / 127로 양자화 (float32 대비 약 1/4)
+- float16: 반정밀도 (float32 대비 1/2)
+- 원본 벡터는 diary_embeddings.db에서 후보 행만 조회 (exact_fn)
+
+설정: EMBEDDING_QUANTIZATION=int8|float16 (비어 있으면 기존 float32 인덱스 사용)
+
+실행:
+  python quantized_index.py recall [--rows N] [--mode int8] [--min-recall 0.99]
+    # float32 정확 검색 대비 recall@k / 메모리 / 지연시간 (JSON 출력, 기준 미달이면 종료 코드 1)
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from request_timings import record_scan
+from sqlite_pool import connection
+from vector_search import VectorIndex, normalize_rows, top_k_indices
+from vector_store import (
+    EMBEDDING_DB_PATH,
+    decode_embedding,
+    embedding_row_item,
+    load_embedding_vectors,
+    load_live_index,
+    scope_where_clause,
+)
+
+QUANTIZATION_MODES = ('int8', 'float16')
+QUANTIZATION_MODE = os.getenv('EMBEDDING_QUANTIZATION', '').lower()
+if QUANTIZATION_MODE not in QUANTIZATION_MODES:
+    QUANTIZATION_MODE = None
+
+# 압축 점수로 고를 후보 수 = top_k × RERANK_FACTOR
+RERANK_FACTOR = int(os.getenv('EMBEDDING_RERANK_FACTOR', '4'))
+
+# 압축 코드를 float32 버퍼로 옮겨 채점할 때 한 번에 처리할 행 수 (버퍼 크기 상한)
+SCORE_CHUNK_ROWS = 8192
+
+
+def quantize_rows(matrix, mode):
+    """정규화된 행렬을 (codes, scales)로 압축 (float16은 scales가 None)"""
+    matrix = normalize_rows(matrix)
+    if mode == 'float16':
+        return matrix.astype(np.float16), None
+    if mode == 'int8':
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"지원하지 않는 양자화 방식: {mode}")
+
+
+def dequantize_rows(codes, scales):
+    """압축 행렬을 float32로 복원"""
+    matrix = codes.astype(np.float32)
+    if scales is not None:
+        matrix *= scales[:, None]
+    return matrix
+
+
+class QuantizedVectorIndex(VectorIndex):
+    """압축 행렬로 후보를 고르고 float32 원본으로 재정렬하는 검색 인덱스
+
+    exact_fn(rows) → 해당 행들의 float32 원본 벡터 (None이면 압축 값을 복원해 사용)
+    전체 행렬을 float32로 복원하지 않으므로 matrix 속성은 없습니다 (VectorIndex 메서드는 모두 재정의).
+    """
+
+    def __init__(self, codes, scales, items, mode, exact_fn=None, rerank_factor=RERANK_FACTOR):
+        self.codes = codes
+        self.scales = scales
+        self.items = list(items)
+        self.mode = mode
+        self.exact_fn = exact_fn
+        self.rerank_factor = max(1, rerank_factor)
+
+    @classmethod
+    def from_vectors(cls, vectors, items, mode, exact_fn=None, rerank_factor=RERANK_FACTOR):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        codes, scales = quantize_rows(vectors, mode)
+        return cls(codes, scales, items, mode, exact_fn, rerank_factor)
+
+    @property
+    def matrix(self):
+        raise AttributeError("QuantizedVectorIndex는 float32 행렬을 보관하지 않습니다 (codes/scales 사용)")
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def approximate_scores(self, queries):
+        """정규화된 (Q, D) 쿼리와 전체 행의 압축 도메인 유사도 (Q, N)
+
+        코드는 SCORE_CHUNK_ROWS행씩 같은 float32 버퍼로 옮겨 곱하고, 행별 scale은 그 구간의 점수에만 곱합니다.
+        (numpy의 int8/float16 행렬곱은 BLAS를 쓰지 않아 훨씬 느림)
+        """
+        n_rows = self.codes.shape[0]
+        scores = np.empty((queries.shape[0], n_rows), dtype=np.float32)
+        buffer = np.empty((min(n_rows, SCORE_CHUNK_ROWS), self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, n_rows, SCORE_CHUNK_ROWS):
+            end = min(start + SCORE_CHUNK_ROWS, n_rows)
+            chunk = buffer[:end - start]
+            np.copyto(chunk, self.codes[start:end], casting='unsafe')
+            block = queries @ chunk.T
+            if self.scales is not None:
+                block *= self.scales[start:end]
+            scores[:, start:end] = block
+        return scores
+
+    def _exact_vectors(self, rows):
+        if self.exact_fn is None:
+            return dequantize_rows(self.codes[rows], None if self.scales is None else self.scales[rows])
+        return normalize_rows(self.exact_fn(rows))
+
+    def scores(self, query_vector):
+        return self.approximate_scores(normalize_rows(query_vector))[0]
+
+    def score_rows(self, query_vector, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        if not rows.size:
+            return np.zeros(0, dtype=np.float32)
+        return self._exact_vectors(rows) @ normalize_rows(query_vector)[0]
+
+    def search(self, query_vector, top_k, score_threshold=None):
+        return self.search_batch(query_vector, top_k, score_threshold)[0]
+
+    def search_batch(self, query_vectors, top_k, score_threshold=None, rerank=True):
+        """압축 점수 상위 후보를 모든 쿼리에 대해 모은 뒤, 원본 벡터를 한 번만 읽어 정확히 재채점"""
+        queries = normalize_rows(query_vectors)
+        if len(self) == 0:
+            return [[] for _ in range(queries.shape[0])]
+        approx = self.approximate_scores(queries)
+        record_scan(len(self) * queries.shape[0], queries.shape[0])
+        if not rerank:
+            return [[(self.items[i], float(row[i])) for i in top_k_indices(row, top_k, score_threshold)] for row in approx]
+
+        # 임계치는 정확한 유사도에만 적용 (압축 오차로 경계 근처 행을 놓치지 않도록)
+        candidates = [top_k_indices(row, top_k * self.rerank_factor) for row in approx]
+        rows = np.unique(np.concatenate(candidates)) if candidates else np.zeros(0, dtype=np.int64)
+        exact = queries @ self._exact_vectors(rows).T
+
+        results = []
+        for qi, cand in enumerate(candidates):
+            cand_scores = exact[qi, np.searchsorted(rows, cand)]
+            order = top_k_indices(cand_scores, top_k, score_threshold)
+            results.append([(self.items[cand[o]], float(cand_scores[o])) for o in order])
+        return results
+
+
+def load_quantized_index(mode, db_path=EMBEDDING_DB_PATH, scope=None, batch_size=4096):
+    """diary_embeddings.db(의 범위)를 배치 단위로 읽어 압축 인덱스로 로드 (float32 전체를 메모리에 두지 않음)"""
+    codes_parts, scale_parts, items, diary_ids = [], [], [], []
+    if os.path.exists(db_path):
+        with connection(db_path) as conn:
+            where, params = scope_where_clause(scope)
+            cursor = conn.execute('SELECT diary_id, text, embedding, date FROM diary_embeddings' + where, params)
+            columns = ('diary_id', 'text', 'embedding', 'date')
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                vectors = []
+                for values in batch:
+                    row = dict(zip(columns, values))
+                    try:
+                        vec = decode_embedding(row['embedding'])
+                    except Exception:
+                        continue
+                    if vectors and vec.shape[0] != vectors[0].shape[0]:
+                        continue
+                    vectors.append(vec)
+                    items.append(embedding_row_item(row))
+                    diary_ids.append(row['diary_id'])
+                if vectors:
+                    codes, scales = quantize_rows(np.vstack(vectors), mode)
+                    codes_parts.append(codes)
+                    scale_parts.append(scales)
+
+    if not codes_parts:
+        return QuantizedVectorIndex(np.zeros((0, 0), dtype=np.int8), None, [], mode)
+    codes = np.concatenate(codes_parts)
+    scales = np.concatenate(scale_parts) if mode == 'int8' else None
+    return QuantizedVectorIndex(
+        codes, scales, items, mode,
+        exact_fn=lambda rows: load_embedding_vectors([diary_ids[r] for r in rows], db_path)
+    )
+
+
+def recall_check(vectors, queries, mode, top_k=10, rerank_factor=RERANK_FACTOR):
+    """float32 정확 검색 대비 재정렬 전/후 recall@k, 메모리, 쿼리당 지연시간(ms)"""
+    items = [{'id': i} for i in range(len(vectors))]
+    exact_index = VectorIndex(vectors, items)
+    exact_matrix = exact_index.matrix
+    quantized = QuantizedVectorIndex.from_vectors(
+        vectors, items, mode, exact_fn=lambda rows: exact_matrix[rows], rerank_factor=rerank_factor
+    )
+
+    start = time.perf_counter()
+    truth = [{item['id'] for item, _ in hits} for hits in exact_index.search_batch(queries, top_k)]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    def measure(rerank):
+        start = time.perf_counter()
+        batch = quantized.search_batch(queries, top_k, rerank=rerank)
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        hits = sum(len(t & {item['id'] for item, _ in found}) for t, found in zip(truth, batch))
+        return round(hits / max(1, sum(len(t) for t in truth)), 4), round(elapsed_ms, 3)
+
+    approx_recall, approx_ms = measure(False)
+    rerank_recall, rerank_ms = measure(True)
+    return {
+        "mode": mode,
+        "rows": len(vectors),
+        "dim": int(exact_matrix.shape[1]),
+        "top_k": top_k,
+        "rerank_factor": quantized.rerank_factor,
+        "float32_bytes": int(exact_matrix.nbytes),
+        "compact_bytes": int(quantized.nbytes),
+        "memory_ratio": round(exact_matrix.nbytes / max(1, quantized.nbytes), 2),
+        "recall_at_k_compact_only": approx_recall,
+        "recall_at_k_reranked": rerank_recall,
+        "exact_latency_ms": round(exact_ms, 3),
+        "compact_only_latency_ms": approx_ms,
+        "reranked_latency_ms": rerank_ms
+    }
+
+
+def synthetic_vectors(n_rows, dim=768, n_queries=100, seed=0):
+    """군집 구조가 있는 합성 벡터와 쿼리 (recall 확인용)"""
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, n_rows // 100)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n_rows)] + rng.standard_normal((n_rows, dim)).astype(np.float32)
+    queries = centers[rng.integers(0, n_clusters, n_queries)] + rng.standard_normal((n_queries, dim)).astype(np.float32)
+    return vectors, queries
+
+
+def main():
+    """메인 함수"""
+    parser = argparse.ArgumentParser(description='압축 임베딩 인덱스 recall 확인')
+    parser.add_argument('command', choices=['recall'])
+    parser.add_argument('--rows', type=int, default=20000, help='합성 벡터 수 (0이면 diary_embeddings.db 사용)')
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--mode', choices=QUANTIZATION_MODES + ('all',), default='all')
+    parser.add_argument('--rerank-factor', type=int, default=RERANK_FACTOR)
+    parser.add_argument('--min-recall', type=float, default=0.99, help='재정렬 후 recall@k가 이보다 낮으면 실패')
+    args = parser.parse_args()
+
+    try:
+        if args.rows:
+            vectors, queries = synthetic_vectors(args.rows, args.dim, args.queries)
+        else:
+            vectors = load_live_index().matrix
+            rng = np.random.default_rng(1)
+            picks = rng.integers(0, len(vectors), args.queries)
+            queries = vectors[picks] + 0.05 * rng.standard_normal((args.queries, vectors.shape[1])).astype(np.float32)
+
+        modes = QUANTIZATION_MODES if args.mode == 'all' else (args.mode,)
+        checks = [recall_check(vectors, queries, mode, args.top_k, args.rerank_factor) for mode in modes]
+        passed = all(check['recall_at_k_reranked'] >= args.min_recall for check in checks)
+        result = {"success": passed, "min_recall": args.min_recall, "checks": checks}
+    except Exception as e:
+        passed = False
+        result = {"success": False, "message": f"recall 확인 실패: {str(e)}"}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
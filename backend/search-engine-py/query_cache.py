@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+검색 쿼리 임베딩 LRU 캐시
+챗봇 후속 질문이나 보고서 재생성처럼 같은 쿼리가 반복되면 모델을 로드/실행하지 않고 캐시된 벡터를 사용합니다.
+
+- 키: (모델 이름, 정규화된 쿼리 텍스트의 해시) — NFC 정규화, 앞뒤 공백 제거, 연속 공백을 하나로
+- 메모리 LRU(최대 QUERY_CACHE_SIZE개) + 디스크(my_local_qdrant_db/query_embeddings.db) write-through
+  CLI처럼 매번 새로 뜨는 프로세스도 디스크에서 이어서 사용하며, 디스크도 같은 개수로 유지합니다.
+  조회 시 사용 시각/누적 횟수는 모아 두었다가 QUERY_CACHE_FLUSH_SECONDS(기본 5초)마다, 저장할 때, 종료 시 기록합니다.
+- QUERY_CACHE_TTL(초)이 0보다 크면 그보다 오래된 항목은 다시 인코딩
+- 적중/미적중 횟수: 프로세스별(stats(), 상주 서버 /health)과 디스크 누적(python query_cache.py, 메모리 적중 제외)
+
+(KDST 표준 문항은 question_cache.py에 만료 없이 저장합니다.)
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from request_timings import record_cache
+from sqlite_pool import connection, transaction
+from vector_store import EMBEDDING_DB_PATH, decode_embedding, encode_embedding, text_hash
+
+QUERY_CACHE_DB_PATH = os.path.join(os.path.dirname(EMBEDDING_DB_PATH), 'query_embeddings.db')
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '1024'))
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', '0'))
+QUERY_CACHE_PERSIST = os.getenv('QUERY_CACHE_PERSIST', '1').lower() not in ('0', 'false', 'no')
+QUERY_CACHE_FLUSH_SECONDS = float(os.getenv('QUERY_CACHE_FLUSH_SECONDS', '5'))
+
+
+def normalize_query(text):
+    """캐시 키와 인코딩에 사용할 정규화된 쿼리"""
+    return ' '.join(unicodedata.normalize('NFC', str(text)).split())
+
+
+def ensure_query_cache_schema(conn):
+    """쿼리 캐시 DB 테이블 (연결 풀이 처음 여는 연결에서 한 번 실행)"""
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                model_name TEXT NOT NULL,
+                query_hash TEXT NOT NULL,
+                query TEXT,
+                embedding BLOB,
+                stored_at REAL,
+                last_used REAL,
+                PRIMARY KEY (model_name, query_hash)
+            )
+        ''')
+        conn.execute('CREATE TABLE IF NOT EXISTS query_cache_stats (name TEXT PRIMARY KEY, value INTEGER)')
+
+
+class QueryEmbeddingCache:
+    """(모델 이름, 정규화 쿼리) → 임베딩 LRU (선택적 TTL, 선택적 디스크 저장)
+
+    조회는 디스크에 쓰지 않습니다. 사용 시각(last_used), 만료 삭제, 누적 횟수는 메모리에 모았다가
+    다음 put, QUERY_CACHE_FLUSH_SECONDS가 지난 조회, 프로세스 종료 때 한 트랜잭션으로 기록합니다.
+    잠금은 메모리 상태에만 쓰고 디스크 I/O는 잠금 밖에서 합니다.
+    """
+
+    def __init__(self, capacity=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL, path=None,
+                 flush_seconds=QUERY_CACHE_FLUSH_SECONDS):
+        self.capacity = max(1, capacity)
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        # (model_name, key) → (vector, stored_at)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        # 디스크에 아직 기록하지 않은 변경: (model_name, key) → last_used, 만료된 키, 누적 횟수
+        self._touched = {}
+        self._expired_keys = set()
+        self._stat_deltas = Counter()
+        self._last_flush = time.monotonic()
+
+    def _is_expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def _remember(self, cache_key, vector, stored_at):
+        self._entries[cache_key] = (vector, stored_at)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, query, model_name):
+        """캐시된 임베딩 (없거나 만료되었으면 None)"""
+        cache_key = (model_name, text_hash(normalize_query(query)))
+        now = time.time()
+        vector = None
+        with self.lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                if not self._is_expired(entry[1], now):
+                    self._entries.move_to_end(cache_key)
+                    self.hits += 1
+                    if self.path:
+                        self._touched[cache_key] = now
+                    record_cache('query_cache', True)
+                    vector = entry[0]
+                else:
+                    del self._entries[cache_key]
+                    self.expired += 1
+        if vector is not None:
+            self._flush_if_due()
+            return vector
+
+        # 디스크 조회는 잠금 밖에서 (다른 스레드의 메모리 적중을 막지 않음)
+        row = self._get_from_disk(cache_key)
+        with self.lock:
+            vector = None
+            if row is not None and self._is_expired(row[1], now):
+                self._expired_keys.add(cache_key)
+                self._touched.pop(cache_key, None)
+                self.expired += 1
+            elif row is not None:
+                vector = decode_embedding(row[0])
+                self._remember(cache_key, vector, row[1])
+                self._touched[cache_key] = now
+            if vector is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if self.path:
+                self._stat_deltas['hits' if vector is not None else 'misses'] += 1
+            record_cache('query_cache', vector is not None)
+        self._flush_if_due()
+        return vector
+
+    def _get_from_disk(self, cache_key):
+        """디스크의 (embedding, stored_at) 행 (없으면 None)"""
+        if not self.path or not os.path.exists(self.path):
+            return None
+        with connection(self.path, ensure_query_cache_schema) as conn:
+            return conn.execute(
+                'SELECT embedding, stored_at FROM query_embeddings WHERE model_name = ? AND query_hash = ?',
+                cache_key
+            ).fetchone()
+
+    def _take_pending(self):
+        """기록할 변경을 꺼내고 비움 (잠금 안에서 호출)"""
+        pending = (self._touched, self._expired_keys, self._stat_deltas)
+        self._touched, self._expired_keys, self._stat_deltas = {}, set(), Counter()
+        self._last_flush = time.monotonic()
+        return pending
+
+    def _write_pending(self, conn, pending):
+        touched, expired_keys, stat_deltas = pending
+        conn.executemany(
+            'UPDATE query_embeddings SET last_used = MAX(COALESCE(last_used, 0), ?) WHERE model_name = ? AND query_hash = ?',
+            [(last_used,) + cache_key for cache_key, last_used in touched.items()]
+        )
+        conn.executemany(
+            'DELETE FROM query_embeddings WHERE model_name = ? AND query_hash = ?', list(expired_keys)
+        )
+        conn.executemany('''
+            INSERT INTO query_cache_stats (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        ''', list(stat_deltas.items()))
+
+    def flush(self):
+        """메모리에 모아 둔 사용 시각/만료/누적 횟수를 디스크에 기록 (실패하면 버림, 캐시 정확성과 무관)"""
+        if not self.path:
+            return
+        with self.lock:
+            pending = self._take_pending()
+        if not any(pending) or not os.path.exists(self.path):
+            return
+        try:
+            with transaction(self.path, ensure_query_cache_schema) as conn:
+                self._write_pending(conn, pending)
+        except sqlite3.Error as e:
+            print(f"쿼리 캐시 사용 기록 저장 실패: {e}", file=sys.stderr)
+
+    def _flush_if_due(self):
+        if self.path and time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def put(self, query, model_name, vector):
+        """임베딩 저장 (디스크에도 기록하고 capacity를 넘는 오래된 항목은 정리)"""
+        normalized = normalize_query(query)
+        cache_key = (model_name, text_hash(normalized))
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        now = time.time()
+        with self.lock:
+            self._remember(cache_key, vector, now)
+            if not self.path:
+                return
+            # 오래된 항목을 지우기 전에 모아 둔 사용 시각을 함께 기록
+            pending = self._take_pending()
+            pending[1].discard(cache_key)
+        with transaction(self.path, ensure_query_cache_schema) as conn:
+            self._write_pending(conn, pending)
+            conn.execute(
+                'INSERT OR REPLACE INTO query_embeddings (model_name, query_hash, query, embedding, stored_at, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+                cache_key + (normalized, encode_embedding(vector), now, now)
+            )
+            conn.execute('''
+                DELETE FROM query_embeddings WHERE rowid NOT IN (
+                    SELECT rowid FROM query_embeddings ORDER BY last_used DESC LIMIT ?
+                )
+            ''', (self.capacity,))
+
+    def get_or_encode(self, query, model_name, encode_fn):
+        """캐시에 있으면 그대로, 없으면 정규화된 쿼리를 encode_fn으로 인코딩 후 저장"""
+        vector = self.get(query, model_name)
+        if vector is None:
+            vector = np.asarray(encode_fn(normalize_query(query)), dtype=np.float32).reshape(-1)
+            self.put(query, model_name, vector)
+        return vector
+
+    def get_or_encode_many(self, queries, model_name, encode_many_fn):
+        """여러 쿼리의 임베딩 목록 (캐시에 없는 쿼리만 encode_many_fn으로 한 번에 인코딩)"""
+        vectors = [self.get(query, model_name) for query in queries]
+        missing = list(dict.fromkeys(normalize_query(q) for q, v in zip(queries, vectors) if v is None))
+        if missing:
+            encoded = dict(zip(missing, np.asarray(encode_many_fn(missing), dtype=np.float32).reshape(len(missing), -1)))
+            for query, vector in encoded.items():
+                self.put(query, model_name, vector)
+            vectors = [v if v is not None else encoded[normalize_query(q)] for q, v in zip(queries, vectors)]
+        return vectors
+
+    def stats(self):
+        """현재 프로세스의 적중/미적중 횟수와 크기"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "expired": self.expired
+        }
+
+    def persisted_stats(self):
+        """디스크에 누적된 적중/미적중 횟수와 저장된 항목 수"""
+        if not self.path or not os.path.exists(self.path):
+            return {"entries": 0, "hits": 0, "misses": 0, "hit_ratio": None}
+        self.flush()
+        with connection(self.path, ensure_query_cache_schema) as conn:
+            counts = dict(conn.execute('SELECT name, value FROM query_cache_stats').fetchall())
+            entries = conn.execute('SELECT COUNT(*) FROM query_embeddings').fetchone()[0]
+        hits, misses = counts.get('hits', 0), counts.get('misses', 0)
+        return {
+            "entries": entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None
+        }
+
+
+_default_cache = None
+
+
+def get_query_cache():
+    """프로세스 공용 쿼리 캐시 (QUERY_CACHE_PERSIST=0이면 메모리에만 보관)"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = QueryEmbeddingCache(path=QUERY_CACHE_DB_PATH if QUERY_CACHE_PERSIST else None)
+        # CLI처럼 한두 번 조회하고 끝나는 프로세스의 누적 횟수도 남김
+        atexit.register(_default_cache.flush)
+    return _default_cache
+
+
+def get_query_embedding(query, model_name, encode_fn):
+    """쿼리 임베딩 (캐시를 사용할 수 없으면 바로 인코딩)"""
+    try:
+        return get_query_cache().get_or_encode(query, model_name, encode_fn)
+    except sqlite3.Error as e:
+        print(f"쿼리 임베딩 캐시 사용 실패, 직접 인코딩: {e}", file=sys.stderr)
+        return np.asarray(encode_fn(normalize_query(query)), dtype=np.float32).reshape(-1)
+
+
+def get_query_embeddings(queries, model_name, encode_many_fn):
+    """여러 쿼리의 임베딩 목록 (캐시를 사용할 수 없으면 한 번에 인코딩)"""
+    try:
+        return get_query_cache().get_or_encode_many(queries, model_name, encode_many_fn)
+    except sqlite3.Error as e:
+        print(f"쿼리 임베딩 캐시 사용 실패, 직접 인코딩: {e}", file=sys.stderr)
+        encoded = np.asarray(encode_many_fn([normalize_query(q) for q in queries]), dtype=np.float32)
+        return list(encoded.reshape(len(queries), -1))
+
+
+def main():
+    """메인 함수: 누적 통계 출력 (clear로 캐시 비우기)"""
+    cache = QueryEmbeddingCache(path=QUERY_CACHE_DB_PATH)
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == 'clear':
+            if os.path.exists(QUERY_CACHE_DB_PATH):
+                with transaction(QUERY_CACHE_DB_PATH, ensure_query_cache_schema) as conn:
+                    conn.execute('DELETE FROM query_embeddings')
+                    conn.execute('DELETE FROM query_cache_stats')
+            result = {"success": True, "message": "쿼리 임베딩 캐시 삭제 완료"}
+        else:
+            result = {"success": True, "path": QUERY_CACHE_DB_PATH, **cache.persisted_stats()}
+    except Exception as e:
+        result = {"success": False, "message": f"쿼리 캐시 작업 실패: {str(e)}"}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+KDST 질문 임베딩 캐시
+K-DST 문항은 고정된 표준 문항이므로, (모델 이름, 문항 텍스트 해시) 기준으로
+임베딩을 diary_embeddings.db 옆의 question_embeddings.db에 저장해 두고 재사용합니다.
+
+워밍업 (전체 K-DST 문항 사전 임베딩):
+  python question_cache.py                   # MySQL questions 테이블의 전체 문항
+  echo '{"questions": [...]}' | python question_cache.py   # 직접 전달한 문항
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+
+from request_timings import record_cache
+from sqlite_pool import connection, transaction
+from vector_store import EMBEDDING_DB_PATH, decode_embedding, encode_embedding, text_hash
+
+QUESTION_CACHE_DB_PATH = os.path.join(os.path.dirname(EMBEDDING_DB_PATH), 'question_embeddings.db')
+
+# 캐시 형식이 바뀌면 올려서 기존 캐시를 폐기
+QUESTION_CACHE_VERSION = 1
+
+# 프로세스 내 메모리 캐시: (model_name, text_hash) → 벡터
+_memory_cache = {}
+
+
+def ensure_question_cache_schema(conn):
+    """문항 캐시 DB 테이블 (연결 풀이 처음 여는 연결에서 한 번 실행, 형식 버전이 다르면 폐기 후 다시 생성)"""
+    with conn:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != QUESTION_CACHE_VERSION:
+            conn.execute('DROP TABLE IF EXISTS question_embeddings')
+            conn.execute(f'PRAGMA user_version = {QUESTION_CACHE_VERSION}')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS question_embeddings (
+                model_name TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                text TEXT,
+                embedding BLOB,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (model_name, text_hash)
+            )
+        ''')
+
+
+def get_question_embeddings(questions, model_name, encode_fn, db_path=None):
+    """문항 목록의 (Q, D) 임베딩 행렬을 반환 (캐시에 없는 문항만 encode_fn으로 일괄 인코딩)
+
+    encode_fn(texts) → (len(texts), D) 배열
+    """
+    db_path = db_path or QUESTION_CACHE_DB_PATH
+    keys = [text_hash(q) for q in questions]
+    vectors = {}
+    for key in keys:
+        cached = _memory_cache.get((model_name, key))
+        if cached is not None:
+            vectors[key] = cached
+
+    missing = [k for k in dict.fromkeys(keys) if k not in vectors]
+    if missing:
+        with connection(db_path, ensure_question_cache_schema) as conn:
+            # SQLite 바인딩 변수 개수 제한을 넘지 않도록 나누어 조회
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(
+                    f'SELECT text_hash, embedding FROM question_embeddings WHERE model_name = ? AND text_hash IN ({placeholders})',
+                    [model_name] + chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vectors[key] = decode_embedding(blob)
+                    _memory_cache[(model_name, key)] = vectors[key]
+
+    # 캐시에 없는 문항은 한 번의 배치로 인코딩 후 저장
+    to_encode = {}
+    for question, key in zip(questions, keys):
+        if key not in vectors and key not in to_encode:
+            to_encode[key] = question
+    record_cache('question_cache', True, len(set(keys)) - len(to_encode))
+    record_cache('question_cache', False, len(to_encode))
+    if to_encode:
+        encoded = np.asarray(encode_fn(list(to_encode.values())), dtype=np.float32)
+        with transaction(db_path, ensure_question_cache_schema) as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO question_embeddings (model_name, text_hash, text, embedding) VALUES (?, ?, ?, ?)',
+                [(model_name, key, text, encode_embedding(vec)) for (key, text), vec in zip(to_encode.items(), encoded)]
+            )
+        for key, vec in zip(to_encode.keys(), encoded):
+            vectors[key] = vec
+            _memory_cache[(model_name, key)] = vec
+
+    return np.vstack([vectors[k] for k in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+
+def load_kdst_questions_from_mysql():
+    """MySQL questions 테이블에서 전체 K-DST 문항 텍스트를 조회"""
+    import mysql.connector
+    from dotenv import load_dotenv
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env.local'))
+    conn = mysql.connector.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        database=os.getenv('DB_NAME', 'little_todakdb')
+    )
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT question_text FROM questions WHERE question_text IS NOT NULL')
+        return [row[0] for row in cursor.fetchall() if str(row[0]).strip()]
+    finally:
+        conn.close()
+
+
+def warm_up(questions):
+    """전체 문항을 미리 임베딩하여 캐시에 저장"""
+    from kdst_rag_module import get_question_embeddings as get_kdst_question_embeddings
+
+    try:
+        questions = list(dict.fromkeys(q for q in questions if str(q).strip()))
+        if not questions:
+            return {"success": False, "message": "워밍업할 문항이 없습니다."}
+        embeddings = get_kdst_question_embeddings(questions)
+        if embeddings is None:
+            return {"success": False, "message": "문항 임베딩 생성 실패"}
+        return {
+            "success": True,
+            "message": "KDST 문항 임베딩 캐시 워밍업 완료",
+            "total_questions": len(questions),
+            "embedding_dim": int(embeddings.shape[1]),
+            "cache_path": QUESTION_CACHE_DB_PATH
+        }
+    except Exception as e:
+        return {"success": False, "message": f"워밍업 실패: {str(e)}"}
+
+
+def main():
+    """메인 함수"""
+    try:
+        if not sys.stdin.isatty():
+            input_data = sys.stdin.read().strip()
+        else:
+            input_data = ''
+        if input_data:
+            questions = json.loads(input_data).get('questions', [])
+        else:
+            questions = load_kdst_questions_from_mysql()
+        print(json.dumps(warm_up(questions), ensure_ascii=False))
+    except json.JSONDecodeError as e:
+        print(json.dumps({"success": False, "message": f"JSON 파싱 실패: {str(e)}"}, ensure_ascii=False))
+    except Exception as e:
+        print(json.dumps({"success": False, "message": f"예상치 못한 오류: {str(e)}"}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
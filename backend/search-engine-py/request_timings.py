@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+요청 단계별 소요 시간 (timings)과 상주 서버 메트릭
+
+요청 JSON에 "timings": true를 넣거나 스크립트를 --timings로 실행하면 응답 JSON의 timings 필드에
+단계별 누적 소요 시간(ms)과 카운터가 함께 출력됩니다. request() 블록 밖(라이브러리 호출, 벤치마크)에서는
+span()/count()가 아무 일도 하지 않습니다.
+  model_load  임베딩 모델 import/로드 (get_model)
+  parse       요청 JSON 디코딩
+  db_load     일기 임베딩 로드 (load_search_data / load_diary_embeddings / 상주 서버 범위 인덱스)
+  encode      쿼리/문항/일기 인코딩 (캐시에 없을 때만)
+  score       유사도 계산과 상위 k 선택 (BM25 포함)
+  write       벡터 DB 쓰기 (업서트/삭제)
+  serialize   응답 JSON 직렬화 (timings 필드를 붙이기 전 본문 기준)
+  카운터: rows_scanned / queries (채점한 행 수, 쿼리 수), *_cache_hits / *_cache_misses
+
+상주 서버(search_server.py)는 enable_metrics()로 모든 요청의 단계 시간을 집계하며,
+GET /metrics에서 Prometheus 텍스트 형식(카운터/히스토그램, 캐시 적중률, 쿼리당 스캔 행 수)으로 제공합니다.
+"""
+
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+ENABLED_BY_FLAG = '--timings' in sys.argv
+
+# 히스토그램 버킷 (초 / 쿼리당 스캔 행 수)
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROWS_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+
+# 적중률을 계산하는 캐시 (카운터 이름 접두사)
+CACHES = ('query_cache', 'question_cache', 'result_cache')
+
+_local = threading.local()
+_metrics = None
+
+
+class RequestTimings:
+    """요청 하나의 단계별 소요 시간과 카운터"""
+
+    def __init__(self, endpoint, report=True):
+        self.endpoint = endpoint
+        # False이면 응답에는 붙이지 않고 메트릭 집계에만 사용
+        self.report = report
+        # 메트릭의 status 레이블 (None이면 예외 없이 끝났는지로 ok/error)
+        self.status = None
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def to_dict(self):
+        stages = {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()}
+        stages['total'] = round(self.elapsed() * 1000, 3)
+        result = {'unit': 'ms', 'stages': stages}
+        if self.counters:
+            result['counters'] = dict(self.counters)
+        return result
+
+
+def current():
+    """현재 스레드에서 측정 중인 RequestTimings (없으면 None)"""
+    return getattr(_local, 'timings', None)
+
+
+def requested(payload):
+    """요청이 timings 출력을 원하는지 (--timings 또는 "timings": true)"""
+    return ENABLED_BY_FLAG or (isinstance(payload, dict) and bool(payload.get('timings')))
+
+
+@contextmanager
+def request(endpoint, report=False):
+    """with 블록을 요청 하나로 측정 (yield 값은 RequestTimings, 블록이 끝나면 메트릭에 반영)
+
+    report는 응답에 timings를 붙일지 여부이며, 요청 JSON을 읽은 뒤 timings.report로 바꿀 수 있습니다.
+    """
+    previous = current()
+    timings = RequestTimings(endpoint, report)
+    _local.timings = timings
+    status = 'error'
+    try:
+        yield timings
+        status = 'ok'
+    finally:
+        _local.timings = previous
+        if _metrics is not None:
+            _metrics.observe_request(timings, timings.status or status)
+
+
+@contextmanager
+def span(name):
+    """with 블록의 소요 시간을 현재 요청의 name 단계에 누적"""
+    timings = current()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def count(name, value=1):
+    timings = current()
+    if timings is not None:
+        timings.count(name, value)
+
+
+def record_scan(rows, queries=1):
+    """채점한 행 수 기록 (쿼리 여러 개를 한 번에 채점했으면 전체 행 수와 쿼리 수)"""
+    timings = current()
+    if timings is not None:
+        timings.count('rows_scanned', int(rows))
+        timings.count('queries', int(queries))
+
+
+def record_cache(cache, hit, value=1):
+    """캐시 조회 결과 기록 (cache: CACHES 중 하나)"""
+    count(f"{cache}_{'hits' if hit else 'misses'}", value)
+
+
+def attach(result, timings):
+    """결과 dict에 timings 필드를 추가 (측정하지 않았거나 출력을 원하지 않으면 그대로 반환)"""
+    if timings is not None and timings.report and isinstance(result, dict):
+        result['timings'] = timings.to_dict()
+    return result
+
+
+def dumps(result, timings=None, **kwargs):
+    """응답 JSON 문자열 (timings를 출력하면 직렬화 시간을 잰 뒤 필드를 붙여 다시 직렬화)"""
+    timings = timings if timings is not None else current()
+    if timings is None:
+        return json.dumps(result, **kwargs)
+    start = time.perf_counter()
+    body = json.dumps(result, **kwargs)
+    timings.add('serialize', time.perf_counter() - start)
+    if not timings.report or not isinstance(result, dict):
+        return body
+    return json.dumps(attach(result, timings), **kwargs)
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value, times=1):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += times
+                break
+        self.sum += value * times
+        self.count += times
+
+
+def _labels(pairs):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}' if pairs else ''
+
+
+class Metrics:
+    """요청/단계/캐시/스캔 행 수 집계 (Prometheus 텍스트 형식으로 출력)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = {}        # (endpoint, status) → 횟수
+        self.durations = {}       # endpoint → _Histogram
+        self.stage_durations = {}  # (endpoint, stage) → _Histogram
+        self.rows_scanned = {}    # endpoint → _Histogram (쿼리당)
+        self.counters = {}        # (endpoint, counter) → 누적값
+
+    def observe_request(self, timings, status):
+        elapsed = timings.elapsed()
+        endpoint = timings.endpoint
+        with self.lock:
+            key = (endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.durations.setdefault(endpoint, _Histogram(SECONDS_BUCKETS)).observe(elapsed)
+            for stage, seconds in timings.stages.items():
+                self.stage_durations.setdefault((endpoint, stage), _Histogram(SECONDS_BUCKETS)).observe(seconds)
+            for name, value in timings.counters.items():
+                self.counters[(endpoint, name)] = self.counters.get((endpoint, name), 0) + value
+            queries = timings.counters.get('queries', 0)
+            if queries:
+                self.rows_scanned.setdefault(endpoint, _Histogram(ROWS_BUCKETS)).observe(
+                    timings.counters.get('rows_scanned', 0) / queries, queries
+                )
+
+    def _cache_totals(self):
+        totals = {}
+        for (_, name), value in self.counters.items():
+            for cache in CACHES:
+                if name in (f'{cache}_hits', f'{cache}_misses'):
+                    hits, misses = totals.get(cache, (0, 0))
+                    totals[cache] = (hits + value, misses) if name.endswith('_hits') else (hits, misses + value)
+        return totals
+
+    @staticmethod
+    def _histogram_lines(name, labels, histogram):
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{_labels(labels + [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(labels + [("le", "+Inf")])} {histogram.count}')
+        lines.append(f'{name}_sum{_labels(labels)} {histogram.sum:.6f}')
+        lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+        return lines
+
+    def render(self, gauges=None):
+        """Prometheus 텍스트 노출 형식 (gauges: 추가로 내보낼 {이름: 값})"""
+        with self.lock:
+            lines = [
+                '# HELP search_engine_uptime_seconds 서버 가동 시간',
+                '# TYPE search_engine_uptime_seconds gauge',
+                f'search_engine_uptime_seconds {time.time() - self.started:.3f}',
+                '# HELP search_engine_requests_total 엔드포인트별 요청 수',
+                '# TYPE search_engine_requests_total counter',
+            ]
+            for (endpoint, status), value in sorted(self.requests.items()):
+                lines.append(f'search_engine_requests_total{_labels([("endpoint", endpoint), ("status", status)])} {value}')
+
+            lines += ['# HELP search_engine_request_duration_seconds 요청 처리 시간',
+                      '# TYPE search_engine_request_duration_seconds histogram']
+            for endpoint, histogram in sorted(self.durations.items()):
+                lines += self._histogram_lines('search_engine_request_duration_seconds', [('endpoint', endpoint)], histogram)
+
+            lines += ['# HELP search_engine_stage_duration_seconds 요청 단계별 처리 시간',
+                      '# TYPE search_engine_stage_duration_seconds histogram']
+            for (endpoint, stage), histogram in sorted(self.stage_durations.items()):
+                lines += self._histogram_lines(
+                    'search_engine_stage_duration_seconds', [('endpoint', endpoint), ('stage', stage)], histogram
+                )
+
+            lines += ['# HELP search_engine_rows_scanned_per_query 쿼리 하나가 채점한 행 수',
+                      '# TYPE search_engine_rows_scanned_per_query histogram']
+            for endpoint, histogram in sorted(self.rows_scanned.items()):
+                lines += self._histogram_lines('search_engine_rows_scanned_per_query', [('endpoint', endpoint)], histogram)
+
+            cache_totals = self._cache_totals()
+            lines += ['# HELP search_engine_cache_lookups_total 캐시 조회 수',
+                      '# TYPE search_engine_cache_lookups_total counter']
+            for cache, (hits, misses) in sorted(cache_totals.items()):
+                lines.append(f'search_engine_cache_lookups_total{_labels([("cache", cache), ("result", "hit")])} {hits}')
+                lines.append(f'search_engine_cache_lookups_total{_labels([("cache", cache), ("result", "miss")])} {misses}')
+            lines += ['# HELP search_engine_cache_hit_ratio 캐시 적중률',
+                      '# TYPE search_engine_cache_hit_ratio gauge']
+            for cache, (hits, misses) in sorted(cache_totals.items()):
+                if hits + misses:
+                    lines.append(f'search_engine_cache_hit_ratio{_labels([("cache", cache)])} {hits / (hits + misses):.4f}')
+
+        for name, value in sorted((gauges or {}).items()):
+            if value is not None:
+                lines += [f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def enable_metrics():
+    """모든 요청을 측정해 메트릭으로 집계 (상주 서버 시작 시 호출). Metrics 인스턴스를 반환"""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
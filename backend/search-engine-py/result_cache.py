@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+검색 결과 캐시 (범위별 세대 번호로 무효화)
+
+- diary_embeddings.db의 store_generations 테이블: 범위 키 → 세대 번호
+    'all'            모든 쓰기마다 증가 (범위 없는 검색용)
+    'child:<id>'     해당 아이의 일기가 추가/수정/삭제될 때 증가
+    'parent:<id>'    해당 부모의 일기가 추가/수정/삭제될 때 증가
+    'epoch'          백필처럼 여러 아이를 한꺼번에 바꾸는 작업 후 증가 (모든 캐시 무효화)
+  upsert_diary/delete_diary는 임베딩을 쓰는 같은 트랜잭션 안에서 세대를 올립니다.
+- result_cache.db: (종류, 범위, 질문 목록 해시, top_k, 임계치) → 결과 JSON + 저장 당시 세대
+  저장 당시 세대와 현재 세대가 같을 때만 재사용하므로, 일기가 바뀌지 않은 아이의 주간 보고서는
+  KDST 문항 RAG 결과를 바로 돌려줍니다.
+
+설정: RESULT_CACHE=0이면 사용하지 않음, RESULT_CACHE_MAX_ENTRIES (기본 4096)
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from request_timings import record_cache
+from sqlite_pool import DEFAULT_DB_PATH, VECTOR_DB_DIR, connection, transaction
+
+RESULT_CACHE_DB_PATH = os.path.join(VECTOR_DB_DIR, 'result_cache.db')
+
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE', '1').lower() not in ('0', 'false', 'no')
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '4096'))
+
+
+def ensure_generation_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS store_generations (
+            scope_key TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def bump_generations(cursor, child_ids=(), parent_ids=(), epoch=False):
+    """쓰기 트랜잭션 안에서 관련 범위의 세대 번호를 올림 (테이블은 sqlite_pool 마이그레이션이 준비)"""
+    keys = ['all']
+    keys += [f'child:{c}' for c in dict.fromkeys(child_ids) if c not in (None, '')]
+    keys += [f'parent:{p}' for p in dict.fromkeys(parent_ids) if p not in (None, '')]
+    if epoch:
+        keys.append('epoch')
+    cursor.executemany('''
+        INSERT INTO store_generations (scope_key, generation) VALUES (?, 1)
+        ON CONFLICT(scope_key) DO UPDATE SET generation = generation + 1
+    ''', [(key,) for key in keys])
+
+
+def scope_generation_keys(scope):
+    """검색 범위의 결과에 영향을 주는 세대 키 목록"""
+    keys = ['epoch']
+    if scope and scope.get('child_id') not in (None, ''):
+        keys.append(f"child:{scope['child_id']}")
+    if scope and scope.get('parent_id') not in (None, ''):
+        keys.append(f"parent:{scope['parent_id']}")
+    if len(keys) == 1:
+        keys.append('all')
+    return keys
+
+
+def current_generation(scope, db_path=DEFAULT_DB_PATH):
+    """범위의 현재 세대 문자열 (예: 'epoch=0;child:5=7')"""
+    keys = scope_generation_keys(scope)
+    with connection(db_path) as conn:
+        rows = dict(conn.execute(
+            f"SELECT scope_key, generation FROM store_generations WHERE scope_key IN ({','.join('?' * len(keys))})",
+            keys
+        ).fetchall())
+    return ';'.join(f'{key}={rows.get(key, 0)}' for key in keys)
+
+
+def result_cache_key(kind, scope, questions, top_k, score_threshold):
+    """(종류, 범위, 질문 목록 해시, top_k, 임계치) 캐시 키"""
+    question_hash = hashlib.sha256('\n'.join(str(q).strip() for q in questions).encode('utf-8')).hexdigest()
+    payload = {
+        'kind': kind,
+        'scope': {key: str(value) for key, value in sorted((scope or {}).items())},
+        'questions': question_hash,
+        'top_k': top_k,
+        'score_threshold': score_threshold
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def ensure_result_cache_schema(conn):
+    """결과 캐시 DB 테이블 (연결 풀이 처음 여는 연결에서 한 번 실행)"""
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS result_cache (
+                cache_key TEXT PRIMARY KEY,
+                generation TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL
+            )
+        ''')
+
+
+def cached_result(kind, scope, questions, top_k, score_threshold, compute_fn,
+                  db_path=None, generation_db_path=DEFAULT_DB_PATH):
+    """세대가 같은 캐시 결과가 있으면 반환하고, 없으면 compute_fn() 결과(성공한 경우)를 저장 후 반환
+
+    캐시에서 가져온 결과에는 "cached": true가 붙습니다.
+    """
+    if not RESULT_CACHE_ENABLED or not os.path.exists(generation_db_path):
+        return compute_fn()
+    db_path = db_path or RESULT_CACHE_DB_PATH
+    try:
+        # 계산 전에 세대를 읽으므로, 계산 중에 쓰기가 끼어들면 다음 조회에서 자연스럽게 무효화됩니다
+        generation = current_generation(scope, generation_db_path)
+        key = result_cache_key(kind, scope, questions, top_k, score_threshold)
+        with connection(db_path, ensure_result_cache_schema) as conn:
+            row = conn.execute('SELECT generation, result FROM result_cache WHERE cache_key = ?', (key,)).fetchone()
+        if row is not None and row[0] == generation:
+            result = json.loads(row[1])
+            result['cached'] = True
+            record_cache('result_cache', True)
+            return result
+        record_cache('result_cache', False)
+    except (sqlite3.Error, ValueError) as e:
+        print(f"결과 캐시 조회 실패: {e}", file=sys.stderr)
+        return compute_fn()
+
+    result = compute_fn()
+    if isinstance(result, dict) and result.get('success'):
+        try:
+            with transaction(db_path, ensure_result_cache_schema) as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO result_cache (cache_key, generation, result, created_at) VALUES (?, ?, ?, ?)',
+                    (key, generation, json.dumps(result, ensure_ascii=False), time.time())
+                )
+                conn.execute('''
+                    DELETE FROM result_cache WHERE cache_key NOT IN (
+                        SELECT cache_key FROM result_cache ORDER BY created_at DESC LIMIT ?
+                    )
+                ''', (RESULT_CACHE_MAX_ENTRIES,))
+        except sqlite3.Error as e:
+            print(f"결과 캐시 저장 실패: {e}", file=sys.stderr)
+    return result
@@ -6,6 +6,7 @@ import sys
 import os
 from datetime import datetime
 from kdst_rag_module import get_kdst_rag_result
+from vector_store import extract_scope
 
 # UTF-8 인코딩 설정
 if sys.platform.startswith('win'):
@@ -13,8 +14,8 @@ if sys.platform.startswith('win'):
     sys.stdout = codecs.getwriter('utf-8')(sys.stdout.detach())
     sys.stderr = codecs.getwriter('utf-8')(sys.stderr.detach())
 
-def save_kdst_rag_to_json(questions, output_filename=None):
-    """KDST RAG 검색 결과를 JSON 파일로 저장"""
+def save_kdst_rag_to_json(questions, output_filename=None, scope=None):
+    """KDST RAG 검색 결과를 JSON 파일로 저장 (scope: child_id/parent_id/date_from/date_to)"""
     try:
         # 출력 파일명 생성
         if not output_filename:
@@ -30,7 +31,7 @@ def save_kdst_rag_to_json(questions, output_filename=None):
         
         # RAG 검색 수행
         print("RAG 검색 중...")
-        rag_result = get_kdst_rag_result(questions)
+        rag_result = get_kdst_rag_result(questions, scope)
         
         if not rag_result.get("success"):
             print(f"❌ RAG 검색 실패: {rag_result.get('message', 'Unknown error')}")
@@ -146,7 +147,7 @@ def main():
                     questions = data.get('questions', sample_questions)
                     output_filename = data.get('output_filename', None)
                     
-                    success = save_kdst_rag_to_json(questions, output_filename)
+                    success = save_kdst_rag_to_json(questions, output_filename, extract_scope(data))
                     
                     # 결과를 JSON으로 출력 (Node.js에서 받을 수 있도록)
                     result = {
@@ -3,36 +3,70 @@
 VectorDB에서 유사한 일기 검색 스크립트
 """
 
+import startup_profile
+import request_timings
 import sys
 import json
 import os
 import sqlite3
-from sentence_transformers import SentenceTransformer
+from embedding_model import MODEL_NAME, encode
+from query_cache import get_query_embedding, get_query_embeddings
+from vector_store import EMBEDDING_DB_PATH, decode_embedding, extract_scope, scope_where_clause
+from sqlite_pool import connection
+from vector_search import VectorIndex
+from quantized_index import QUANTIZATION_MODE, load_quantized_index
+from vector_segments import load_segment_index
+from lexical_index import bm25_search, reciprocal_rank_fusion, sync_lexical_index
+from diary_chunks import CHUNK_AGGREGATION, CHUNK_TOP_M, chunk_scores, load_chunk_index
+from ndjson_stream import STREAM_MODE, run_stream
+
+startup_profile.mark_imports_done()
 
 # 설정
-MODEL_NAME = 'BM-K/KoSimCSE-roberta-multitask'
 COLLECTION_NAME = "my_journal_on_disk"
 QDRANT_PATH = "../my_local_qdrant_db"
-EMBEDDING_DB_PATH = os.path.join(os.path.dirname(__file__), 'my_local_qdrant_db', 'diary_embeddings.db')
 
-def setup_model_and_data():
-    """임베딩 모델을 준비하고 기존 데이터를 로드합니다
+# 검색 방식 (search_similar_diaries 참고)과 BM25 후보 수, RRF 상수
+SEARCH_MODES = ('dense', 'hybrid', 'prefilter')
+LEXICAL_CANDIDATES = int(os.getenv('LEXICAL_CANDIDATES', '200'))
+RRF_K = 60
+
+def load_search_data(scope=None):
+    """검색 대상 데이터를 로드합니다
     우선순위: diary_embeddings.db → Qdrant storage.sqlite → 샘플 데이터
+    scope(child_id/parent_id/date_from/date_to)가 있으면 diary_embeddings.db에서
+    해당 범위만 읽고, 다른 가족의 데이터가 섞이지 않도록 대체 소스는 사용하지 않습니다.
     """
     try:
-        model = SentenceTransformer(MODEL_NAME)
+        where, params = scope_where_clause(scope)
 
         # 1) diary_embeddings.db 우선 사용 (일지 저장 시 업서트되는 DB)
+        # EMBEDDING_QUANTIZATION이 설정되면 압축 인덱스로 로드 (상위 후보는 float32로 재정렬)
+        if QUANTIZATION_MODE and os.path.exists(EMBEDDING_DB_PATH):
+            try:
+                index = load_quantized_index(QUANTIZATION_MODE, scope=scope)
+                if len(index) or where:
+                    return index
+            except Exception:
+                pass
+
+        # 메모리 맵 세그먼트가 있으면 임베딩 BLOB을 읽지 않고 공유 페이지 캐시를 사용
         if os.path.exists(EMBEDDING_DB_PATH):
             try:
-                conn = sqlite3.connect(EMBEDDING_DB_PATH)
-                cursor = conn.cursor()
-                cursor.execute('SELECT diary_id, text, embedding, date FROM diary_embeddings')
-                rows = cursor.fetchall()
+                index = load_segment_index(scope)
+                if index is not None:
+                    return index
+            except Exception:
+                pass
+
+        if os.path.exists(EMBEDDING_DB_PATH):
+            try:
+                with connection(EMBEDDING_DB_PATH) as conn:
+                    rows = conn.execute('SELECT diary_id, text, embedding, date FROM diary_embeddings' + where, params).fetchall()
                 data = []
                 for diary_id, text, embedding_blob, date in rows:
                     try:
-                        vec = json.loads(embedding_blob)
+                        vec = decode_embedding(embedding_blob)
                         data.append({
                             'id': diary_id,
                             'vector': vec,
@@ -42,12 +76,15 @@ def setup_model_and_data():
                         })
                     except Exception:
                         continue
-                conn.close()
-                if data:
-                    return model, data
+                if data or where:
+                    return data
             except Exception:
                 pass
 
+        # 범위 검색은 대체 소스(Qdrant/샘플)를 사용하지 않음
+        if where:
+            return []
+
         # 2) Qdrant storage.sqlite (있다면 사용)
         sqlite_path = os.path.join(QDRANT_PATH, "collection", COLLECTION_NAME, "storage.sqlite")
         if os.path.exists(sqlite_path):
@@ -75,15 +112,15 @@ def setup_model_and_data():
                             })
                 conn.close()
                 if data:
-                    return model, data
+                    return data
             except Exception:
                 pass
 
         # 3) 아무것도 없으면 샘플 데이터
-        return model, get_sample_data()
+        return get_sample_data()
 
     except Exception:
-        return None, get_sample_data()
+        return get_sample_data()
 
 def extract_text_from_payload(payload):
     """페이로드에서 텍스트를 추출합니다"""
@@ -191,10 +228,82 @@ def get_sample_data():
         }
     ]
 
-def search_similar_diaries(model, data, query_text, limit=5, score_threshold=0.5):
-    """유사한 일기를 검색합니다"""
+def build_search_index(data):
+    """검색 데이터 목록을 정규화된 행렬 인덱스로 변환합니다"""
+    if isinstance(data, VectorIndex):
+        return data
+    return VectorIndex.from_items(data)
+
+def encode_query(model, query_text):
+    """쿼리 임베딩 (같은 쿼리는 캐시에서 가져오고, 캐시에 없을 때만 모델을 로드해 인코딩)"""
+    return get_query_embedding(query_text, MODEL_NAME, lambda text: model.encode(text) if model is not None else encode(text))
+
+def lexical_candidates(query_text, scope=None, limit=LEXICAL_CANDIDATES):
+    """diary_embeddings.db의 BM25 상위 (diary_id, score) 목록 (색인되지 않은 행은 먼저 색인)"""
+    if not os.path.exists(EMBEDDING_DB_PATH):
+        return []
+    sync_lexical_index(EMBEDDING_DB_PATH)
+    with connection(EMBEDDING_DB_PATH) as conn:
+        where, params = scope_where_clause(scope)
+        return bm25_search(conn, query_text, limit, where, params)
+
+def load_chunk_scores(query_vector, scope=None):
+    """긴 일기의 청크 점수 집계 {diary_id: score} (청크가 없거나 읽지 못하면 빈 dict)"""
+    try:
+        return chunk_scores(load_chunk_index(scope), query_vector)
+    except Exception as e:
+        print(f"청크 인덱스 로드 실패, 일기 벡터로만 검색: {e}", file=sys.stderr)
+        return {}
+
+def dense_search(index, query_vector, limit, score_threshold, overrides, rows=None):
+    """코사인 상위 결과 (청크가 있는 긴 일기는 청크 점수 집계로 다시 채점, rows가 있으면 그 행만)"""
+    if not overrides:
+        if rows is None:
+            return index.search(query_vector, limit, score_threshold)
+        return index.search_rows(query_vector, rows, limit, score_threshold)
+    pool = max(limit * 4, 50)
+    if rows is None:
+        return index.rescore(index.search(query_vector, pool), overrides, limit, score_threshold)
+    allowed = {index.items[row]['id'] for row in rows}
+    return index.rescore(index.search_rows(query_vector, rows, pool), overrides, limit, score_threshold, allowed)
+
+def format_search_response(query_text, mode, hits, bm25=None, rrf_scores=None):
+    """(item, similarity) 목록을 검색 응답 JSON으로 변환"""
+    results = []
+    for item, similarity in hits:
+        result = {
+            'id': item['id'],
+            'similarity': similarity,
+            'text': item.get('text', ''),
+            'date': item.get('date', '2024-08-14'),
+            'combined_text': item.get('combined_text', ''),
+        }
+        if mode != 'dense':
+            result['bm25'] = round(bm25[item['id']], 4) if item['id'] in bm25 else 0.0
+            if mode == 'hybrid':
+                result['rrf_score'] = rrf_scores[item['id']]
+        results.append(result)
+    
+    return {
+        "success": True,
+        "query": query_text,
+        "mode": mode,
+        "results": results,
+        "total_found": len(results)
+    }
+
+def search_similar_diaries(model, data, query_text, limit=5, score_threshold=0.5, mode='dense', scope=None):
+    """유사한 일기를 검색합니다 (data는 데이터 목록 또는 build_search_index 결과)
+
+    mode
+      dense     코사인 유사도 (기본)
+      hybrid    BM25 순위와 코사인 순위를 RRF로 결합 (정확한 단어/이름 매칭 보완).
+                임계치는 코사인 순위에만 적용하므로 단어가 일치하는 일기는 유사도가 낮아도 포함될 수 있습니다.
+      prefilter BM25 상위 후보만 코사인으로 채점 (후보가 없으면 dense와 같음)
+    청크로 나눠 저장된 긴 일기의 유사도는 청크 유사도 집계(diary_chunks.CHUNK_AGGREGATION)입니다.
+    """
     try:
-        if not data:
+        if data is None or len(data) == 0:
             return {
                 "success": False,
                 "error": "데이터가 없습니다",
@@ -202,33 +311,38 @@ def search_similar_diaries(model, data, query_text, limit=5, score_threshold=0.5
                 "results": []
             }
         
-        query_vector = model.encode(query_text)
-        results = []
+        index = build_search_index(data)
+        query_vector = encode_query(model, query_text)
+        if mode not in SEARCH_MODES:
+            mode = 'dense'
         
-        for item in data:
-            if 'vector' in item and item['vector']:
-                stored_vector = item['vector']
-                similarity = cosine_similarity(query_vector, stored_vector)
-                # 임계치 해석을 "유사도 >= 임계치"로 통일
-                if similarity >= score_threshold:
-                    results.append({
-                        'id': item['id'],
-                        'similarity': float(similarity),
-                        'text': item.get('text', ''),
-                        'date': item.get('date', '2024-08-14'),
-                        'combined_text': item.get('combined_text', ''),
-                    })
+        # 임계치 해석을 "유사도 >= 임계치"로 통일, 유사도 높은 순 상위 N개
+        bm25, rrf_scores = {}, {}
+        with request_timings.span('db_load'):
+            overrides = load_chunk_scores(query_vector, scope)
+        with request_timings.span('score'):
+            if mode == 'dense':
+                hits = dense_search(index, query_vector, limit, score_threshold, overrides)
+            else:
+                lexical = lexical_candidates(query_text, scope)
+                bm25 = dict(lexical)
+                lexical_rows = index.rows_for_ids([diary_id for diary_id, _ in lexical])
+                if mode == 'prefilter':
+                    hits = dense_search(index, query_vector, limit, score_threshold, overrides, lexical_rows or None)
+                else:
+                    dense_hits = dense_search(index, query_vector, max(limit * 4, 50), score_threshold, overrides)
+                    dense_ids = [item['id'] for item, _ in dense_hits]
+                    lexical_ids = [index.items[row]['id'] for row in lexical_rows]
+                    fused = reciprocal_rank_fusion([dense_ids, lexical_ids], RRF_K)
+                    top_ids = sorted(fused, key=lambda diary_id: -fused[diary_id])[:limit]
+                    rows = index.rows_for_ids(top_ids)
+                    hits = [
+                        (index.items[row], float(overrides.get(index.items[row]['id'], score)))
+                        for row, score in zip(rows, index.score_rows(query_vector, rows))
+                    ]
+                    rrf_scores = {item['id']: round(fused[item['id']], 6) for item, _ in hits}
         
-        # 유사도 높은 순으로 정렬 후 상위 N개 반환
-        results.sort(key=lambda x: x.get('similarity', 0.0), reverse=True)
-        results = results[:limit]
-        
-        return {
-            "success": True,
-            "query": query_text,
-            "results": results,
-            "total_found": len(results)
-        }
+        return format_search_response(query_text, mode, hits, bm25, rrf_scores)
         
     except Exception as e:
         return {
@@ -238,47 +352,95 @@ def search_similar_diaries(model, data, query_text, limit=5, score_threshold=0.5
             "results": []
         }
 
-def cosine_similarity(vec1, vec2):
-    """코사인 유사도를 계산합니다"""
-    import numpy as np
+def handle_search_request(model, data, data_input):
+    """검색 요청(JSON)을 처리합니다 (CLI와 상주 서버가 공유)"""
+    query_text = data_input.get('query')
+    limit = data_input.get('limit', 5)
+    score_threshold = data_input.get('score_threshold', 0.5)
+    mode = data_input.get('mode', 'dense')
+    
+    if not query_text:
+        return {"success": False, "message": "검색할 쿼리가 누락되었습니다."}
+    return search_similar_diaries(model, data, query_text, limit, score_threshold, mode, extract_scope(data_input))
+
+def search_dense_batch(data, requests, scope=None):
+    """같은 범위의 dense 검색 요청들을 쿼리 인코딩 한 번, (Q×D)·(D×N) 행렬곱 한 번으로 처리"""
+    index = build_search_index(data)
+    queries = get_query_embeddings([r['query'] for r in requests], MODEL_NAME, encode)
+    widest = max(int(r.get('limit', 5)) for r in requests)
     try:
-        vec1 = np.array(vec1).reshape(-1)
-        vec2 = np.array(vec2).reshape(-1)
-        
-        dot_product = np.dot(vec1, vec2)
-        norm1 = np.linalg.norm(vec1)
-        norm2 = np.linalg.norm(vec2)
-        
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
-            
-        return float(dot_product / (norm1 * norm2))
-    except Exception:
-        return 0.5
+        with request_timings.span('db_load'):
+            chunk_index = load_chunk_index(scope)
+    except Exception as e:
+        print(f"청크 인덱스 로드 실패, 일기 벡터로만 검색: {e}", file=sys.stderr)
+        chunk_index = None
+    with request_timings.span('score'):
+        if chunk_index is None:
+            pools = index.search_batch(queries, widest)
+            overrides = [{}] * len(requests)
+        else:
+            pools = index.search_batch(queries, max(widest * 4, 50))
+            overrides = chunk_index.aggregate_batch(queries, CHUNK_AGGREGATION, CHUNK_TOP_M)
+        hits = [
+            index.rescore(pool, scores, int(r.get('limit', 5)), r.get('score_threshold', 0.5))
+            for r, pool, scores in zip(requests, pools, overrides)
+        ]
+    return [format_search_response(r['query'], 'dense', result) for r, result in zip(requests, hits)]
+
+def handle_search_batch(requests):
+    """--stream 배치: 범위별로 데이터를 한 번 로드하고, dense 검색은 search_dense_batch로 함께 처리"""
+    results = [None] * len(requests)
+    groups = {}
+    for i, request in enumerate(requests):
+        if not request.get('query'):
+            results[i] = handle_search_request(None, [], request)
+            continue
+        scope = extract_scope(request)
+        groups.setdefault(tuple(sorted(scope.items())), []).append(i)
+
+    for key, indices in groups.items():
+        scope = dict(key)
+        with request_timings.span('db_load'):
+            data = build_search_index(load_search_data(scope))
+        dense = [i for i in indices if requests[i].get('mode', 'dense') not in ('hybrid', 'prefilter')]
+        if len(data) and len(dense) > 1:
+            try:
+                for i, result in zip(dense, search_dense_batch(data, [requests[i] for i in dense], scope)):
+                    results[i] = result
+            except Exception as e:
+                print(f"배치 검색 실패, 요청별로 검색: {e}", file=sys.stderr)
+        for i in indices:
+            if results[i] is None:
+                results[i] = handle_search_request(None, data, requests[i])
+    return results
 
 def main():
     """메인 함수"""
+    if STREAM_MODE:
+        run_stream(handle_search_batch, 'search')
+        return
     try:
-        model, data = setup_model_and_data()
-        
-        if not model:
-            result = {"success": False, "message": "임베딩 모델을 초기화할 수 없습니다."}
-            print(json.dumps(result, ensure_ascii=False))
-            return
-
         input_data = sys.stdin.read()
-        data_input = json.loads(input_data)
-        
-        query_text = data_input.get('query')
-        limit = data_input.get('limit', 5)
-        score_threshold = data_input.get('score_threshold', 0.5)
-        
-        if not query_text:
-            result = {"success": False, "message": "검색할 쿼리가 누락되었습니다."}
-        else:
-            result = search_similar_diaries(model, data, query_text, limit, score_threshold)
-        
-        print(json.dumps(result, ensure_ascii=False))
+        with request_timings.request('search') as timings:
+            with request_timings.span('parse'):
+                data_input = json.loads(input_data)
+            # --timings 또는 "timings": true이면 단계별 소요 시간 포함
+            timings.report = request_timings.requested(data_input)
+            
+            # 쿼리가 없으면 데이터/모델을 로드하지 않고 바로 응답
+            if not data_input.get('query'):
+                print(request_timings.dumps(handle_search_request(None, [], data_input), ensure_ascii=False))
+                return
+            
+            # child_id/parent_id/date_from/date_to가 있으면 해당 범위만 로드
+            with startup_profile.stage('db_load'), request_timings.span('db_load'):
+                data = load_search_data(extract_scope(data_input))
+            
+            # 모델은 쿼리 임베딩이 캐시에 없을 때만 로드 (encode_query)
+            result = handle_search_request(None, data, data_input)
+            
+            # --profile-startup이면 시작 시간 보고서 포함
+            print(request_timings.dumps(startup_profile.attach(result), ensure_ascii=False))
         
     except Exception as e:
         error_result = {"success": False, "message": f"스크립트 실행 오류: {str(e)}"}
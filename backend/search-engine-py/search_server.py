@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+상주형 검색 엔진 서버
+모델과 벡터 저장소를 한 번만 로드해 두고, 스크립트와 동일한 JSON 계약으로
+검색/업서트/삭제/KDST 배치 요청을 HTTP(JSON)로 처리합니다.
+
+실행: python search_server.py [--host 127.0.0.1] [--port 8765]
+
+엔드포인트 (모두 POST, 본문은 각 스크립트의 stdin JSON과 동일)
+  /search  → search_diaries.py
+  /upsert  → upsert_diary.py (일기 배열이나 {"diaries": [...]}이면 한 트랜잭션으로 일괄 저장)
+  /delete  → delete_diary.py ({"diary_ids": [...]} 또는 {"child_id": ...}/{"parent_id": ...} 범위 일괄 삭제)
+  /kdst    → kdst_rag_module.py (아이/부모/전체 범위는 쓰기 시 갱신되는 문항별 상위 일기 목록에서 읽음)
+  GET /health
+  GET /metrics  (Prometheus 텍스트 형식: 요청/단계별 지연시간 히스토그램, 캐시 적중률, 쿼리당 스캔 행 수)
+
+요청 JSON에 "timings": true를 넣으면 응답에 단계별 소요 시간(timings 필드)이 붙습니다.
+
+인코딩은 encode_scheduler.EncodeScheduler가 동시 요청을 마이크로 배치로 묶어 처리합니다
+(ENCODE_WORKERS, ENCODE_MAX_BATCH, ENCODE_MAX_WAIT_MS, ENCODE_TORCH_THREADS).
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import kdst_rag_module
+import request_timings
+import search_diaries
+import upsert_diary
+from delete_diary import handle_delete_request
+from embedding_model import get_model, set_encoder
+from encode_scheduler import EncodeScheduler
+from query_cache import get_query_cache
+from result_cache import cached_result
+from sqlite_pool import connection
+from ann_index import ANN_INDEX_PATH, IVFFlatIndex
+from vector_store import (
+    EMBEDDING_DB_PATH,
+    SCOPE_KEYS,
+    decode_embedding,
+    embedding_row_item,
+    extract_scope,
+    fetch_embedding_rows,
+    load_live_index,
+    row_in_scope,
+    row_stamp,
+    scope_where_clause,
+)
+
+DEFAULT_HOST = os.getenv('SEARCH_ENGINE_HOST', '127.0.0.1')
+DEFAULT_PORT = int(os.getenv('SEARCH_ENGINE_PORT', '8765'))
+
+# 범위(아이/부모/기간)별로 메모리에 유지할 인덱스 수
+SCOPE_CACHE_SIZE = int(os.getenv('SEARCH_ENGINE_SCOPE_CACHE_SIZE', '256'))
+
+# 외부 쓰기 감지를 위한 DB 일관성 검사 주기 (초)
+CONSISTENCY_CHECK_INTERVAL = float(os.getenv('SEARCH_ENGINE_CONSISTENCY_INTERVAL', '30'))
+
+# 근사 검색(IVF-flat) 사용 여부와 적용할 최소 행 수
+ANN_ENABLED = os.getenv('SEARCH_ENGINE_ANN', '').lower() in ('1', 'true', 'ivf')
+ANN_MIN_ROWS = int(os.getenv('SEARCH_ENGINE_ANN_MIN_ROWS', '20000'))
+
+
+class SearchEngineHTTPServer(ThreadingHTTPServer):
+    # 동시 저장이 몰려도 연결이 거부되지 않도록 listen 대기열을 늘림 (기본 5)
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class ReadWriteLock:
+    """여러 읽기는 함께, 쓰기는 단독으로 (쓰기가 기다리는 동안 새 읽기는 대기하므로 쓰기가 굶지 않음)
+
+    같은 스레드에서 중첩해서 잡지 마세요.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class SearchEngineState:
+    """모델과 메모리에 올린 벡터 저장소를 보관합니다
+
+    범위별 인덱스는 LiveVectorIndex로 유지하며, 업서트/삭제는 해당 행만 O(dim)으로 반영합니다.
+    외부(다른 프로세스)에서 DB를 직접 수정한 경우는 주기적인 행 스탬프(text_hash, 메타데이터, created_at) 비교로 따라잡습니다.
+
+    잠금 순서: self.lock(상태/인덱스 변경 직렬화) → self.index_lock.write()(인덱스 행 변경).
+    검색/KDST는 인덱스를 읽는 동안 self.index_lock.read()만 잡으며, 그 안에서 self.lock을 잡지 않습니다.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # 검색 중에 행 배열/tombstone/compaction이 바뀌지 않도록 (읽기끼리는 동시에)
+        self.index_lock = ReadWriteLock()
+        # embedding_model의 싱글톤이므로 업서트/KDST 모듈도 같은 인스턴스를 사용
+        self.model = get_model()
+        # 업서트/검색/KDST의 embedding_model.encode() 호출을 마이크로 배치로 묶음
+        self.encoder = EncodeScheduler(self.model)
+        set_encoder(self.encoder)
+        # 같은 일기의 동시 업서트만 직렬화 (인코딩은 잠금 밖에서 다른 일기와 함께 배치 처리)
+        self._diary_locks = {}
+        self._diary_locks_guard = threading.Lock()
+        # 범위 → LiveVectorIndex, 최근 사용 순
+        self._indexes = OrderedDict()
+        # diary_embeddings.db가 비었을 때 쓰는 대체 검색 데이터 (Qdrant/샘플)
+        self._fallback = None
+        self._last_consistency_check = time.monotonic()
+
+    @staticmethod
+    def _scope_key(scope):
+        return tuple(scope.get(k) for k in SCOPE_KEYS)
+
+    @staticmethod
+    def _normalize_id(diary_id):
+        # DB의 diary_id는 INTEGER이므로 인덱스 키도 정수로 맞춤
+        try:
+            return int(diary_id)
+        except (TypeError, ValueError):
+            return diary_id
+
+    def _apply_row(self, index, row):
+        index.upsert(row['diary_id'], decode_embedding(row['embedding']), embedding_row_item(row), row_stamp(row))
+
+    def _fetch_rows(self, scope=None, diary_ids=None):
+        if not os.path.exists(EMBEDDING_DB_PATH):
+            return []
+        with connection(EMBEDDING_DB_PATH) as conn:
+            return fetch_embedding_rows(conn.cursor(), scope, diary_ids)
+
+    def live_index(self, scope):
+        """범위에 해당하는 LiveVectorIndex (없으면 DB에서 로드)"""
+        key = self._scope_key(scope)
+        with self.lock:
+            self._maybe_check_consistency()
+            if key in self._indexes:
+                self._indexes.move_to_end(key)
+                return self._indexes[key]
+            index = load_live_index(EMBEDDING_DB_PATH, scope)
+            self._attach_ann(scope, index)
+            self._indexes[key] = (scope, index)
+            while len(self._indexes) > SCOPE_CACHE_SIZE:
+                self._indexes.popitem(last=False)
+            return self._indexes[key]
+
+    def _attach_ann(self, scope, index):
+        """행 수가 많은 인덱스에 IVF-flat 근사 검색을 연결 (전체 범위는 디스크에 저장/재사용)"""
+        if not ANN_ENABLED or len(index) < ANN_MIN_ROWS:
+            return
+        try:
+            if not scope and os.path.exists(ANN_INDEX_PATH):
+                index.ann = IVFFlatIndex.load(index, ANN_INDEX_PATH)
+                return
+            index.ann = IVFFlatIndex.train(index)
+            if not scope:
+                index.ann.save(ANN_INDEX_PATH)
+        except Exception as e:
+            print(f"[search_server] ANN 인덱스 준비 실패, 정확 검색 사용: {e}", file=sys.stderr)
+            index.ann = None
+
+    def save_ann(self):
+        """전체 범위 ANN 인덱스의 배정을 디스크에 저장 (종료 시)"""
+        with self.lock:
+            entry = self._indexes.get(self._scope_key({}))
+            if entry is not None and entry[1].ann is not None:
+                entry[1].ann.save(ANN_INDEX_PATH)
+
+    def _apply_upserted(self, diary_id):
+        """업서트된 한 행을 캐시된 모든 범위 인덱스에 반영"""
+        diary_id = self._normalize_id(diary_id)
+        rows = self._fetch_rows(diary_ids=[diary_id])
+        for scope, index in self._indexes.values():
+            if rows and row_in_scope(rows[0], scope):
+                self._apply_row(index, rows[0])
+            elif index.remove(diary_id) and index.needs_compaction():
+                index.compact()
+        self._fallback = None
+
+    def _apply_deleted(self, diary_id):
+        """삭제된 행을 캐시된 모든 범위 인덱스에서 tombstone 처리"""
+        diary_id = self._normalize_id(diary_id)
+        for _, index in self._indexes.values():
+            if index.remove(diary_id) and index.needs_compaction():
+                index.compact()
+        self._fallback = None
+
+    def _maybe_check_consistency(self):
+        if time.monotonic() - self._last_consistency_check >= CONSISTENCY_CHECK_INTERVAL:
+            self.check_consistency()
+
+    def check_consistency(self):
+        """캐시된 인덱스를 DB의 행 스탬프와 비교하여 외부 쓰기를 반영하고 tombstone을 정리
+
+        created_at은 초 단위라 같은 초의 두 번째 쓰기를 놓치므로 text_hash와 메타데이터를 함께 비교합니다.
+        DB 조회는 self.lock만 잡은 채 하고, 인덱스 변경만 쓰기 잠금 안에서 합니다.
+        """
+        with self.lock:
+            self._last_consistency_check = time.monotonic()
+            if not self._indexes or not os.path.exists(EMBEDDING_DB_PATH):
+                return
+            with connection(EMBEDDING_DB_PATH) as conn:
+                cursor = conn.cursor()
+                for scope, index in self._indexes.values():
+                    where, params = scope_where_clause(scope)
+                    cursor.execute(
+                        'SELECT diary_id, text_hash, date, child_id, parent_id, created_at FROM diary_embeddings' + where,
+                        params
+                    )
+                    stored = {
+                        diary_id: row_stamp(dict(zip(('text_hash', 'date', 'child_id', 'parent_id', 'created_at'), rest)))
+                        for diary_id, *rest in cursor.fetchall()
+                    }
+                    cached = index.stamp_map()
+                    removed = set(cached) - set(stored)
+                    changed = [d for d, stamp in stored.items() if cached.get(d, object()) != stamp]
+                    rows = []
+                    for start in range(0, len(changed), 500):
+                        rows += fetch_embedding_rows(cursor, scope, changed[start:start + 500])
+                    if not removed and not rows and not index.tombstones:
+                        continue
+                    with self.index_lock.write():
+                        for diary_id in removed:
+                            index.remove(diary_id)
+                        for row in rows:
+                            try:
+                                self._apply_row(index, row)
+                            except Exception:
+                                continue
+                        if index.tombstones:
+                            index.compact()
+
+    def search(self, payload):
+        scope = extract_scope(payload)
+        with request_timings.span('db_load'):
+            _, data = self.live_index(scope)
+            if len(data) == 0 and not scope:
+                with self.lock:
+                    if self._fallback is None:
+                        self._fallback = search_diaries.build_search_index(search_diaries.load_search_data())
+                    data = self._fallback
+        # 모델 대신 None을 넘겨 쿼리 인코딩도 스케줄러를 거치도록 함
+        # (검색하는 동안 업서트/삭제/compaction이 행 배열을 바꾸지 않도록 읽기 잠금)
+        with self.index_lock.read():
+            return search_diaries.handle_search_request(None, data, payload)
+
+    def _diary_lock(self, diary_id):
+        with self._diary_locks_guard:
+            entry = self._diary_locks.setdefault(self._normalize_id(diary_id), [threading.Lock(), 0])
+            entry[1] += 1
+            return entry
+
+    def _release_diary_lock(self, diary_id, entry):
+        with self._diary_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._diary_locks.pop(self._normalize_id(diary_id), None)
+
+    def upsert(self, payload):
+        # 전체 잠금을 잡은 채 인코딩하면 동시 저장이 한 건씩 처리되므로, 인덱스 반영할 때만 잡음
+        batch = upsert_diary.diary_batch(payload)
+        diaries = batch if batch is not None else [payload]
+        # 여러 일기를 함께 저장할 때도 교착되지 않도록 항상 같은 순서로 일기 잠금을 잡음
+        diary_ids = sorted({self._normalize_id(d.get('id')) for d in diaries if isinstance(d, dict)}, key=str)
+        entries = [(diary_id, self._diary_lock(diary_id)) for diary_id in diary_ids]
+        try:
+            with ExitStack() as stack:
+                for _, entry in entries:
+                    stack.enter_context(entry[0])
+                results = upsert_diary.upsert_diaries(diaries)
+                with self.lock, self.index_lock.write():
+                    for result in results:
+                        if result.get('success'):
+                            self._apply_upserted(result['diary_id'])
+        finally:
+            for diary_id, entry in entries:
+                self._release_diary_lock(diary_id, entry)
+        return results[0] if batch is None else upsert_diary.batch_response(results)
+
+    def delete(self, payload):
+        with self.lock:
+            result = handle_delete_request(payload)
+            with self.index_lock.write():
+                for item in result.get('results', [result]):
+                    if item.get('success'):
+                        self._apply_deleted(item['diary_id'])
+        return result
+
+    def metrics_gauges(self):
+        """/metrics에 함께 내보낼 현재 상태 값"""
+        encoder = self.encoder.stats()
+        query_cache = get_query_cache().stats()
+        with self.lock:
+            indexes = list(self._indexes.values())
+        return {
+            'search_engine_scope_indexes': len(indexes),
+            'search_engine_indexed_rows': sum(len(index) for _, index in indexes),
+            'search_engine_encoder_queued': encoder['queued'],
+            'search_engine_encoder_batches': encoder['batches'],
+            'search_engine_encoder_avg_batch_size': encoder['avg_batch_size'],
+            'search_engine_query_cache_entries': query_cache['size'],
+        }
+
+    def kdst(self, payload):
+        questions = payload.get('questions', [])
+        if not questions:
+            return {"success": False, "message": "질문이 제공되지 않았습니다."}
+        scope = extract_scope(payload)
+
+        def compute():
+            with request_timings.span('db_load'):
+                _, index = self.live_index(scope)
+            with self.index_lock.read():
+                if len(index) == 0:
+                    return {"success": False, "message": "일기 임베딩을 로드할 수 없습니다."}
+                return kdst_rag_module.process_kdst_questions(questions, index, index.items, scope)
+
+        # 쓰기 시 갱신되는 문항별 상위 일기 목록을 먼저 읽음 (날짜 범위 등은 검색)
+        result = kdst_rag_module.materialized_kdst_result(questions, scope)
+        if result is not None:
+            return result
+        # 범위의 일기가 바뀌지 않았으면 (세대 번호가 같으면) 이전 결과 재사용
+        return cached_result('kdst', scope, questions, kdst_rag_module.KDST_TOP_K, None, compute)
+
+
+def make_handler(state, metrics):
+    routes = {
+        '/search': state.search,
+        '/upsert': state.upsert,
+        '/delete': state.delete,
+        '/kdst': state.kdst,
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, data, content_type='application/json; charset=utf-8'):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_json(self, status, body):
+            self._send(status, json.dumps(body, ensure_ascii=False).encode('utf-8'))
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send_json(200, {
+                    "success": True,
+                    "message": "ok",
+                    "query_cache": get_query_cache().stats(),
+                    "encoder": state.encoder.stats()
+                })
+            elif self.path == '/metrics':
+                body = metrics.render(state.metrics_gauges())
+                self._send(200, body.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+            else:
+                self._send_json(404, {"success": False, "message": "알 수 없는 경로입니다."})
+
+        def do_POST(self):
+            route = routes.get(self.path)
+            if route is None:
+                self._send_json(404, {"success": False, "message": "알 수 없는 경로입니다."})
+                return
+            with request_timings.request(self.path.lstrip('/')) as timings:
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                    raw = self.rfile.read(length).decode('utf-8').strip()
+                    if not raw:
+                        timings.status = 'bad_request'
+                        self._send_json(400, {"success": False, "message": "입력 데이터가 없습니다."})
+                        return
+                    with request_timings.span('parse'):
+                        payload = json.loads(raw)
+                except json.JSONDecodeError as e:
+                    timings.status = 'bad_request'
+                    self._send_json(400, {"success": False, "message": f"JSON 파싱 실패: {str(e)}"})
+                    return
+                timings.report = request_timings.requested(payload)
+                try:
+                    result = route(payload)
+                    timings.status = 'ok' if isinstance(result, dict) and result.get('success') else 'failed'
+                    body = request_timings.dumps(result, timings, ensure_ascii=False)
+                except Exception as e:
+                    timings.status = 'error'
+                    self._send_json(500, {"success": False, "message": f"예상치 못한 오류: {str(e)}"})
+                    return
+                self._send(200, body.encode('utf-8'))
+
+        def log_message(self, format, *args):
+            print(f"[search_server] {self.address_string()} {format % args}", file=sys.stderr)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='상주형 일기 검색 엔진 서버')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    # 모든 요청의 단계별 소요 시간을 집계 (GET /metrics)
+    metrics = request_timings.enable_metrics()
+    state = SearchEngineState()
+    server = SearchEngineHTTPServer((args.host, args.port), make_handler(state, metrics))
+    print(f"[search_server] listening on http://{args.host}:{args.port}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        state.save_ann()
+
+
+if __name__ == '__main__':
+    main()
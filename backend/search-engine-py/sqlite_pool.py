@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+diary_embeddings.db 연결 관리 (WAL, 스키마 마이그레이션, 연결 재사용)
+
+- 연결을 처음 열 때 WAL 저널 모드와 synchronous/mmap_size/busy_timeout을 설정합니다.
+  WAL에서는 읽기가 쓰기를 기다리지 않으므로 저장 중에도 검색이 막히지 않습니다.
+- 스키마(테이블/컬럼/인덱스)는 PRAGMA user_version을 보고 프로세스당 한 번만 마이그레이션합니다.
+  (예전에는 업서트마다 CREATE TABLE과 컬럼 확인을 실행)
+- connection()은 풀에서 연결을 빌려주고 돌려받습니다. 연결마다 준비된 SQL 문이 캐시되므로
+  같은 업서트/조회 문을 다시 파싱하지 않습니다. 다른 DB 파일(쿼리 캐시 등)은 setup에 자체 스키마 함수를 넘깁니다.
+- transaction()은 BEGIN IMMEDIATE로 처음부터 쓰기 잠금을 잡아, 읽기 트랜잭션을 쓰기로 올리다
+  "database is locked"가 나는 경우를 막습니다. 예외가 나면 롤백합니다.
+
+설정
+- SQLITE_JOURNAL_MODE (기본 WAL, 네트워크 드라이브 등 WAL을 쓸 수 없으면 DELETE)
+- SQLITE_SYNCHRONOUS (기본 NORMAL, WAL에서는 전원 장애 시 마지막 커밋만 유실될 수 있음)
+- SQLITE_MMAP_SIZE (바이트, 기본 268435456)
+- SQLITE_BUSY_TIMEOUT_MS (기본 30000) - 다른 프로세스가 쓰는 중일 때 기다리는 최대 시간
+- SQLITE_POOL_SIZE (기본 8) - DB 파일당 보관하는 유휴 연결 수
+
+데이터 디렉터리(VECTOR_DB_DIR)와 diary_embeddings.db 경로는 여기에서만 정하고, 다른 모듈은 이 값을 가져다 씁니다.
+
+실행:
+  python sqlite_pool.py status     # 저널 모드, 스키마 버전, PRAGMA 값 확인
+  python sqlite_pool.py migrate    # 스키마 마이그레이션만 실행
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+# 벡터 DB 디렉터리 (VECTOR_DB_DIR 환경 변수로 변경 가능, 벤치마크/테스트는 임시 디렉터리 사용)
+VECTOR_DB_DIR = os.getenv('VECTOR_DB_DIR') or os.path.join(os.path.dirname(__file__), 'my_local_qdrant_db')
+DEFAULT_DB_PATH = os.path.join(VECTOR_DB_DIR, 'diary_embeddings.db')
+
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL').upper()
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '30000'))
+SQLITE_POOL_SIZE = max(1, int(os.getenv('SQLITE_POOL_SIZE', '8')))
+
+# 경로 → ConnectionPool
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def ensure_schema(cursor):
+    """diary_embeddings 테이블, 추가 컬럼, 범위 검색용 인덱스를 준비"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS diary_embeddings (
+            id INTEGER PRIMARY KEY,
+            diary_id INTEGER UNIQUE,
+            text TEXT,
+            embedding BLOB,
+            date TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 마이그레이션: parent_id, child_id 컬럼 없으면 추가
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(diary_embeddings)')}
+    if 'parent_id' not in columns:
+        cursor.execute('ALTER TABLE diary_embeddings ADD COLUMN parent_id INTEGER')
+    if 'child_id' not in columns:
+        cursor.execute('ALTER TABLE diary_embeddings ADD COLUMN child_id INTEGER')
+    # 임베딩한 텍스트의 해시 (텍스트가 같으면 재임베딩 생략)
+    if 'text_hash' not in columns:
+        cursor.execute('ALTER TABLE diary_embeddings ADD COLUMN text_hash TEXT')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_diary_embeddings_child_date ON diary_embeddings (child_id, date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_diary_embeddings_parent_date ON diary_embeddings (parent_id, date)')
+
+
+def _migrate_v1(cursor):
+    """기존 테이블 전체 (이미 있는 DB에서도 안전하게 실행됨)"""
+    from diary_chunks import ensure_chunk_schema
+    from lexical_index import ensure_lexical_schema
+    from result_cache import ensure_generation_table
+
+    ensure_schema(cursor)
+    ensure_chunk_schema(cursor)
+    ensure_lexical_schema(cursor)
+    ensure_generation_table(cursor)
+
+
+def _migrate_v2(cursor):
+    """KDST 문항별 상위 일기 목록 테이블"""
+    from kdst_topk import ensure_topk_schema
+
+    ensure_topk_schema(cursor)
+
+
+def _migrate_v3(cursor):
+    """BM25 색인 통계 행과 색인 대기열"""
+    from lexical_index import ensure_lexical_stats
+
+    ensure_lexical_stats(cursor)
+
+
+# user_version N → N+1 로 올리는 함수 목록 (새 스키마 변경은 끝에 추가)
+MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn):
+    """user_version이 SCHEMA_VERSION보다 낮으면 남은 마이그레이션을 한 트랜잭션으로 실행. 실행한 단계 수를 반환"""
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+        return 0
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # 잠금을 잡은 뒤 다시 읽음 (다른 프로세스가 먼저 마이그레이션했을 수 있음)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        cursor = conn.cursor()
+        for step in MIGRATIONS[version:]:
+            step(cursor)
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+        return max(0, SCHEMA_VERSION - version)
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def configure(conn):
+    """연결 PRAGMA 설정 (저널 모드는 DB 파일에 저장되므로 실패해도 기존 모드로 계속 사용)"""
+    conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+    try:
+        conn.execute(f'PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}')
+    except sqlite3.OperationalError as e:
+        print(f"SQLite 저널 모드 설정 실패 ({SQLITE_JOURNAL_MODE}): {e}", file=sys.stderr)
+    conn.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+
+
+class ConnectionPool:
+    """DB 파일 하나의 연결 풀 (빌린 연결은 한 스레드만 사용하고, 반납 시 남은 트랜잭션은 롤백)
+
+    setup(conn): 처음 여는 연결에서 한 번 실행할 스키마 준비 (기본은 diary_embeddings 마이그레이션)
+    """
+
+    def __init__(self, path, size=SQLITE_POOL_SIZE, setup=migrate):
+        self.path = path
+        self.size = size
+        self.setup = setup
+        self._idle = queue.LifoQueue()
+        self._migrated = False
+        self._migrate_lock = threading.Lock()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0, check_same_thread=False)
+        configure(conn)
+        if not self._migrated:
+            with self._migrate_lock:
+                if not self._migrated:
+                    self.setup(conn)
+                    self._migrated = True
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._open()
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def get_pool(db_path=None, setup=migrate):
+    path = os.path.abspath(db_path or DEFAULT_DB_PATH)
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path, setup=setup)
+        return pool
+
+
+@contextmanager
+def connection(db_path=None, setup=migrate):
+    """풀에서 빌린 연결 (블록이 끝나면 반납, close하지 말 것)"""
+    pool = get_pool(db_path, setup)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+@contextmanager
+def transaction(db_path=None, setup=migrate):
+    """쓰기 트랜잭션 (BEGIN IMMEDIATE, 정상 종료 시 커밋, 예외 시 롤백)"""
+    with connection(db_path, setup) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def status(db_path=None):
+    with connection(db_path) as conn:
+        return {
+            "path": get_pool(db_path).path,
+            "journal_mode": conn.execute('PRAGMA journal_mode').fetchone()[0],
+            "synchronous": conn.execute('PRAGMA synchronous').fetchone()[0],
+            "mmap_size": conn.execute('PRAGMA mmap_size').fetchone()[0],
+            "busy_timeout_ms": conn.execute('PRAGMA busy_timeout').fetchone()[0],
+            "user_version": conn.execute('PRAGMA user_version').fetchone()[0],
+            "schema_version": SCHEMA_VERSION
+        }
+
+
+def main():
+    """메인 함수"""
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    try:
+        if command not in ('status', 'migrate'):
+            raise ValueError(f"알 수 없는 명령: {command} (status | migrate)")
+        # 연결을 열면 마이그레이션이 실행되므로 두 명령 모두 현재 상태를 출력
+        result = {"success": True, **status()}
+    except Exception as e:
+        result = {"success": False, "message": str(e)}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
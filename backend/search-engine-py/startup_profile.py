@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CLI 시작 시간 프로파일 (--profile-startup)
+
+스크립트를 --profile-startup 옵션과 함께 실행하면 결과 JSON에 startup_profile 필드로
+모듈 import / 모델 import·로드 / DB 로드에 걸린 시간(ms)을 함께 출력합니다.
+  echo '{"query": "..."}' | python search_diaries.py --profile-startup
+
+각 스크립트는 다른 import보다 먼저 이 모듈을 import하고, 자신의 import가 끝나면 mark_imports_done()을 호출합니다.
+옵션이 없으면 모든 함수가 아무 일도 하지 않습니다.
+"""
+
+import sys
+import time
+from contextlib import contextmanager
+
+ENABLED = '--profile-startup' in sys.argv
+
+_started = time.perf_counter()
+_stages = {}
+
+
+def record(name, seconds):
+    """단계별 소요 시간을 누적"""
+    if ENABLED:
+        _stages[name] = _stages.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    """with 블록의 소요 시간을 name 단계로 기록"""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def mark_imports_done():
+    """스크립트 최상위 import가 끝난 시점까지를 module_imports 단계로 기록"""
+    if ENABLED and 'module_imports' not in _stages:
+        _stages['module_imports'] = time.perf_counter() - _started
+
+
+def report():
+    """단계별 소요 시간(ms) 보고서 (옵션이 없으면 None)"""
+    if not ENABLED:
+        return None
+    stages = {name: round(seconds * 1000, 1) for name, seconds in _stages.items()}
+    stages['total'] = round((time.perf_counter() - _started) * 1000, 1)
+    return {'unit': 'ms', 'stages': stages}
+
+
+def attach(result):
+    """결과 dict에 startup_profile 필드를 추가 (옵션이 없으면 그대로 반환)"""
+    profile = report()
+    if profile is not None and isinstance(result, dict):
+        result['startup_profile'] = profile
+    return result
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+pytest 공통 설정
+
+스크립트들은 import 시점에 VECTOR_DB_DIR로 DB 경로를 정하므로, 실제 my_local_qdrant_db를 건드리지 않도록
+모듈을 import하기 전에 임시 디렉터리로 바꿉니다. (search-engine-py 디렉터리에서 python -m pytest -q)
+"""
+
+import os
+import sys
+import tempfile
+
+os.environ['VECTOR_DB_DIR'] = tempfile.mkdtemp(prefix='search-engine-tests-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
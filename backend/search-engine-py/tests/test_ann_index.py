@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from ann_index import IVFFlatIndex, synthetic_index
+
+
+def test_load_reassigns_rows_whose_vectors_changed_after_save(tmp_path):
+    path = str(tmp_path / 'ann_ivf.npz')
+    base, centers = synthetic_index(2000, dim=16, n_clusters=20)
+    ivf = IVFFlatIndex.train(base, n_lists=20)
+    ivf.save(path)
+
+    # 서버가 내려가 있는 동안 일기 7의 벡터가 다른 군집으로 바뀐 상황
+    restarted, _ = synthetic_index(2000, dim=16, n_clusters=20)
+    target = centers[(int(np.argmax(centers @ restarted.matrix[7])) + 1) % len(centers)]
+    restarted.upsert(7, target, {'id': 7})
+
+    loaded = IVFFlatIndex.load(restarted, path)
+    np.testing.assert_array_equal(loaded.centroids, ivf.centroids)
+    row = restarted.row_of[7]
+    assert loaded.assignment[row] == loaded._nearest(restarted.matrix[row:row + 1])[0]
+    loaded.n_probe = 1
+    assert 7 in {item['id'] for item, _ in loaded.search(target, 2000)}
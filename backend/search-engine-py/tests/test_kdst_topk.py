@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import uuid
+
+import numpy as np
+import pytest
+
+import kdst_topk
+from vector_search import normalize_rows
+from vector_store import encode_embedding
+
+DIM = 8
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    kdst_topk.ensure_topk_schema(conn.cursor())
+    yield conn
+    conn.close()
+
+
+def _create_lists(conn, n_items=3, bucket='all'):
+    """빈 목록 (truncated=0) 생성 → {item_hash: 정규화된 문항 벡터}"""
+    # 문항 행렬은 item_hash로 프로세스 안에서 캐시되므로 테스트마다 새 해시를 씀
+    vectors = normalize_rows(np.random.default_rng(len(bucket)).standard_normal((n_items, DIM)))
+    items = [(uuid.uuid4().hex, f'문항 {i}', encode_embedding(vec)) for i, vec in enumerate(vectors)]
+    kdst_topk.store_lists(conn, bucket, items, [[] for _ in items], truncated=False)
+    return {item_hash: vec for (item_hash, _, _), vec in zip(items, vectors)}
+
+
+def _stored(conn, item_hash, bucket='all'):
+    return [diary_id for diary_id, _ in conn.execute(
+        'SELECT diary_id, similarity FROM kdst_topk WHERE bucket = ? AND item_hash = ? ORDER BY similarity DESC',
+        (bucket, item_hash)
+    )]
+
+
+def _exact(vectors, item_vec, n):
+    """남아 있는 일기 중 문항과 가장 가까운 n개 (정확한 순위)"""
+    scores = {diary_id: float(normalize_rows(vec)[0] @ item_vec) for diary_id, vec in vectors.items()}
+    return sorted(scores, key=lambda diary_id: -scores[diary_id])[:n]
+
+
+def _truncated(conn, item_hash, bucket='all'):
+    return conn.execute(
+        'SELECT truncated FROM kdst_topk_lists WHERE bucket = ? AND item_hash = ?', (bucket, item_hash)
+    ).fetchone()[0]
+
+
+def test_lists_stay_exact_prefix_while_growing_past_depth(conn, monkeypatch):
+    monkeypatch.setattr(kdst_topk, 'KDST_TOPK_DEPTH', 5)
+    items = _create_lists(conn)
+    rng = np.random.default_rng(7)
+    vectors = {}
+    for diary_id in range(1, 31):
+        vectors[diary_id] = rng.standard_normal(DIM).astype(np.float32)
+        kdst_topk.update_diary(conn, diary_id, vectors[diary_id])
+        for item_hash, item_vec in items.items():
+            stored = _stored(conn, item_hash)
+            assert len(stored) == min(diary_id, 5)
+            # 잘린 뒤에도 목록은 전체 일기의 정확한 상위 DEPTH개
+            assert stored == _exact(vectors, item_vec, 5)
+            assert _truncated(conn, item_hash) == int(diary_id > 5)
+
+
+def test_truncated_list_skips_diaries_below_its_minimum(conn, monkeypatch):
+    monkeypatch.setattr(kdst_topk, 'KDST_TOPK_DEPTH', 3)
+    items = _create_lists(conn, n_items=1)
+    (item_hash, item_vec), = items.items()
+    # 문항과의 유사도가 높은 순서대로 네 일기 → 4번째가 밀려나며 잘림
+    basis = normalize_rows(np.random.default_rng(3).standard_normal(DIM))[0]
+    other = basis - (basis @ item_vec) * item_vec
+    other /= np.linalg.norm(other)
+    vectors = {diary_id: item_vec * weight + other * (1 - weight)
+               for diary_id, weight in zip(range(1, 5), (0.9, 0.8, 0.7, 0.6))}
+    for diary_id, vec in vectors.items():
+        kdst_topk.update_diary(conn, diary_id, vec)
+    assert _stored(conn, item_hash) == [1, 2, 3]
+    assert _truncated(conn, item_hash) == 1
+
+    # 목록 최솟값보다 낮은 일기는 넣지 않음 (목록 밖 일기와 순위를 알 수 없으므로)
+    assert kdst_topk.update_diary(conn, 5, item_vec * 0.1 + other * 0.9) == 0
+    assert _stored(conn, item_hash) == [1, 2, 3]
+
+    # 최솟값보다 높으면 넣고 최하위를 밀어냄
+    assert kdst_topk.update_diary(conn, 6, item_vec * 0.85 + other * 0.15) == 1
+    assert _stored(conn, item_hash) == [1, 6, 2]
+
+
+def test_deletes_keep_a_prefix_and_mark_short_truncated_lists_stale(conn, monkeypatch):
+    monkeypatch.setattr(kdst_topk, 'KDST_TOPK_DEPTH', 4)
+    items = _create_lists(conn, n_items=2)
+    rng = np.random.default_rng(11)
+    vectors = {diary_id: rng.standard_normal(DIM).astype(np.float32) for diary_id in range(1, 11)}
+    for diary_id, vec in vectors.items():
+        kdst_topk.update_diary(conn, diary_id, vec)
+
+    first = next(iter(items))
+    for diary_id in _stored(conn, first)[:2]:
+        kdst_topk.remove_diary(conn, diary_id)
+        del vectors[diary_id]
+    for item_hash, item_vec in items.items():
+        stored = _stored(conn, item_hash)
+        # 삭제 후에도 남은 행은 남은 일기의 정확한 상위 len(stored)개
+        assert stored == _exact(vectors, item_vec, len(stored))
+
+    ready, stale = kdst_topk.read_lists(conn, 'all', list(items), top_k=3)
+    assert first in stale
+    assert first not in ready
+    for item_hash in ready:
+        assert [diary_id for diary_id, _ in ready[item_hash]] == _stored(conn, item_hash)[:3]
+
+
+def test_update_moves_diary_between_buckets(conn, monkeypatch):
+    monkeypatch.setattr(kdst_topk, 'KDST_TOPK_DEPTH', 5)
+    child_items = _create_lists(conn, n_items=1, bucket='child:1')
+    other_hash = next(iter(_create_lists(conn, n_items=1, bucket='child:2')))
+    (item_hash, item_vec), = child_items.items()
+
+    assert kdst_topk.update_diary(conn, 42, item_vec, child_id=1) == 1
+    assert _stored(conn, item_hash, 'child:1') == [42]
+
+    # 아이가 바뀌면 이전 범위의 목록에서 빠지고 새 범위 목록에만 들어감
+    kdst_topk.update_diary(conn, 42, item_vec, child_id=2)
+    assert _stored(conn, item_hash, 'child:1') == []
+    assert _stored(conn, other_hash, 'child:2') == [42]
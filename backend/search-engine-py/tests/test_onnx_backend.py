@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pytest
+
+pytest.importorskip('onnxruntime')
+pytest.importorskip('sentence_transformers')
+
+import onnx_backend  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def exported_model():
+    """임시 VECTOR_DB_DIR/onnx에 float32와 int8 모델을 내보냄"""
+    return onnx_backend.export_onnx(quantize=True)
+
+
+@pytest.mark.parametrize('quantized, min_cosine', [
+    (False, onnx_backend.PARITY_MIN_COSINE),
+    (True, onnx_backend.PARITY_MIN_COSINE_QUANTIZED),
+])
+def test_onnx_embeddings_match_torch(exported_model, quantized, min_cosine):
+    check = onnx_backend.parity_check(quantized=quantized, limit=0)
+    assert check['texts'] == len(onnx_backend.PARITY_SAMPLE_TEXTS)
+    assert check['min_cosine'] >= min_cosine
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from quantized_index import (
+    QUANTIZATION_MODES,
+    QuantizedVectorIndex,
+    dequantize_rows,
+    quantize_rows,
+    recall_check,
+    synthetic_vectors,
+)
+from vector_search import VectorIndex, normalize_rows
+
+
+@pytest.mark.parametrize('mode', QUANTIZATION_MODES)
+def test_reranked_recall_matches_float32(mode):
+    vectors, queries = synthetic_vectors(3000, dim=64, n_queries=30)
+    check = recall_check(vectors, queries, mode, top_k=10)
+    assert check['recall_at_k_reranked'] >= 0.99
+    assert check['memory_ratio'] >= (3.5 if mode == 'int8' else 1.9)
+
+
+@pytest.mark.parametrize('mode', QUANTIZATION_MODES)
+def test_approximate_scores_match_dequantized_matrix(mode, monkeypatch):
+    # 여러 구간으로 나눠 채점해도 행별 scale이 제 구간에 곱해지는지 확인
+    monkeypatch.setattr('quantized_index.SCORE_CHUNK_ROWS', 7)
+    vectors, queries = synthetic_vectors(50, dim=16, n_queries=3)
+    index = QuantizedVectorIndex.from_vectors(vectors, [{'id': i} for i in range(50)], mode)
+    queries = normalize_rows(queries)
+    expected = queries @ dequantize_rows(index.codes, index.scales).T
+    np.testing.assert_allclose(index.approximate_scores(queries), expected, rtol=1e-5, atol=1e-6)
+
+
+def test_reranked_scores_are_exact():
+    vectors, queries = synthetic_vectors(500, dim=32, n_queries=5)
+    items = [{'id': i} for i in range(500)]
+    exact = VectorIndex(vectors, items)
+    index = QuantizedVectorIndex.from_vectors(vectors, items, 'int8', exact_fn=lambda rows: exact.matrix[rows])
+    for (item, similarity), (expected_item, expected) in zip(index.search(queries[0], 5), exact.search(queries[0], 5)):
+        assert item['id'] == expected_item['id']
+        assert similarity == pytest.approx(expected, abs=1e-5)
+
+
+def test_matrix_is_not_materialized():
+    codes, scales = quantize_rows(np.eye(4, dtype=np.float32), 'int8')
+    index = QuantizedVectorIndex(codes, scales, [{'id': i} for i in range(4)], 'int8')
+    with pytest.raises(AttributeError):
+        index.matrix
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sqlite3
+
+import pytest
+
+import sqlite_pool
+
+
+def _tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def _version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def test_migrate_new_database_to_latest_version(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'diary_embeddings.db'))
+    assert sqlite_pool.migrate(conn) == sqlite_pool.SCHEMA_VERSION
+    assert _version(conn) == sqlite_pool.SCHEMA_VERSION
+    assert {'diary_embeddings', 'lexical_docs', 'store_generations', 'kdst_topk', 'lexical_stats'} <= _tables(conn)
+    # 이미 최신이면 아무것도 하지 않음
+    assert sqlite_pool.migrate(conn) == 0
+
+
+def test_migrate_runs_only_remaining_steps(tmp_path, monkeypatch):
+    conn = sqlite3.connect(str(tmp_path / 'diary_embeddings.db'))
+    sqlite_pool._migrate_v1(conn.cursor())
+    conn.execute('PRAGMA user_version = 1')
+    conn.commit()
+
+    original = list(sqlite_pool.MIGRATIONS)
+    calls = []
+    steps = [lambda cursor, step=step: calls.append(step) or step(cursor) for step in original]
+    monkeypatch.setattr(sqlite_pool, 'MIGRATIONS', steps)
+
+    assert sqlite_pool.migrate(conn) == sqlite_pool.SCHEMA_VERSION - 1
+    assert calls == original[1:]
+    assert _version(conn) == sqlite_pool.SCHEMA_VERSION
+    assert 'kdst_topk' in _tables(conn)
+
+
+def test_failed_migration_rolls_back_and_keeps_version(tmp_path, monkeypatch):
+    conn = sqlite3.connect(str(tmp_path / 'diary_embeddings.db'))
+
+    def broken(cursor):
+        cursor.execute('CREATE TABLE half_done (id INTEGER)')
+        raise RuntimeError('마이그레이션 실패')
+
+    monkeypatch.setattr(sqlite_pool, 'MIGRATIONS', sqlite_pool.MIGRATIONS + [broken])
+    monkeypatch.setattr(sqlite_pool, 'SCHEMA_VERSION', len(sqlite_pool.MIGRATIONS))
+    with pytest.raises(RuntimeError):
+        sqlite_pool.migrate(conn)
+
+    assert _version(conn) == 0
+    assert 'half_done' not in _tables(conn)
+    assert 'diary_embeddings' not in _tables(conn)
+
+
+def test_pool_migrates_once_and_reuses_connections(tmp_path):
+    db_path = str(tmp_path / 'diary_embeddings.db')
+    with sqlite_pool.connection(db_path) as conn:
+        first = conn
+        assert _version(conn) == sqlite_pool.SCHEMA_VERSION
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == sqlite_pool.SQLITE_JOURNAL_MODE.lower()
+    with sqlite_pool.connection(db_path) as conn:
+        assert conn is first
+
+
+def test_transaction_rolls_back_on_error(tmp_path):
+    db_path = str(tmp_path / 'diary_embeddings.db')
+    with pytest.raises(ValueError):
+        with sqlite_pool.transaction(db_path) as conn:
+            conn.execute("INSERT INTO diary_embeddings (diary_id, text) VALUES (1, '일기')")
+            raise ValueError('중단')
+    with sqlite_pool.connection(db_path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM diary_embeddings').fetchone()[0] == 0
+
+
+def test_setup_hook_replaces_diary_migrations(tmp_path):
+    db_path = str(tmp_path / 'other.db')
+
+    def setup(conn):
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS other (id INTEGER)')
+
+    with sqlite_pool.connection(db_path, setup) as conn:
+        assert _tables(conn) == {'other'}
+        assert _version(conn) == 0
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from vector_search import LiveVectorIndex, VectorIndex
+
+
+def _vectors(n, dim=8, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+
+def _live_index(vectors):
+    index = LiveVectorIndex()
+    for key, vec in enumerate(vectors):
+        index.upsert(key, vec, {'id': key}, stamp=('hash', key))
+    return index
+
+
+def _ids(hits):
+    return [item['id'] for item, _ in hits]
+
+
+def test_removed_rows_are_tombstoned_and_skipped():
+    vectors = _vectors(100)
+    index = _live_index(vectors)
+    for key in range(0, 100, 3):
+        assert index.remove(key)
+    assert not index.remove(0)
+
+    assert index.tombstones == 34
+    assert len(index) == 66
+    assert 3 not in index and 4 in index
+    # 행렬 크기는 그대로이고 mask로 제외
+    assert index.matrix.shape[0] == 100
+    assert index.mask.sum() == 66
+
+    keep = [key for key in range(100) if key % 3]
+    expected = VectorIndex(vectors[keep], [{'id': key} for key in keep])
+    query = _vectors(1, seed=1)[0]
+    assert _ids(index.search(query, 10)) == _ids(expected.search(query, 10))
+    assert [_ids(hits) for hits in index.search_batch(_vectors(3, seed=2), 5)] == \
+        [_ids(hits) for hits in expected.search_batch(_vectors(3, seed=2), 5)]
+
+
+def test_compact_keeps_live_rows_and_stamps():
+    vectors = _vectors(100)
+    index = _live_index(vectors)
+    for key in range(50):
+        index.remove(key)
+    assert index.needs_compaction(ratio=0.25, minimum=10)
+    query = _vectors(1, seed=3)[0]
+    before = index.search(query, 10)
+
+    index.compact()
+
+    assert index.tombstones == 0
+    assert index.mask is None
+    assert index.matrix.shape[0] == 50
+    assert index.keys == list(range(50, 100))
+    assert index.row_of == {key: row for row, key in enumerate(range(50, 100))}
+    assert index.stamp_map() == {key: ('hash', key) for key in range(50, 100)}
+    assert _ids(index.search(query, 10)) == _ids(before)
+    np.testing.assert_allclose([s for _, s in index.search(query, 10)], [s for _, s in before], rtol=1e-6)
+
+
+def test_upsert_after_remove_reuses_key_without_duplicates():
+    index = _live_index(_vectors(4))
+    index.remove(1)
+    index.upsert(1, np.eye(8, dtype=np.float32)[0], {'id': 1}, stamp=('new', 1))
+    index.upsert(2, np.eye(8, dtype=np.float32)[1], {'id': 2}, stamp=('new', 2))
+
+    assert len(index) == 4
+    assert index.stamp_map()[1] == ('new', 1)
+    assert _ids(index.search(np.eye(8, dtype=np.float32)[0], 1)) == [1]
+    index.compact()
+    assert sorted(index.keys) == [0, 1, 2, 3]
+    assert _ids(index.search(np.eye(8, dtype=np.float32)[1], 1)) == [2]
+
+
+def test_upsert_rejects_dimension_mismatch():
+    index = _live_index(_vectors(2))
+    with pytest.raises(ValueError):
+        index.upsert(9, np.ones(4, dtype=np.float32), {'id': 9})
+    assert 9 not in index
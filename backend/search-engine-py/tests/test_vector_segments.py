@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pytest
+
+import vector_segments
+from sqlite_pool import transaction
+from vector_search import normalize_rows
+from vector_store import encode_embedding
+
+DIM = 8
+
+
+@pytest.fixture
+def segments(tmp_path, monkeypatch):
+    """임시 DB와 세그먼트 디렉터리 → DB 경로"""
+    segment_dir = tmp_path / 'segments'
+    monkeypatch.setattr(vector_segments, 'SEGMENT_DIR', str(segment_dir))
+    monkeypatch.setattr(vector_segments, 'MANIFEST_PATH', str(segment_dir / 'manifest.json'))
+    return str(tmp_path / 'diary_embeddings.db')
+
+
+def _vectors(ids, seed=0):
+    rng = np.random.default_rng(seed)
+    return {diary_id: rng.standard_normal(DIM).astype(np.float32) for diary_id in ids}
+
+
+def _insert(db_path, vectors):
+    with transaction(db_path) as conn:
+        conn.executemany(
+            'INSERT INTO diary_embeddings (diary_id, text, embedding) VALUES (?, ?, ?)',
+            [(diary_id, f'일기 {diary_id}', encode_embedding(vec)) for diary_id, vec in vectors.items()]
+        )
+
+
+def _live(snapshot):
+    """{diary_id: 정규화된 벡터} (diary_id별 마지막 유효 행)"""
+    return {int(snapshot.ids[row]): np.asarray(snapshot.matrix[row]) for row in snapshot.live_rows}
+
+
+def _assert_matches(snapshot, vectors):
+    live = _live(snapshot)
+    assert sorted(live) == sorted(vectors)
+    for diary_id, vec in vectors.items():
+        np.testing.assert_allclose(live[diary_id], normalize_rows(vec)[0], rtol=1e-6)
+
+
+def test_appended_rows_win_over_earlier_rows_and_deletes_hide_ids(segments):
+    vectors = _vectors(range(1, 11))
+    _insert(segments, vectors)
+    assert vector_segments.rebuild(segments)['rows'] == 10
+
+    updated = _vectors([3, 11], seed=1)
+    assert vector_segments.append_entries(list(updated.items()) + [(5, None)])
+    vectors.update(updated)
+    del vectors[5]
+
+    snapshot = vector_segments.open_snapshot()
+    assert snapshot.manifest['rows'] == 13
+    _assert_matches(snapshot, vectors)
+    rows = snapshot.rows_for([3, 5, 11, 99])
+    assert rows[1] == -1 and rows[3] == -1
+    assert rows[0] == 10 and rows[2] == 11
+
+
+def test_compact_keeps_only_live_rows_and_swaps_segment(segments):
+    vectors = _vectors(range(1, 21))
+    _insert(segments, vectors)
+    vector_segments.rebuild(segments)
+    for seed in range(2, 5):
+        updated = _vectors(range(1, 6), seed=seed)
+        vector_segments.append_entries(list(updated.items()))
+        vectors.update(updated)
+    vector_segments.append_entries([(20, None)])
+    del vectors[20]
+    old_segment = vector_segments.read_manifest()['segment']
+
+    result = vector_segments.compact()
+
+    manifest = vector_segments.read_manifest()
+    assert result == {'segment': manifest['segment'], 'rows_before': 36, 'rows_after': 19}
+    assert manifest['segment'] != old_segment
+    assert manifest['rows'] == manifest['compacted_rows'] == 19
+    assert not any(os.path.exists(path) for path in vector_segments.segment_paths(old_segment))
+    _assert_matches(vector_segments.open_snapshot(), vectors)
+
+
+def test_append_after_interrupted_write_drops_stale_tail(segments):
+    vectors = _vectors(range(1, 4))
+    _insert(segments, vectors)
+    vector_segments.rebuild(segments)
+    # manifest를 갱신하기 전에 중단된 덧붙이기의 꼬리
+    for path in vector_segments.segment_paths(vector_segments.read_manifest()['segment']):
+        with open(path, 'ab') as f:
+            f.write(b'\xff' * 7)
+
+    updated = _vectors([2], seed=5)
+    vector_segments.append_entries(list(updated.items()))
+    vectors.update(updated)
+    _assert_matches(vector_segments.open_snapshot(), vectors)
+
+
+def test_write_transaction_appends_only_on_commit(segments):
+    vectors = _vectors(range(1, 4))
+    _insert(segments, vectors)
+    vector_segments.rebuild(segments)
+
+    with pytest.raises(RuntimeError):
+        with vector_segments.write_transaction(segments) as (conn, entries):
+            conn.execute('DELETE FROM diary_embeddings WHERE diary_id = 1')
+            entries.append((1, None))
+            raise RuntimeError('롤백')
+    assert vector_segments.read_manifest()['rows'] == 3
+
+    with vector_segments.write_transaction(segments) as (conn, entries):
+        conn.execute('DELETE FROM diary_embeddings WHERE diary_id = 1')
+        entries.append((1, None))
+    del vectors[1]
+    assert vector_segments.read_manifest()['rows'] == 4
+    _assert_matches(vector_segments.open_snapshot(), vectors)
+
+
+def test_append_dimension_mismatch_disables_segment_but_commits(segments):
+    _insert(segments, _vectors(range(1, 3)))
+    vector_segments.rebuild(segments)
+
+    with vector_segments.write_transaction(segments) as (conn, entries):
+        conn.execute('DELETE FROM diary_embeddings WHERE diary_id = 2')
+        entries.append((3, np.ones(DIM + 1, dtype=np.float32)))
+
+    assert vector_segments.read_manifest() is None
+    with transaction(segments) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM diary_embeddings').fetchone()[0] == 1
@@ -1,12 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import startup_profile
+import request_timings
 import json
 import sys
-import numpy as np
-from sentence_transformers import SentenceTransformer
-import sqlite3
 import os
+import vector_segments
+import kdst_topk
+from result_cache import bump_generations
+from lexical_index import index_document
+from diary_chunks import embed_texts, replace_chunks
+from ndjson_stream import STREAM_MODE, run_stream
+from sqlite_pool import connection
+from vector_store import EMBEDDING_DB_PATH, decode_embedding, encode_embedding, text_hash
+
+startup_profile.mark_imports_done()
 
 # UTF-8 인코딩 설정 (Windows 환경 대응)
 if sys.platform.startswith('win'):
@@ -16,114 +25,261 @@ if sys.platform.startswith('win'):
     # stdin도 UTF-8로 설정
     sys.stdin = codecs.getreader('utf-8')(sys.stdin.detach())
 
-# 모델 로드
-model = SentenceTransformer('BM-K/KoSimCSE-roberta-multitask')
+# diary_id가 이미 있으면 같은 행을 갱신 (조회 후 INSERT/UPDATE를 고르지 않으므로 동시 저장에도 UNIQUE 충돌이 없음)
+UPSERT_EMBEDDING_SQL = '''
+    INSERT INTO diary_embeddings (diary_id, text, embedding, date, parent_id, child_id, text_hash)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(diary_id) DO UPDATE SET
+        text = excluded.text, embedding = excluded.embedding, date = excluded.date,
+        parent_id = excluded.parent_id, child_id = excluded.child_id, text_hash = excluded.text_hash,
+        created_at = CURRENT_TIMESTAMP
+'''
+
+UPDATE_METADATA_SQL = '''
+    UPDATE diary_embeddings
+    SET date = ?, parent_id = ?, child_id = ?, text_hash = ?, created_at = CURRENT_TIMESTAMP
+    WHERE diary_id = ?
+'''
 
-def get_embedding(text):
-    """텍스트를 벡터로 변환"""
+def get_chunked_embedding(text):
+    """긴 텍스트는 토큰 기준 청크로 나눠 배치 인코딩 → (일기 벡터, [(청크 텍스트, 청크 벡터), ...])"""
     try:
-        embedding = model.encode(text)
-        return embedding.tolist()
+        return embed_texts([text])[0]
     except Exception as e:
         print(f"임베딩 생성 실패: {e}", file=sys.stderr)
-        return None
+        return None, []
+
+def compose_diary_text(diary_data):
+    """임베딩할 텍스트 구성 (날짜 + 제목 + 내용 + [비공개 캡션])"""
+    date_str = diary_data.get('date', '')
+    title = diary_data.get('title', '')
+    content = diary_data.get('content', '')
+    captions = diary_data.get('captions') or []
+    if isinstance(captions, str):
+        # 잘못 전달된 경우 문자열을 리스트로 처리
+        captions = [captions]
+    if not isinstance(captions, list):
+        captions = []
+    
+    if date_str:
+        base_text = f"{date_str} : {content}".strip()
+    else:
+        base_text = f"{title} {content}".strip()
+    captions_text = " ".join([str(c).strip() for c in captions if str(c).strip()])
+    return base_text if not captions_text else f"{base_text} {captions_text}".strip()
+
+def _text_unchanged(existing, text, new_hash):
+    """저장된 (text, text_hash, embedding)과 텍스트가 같은지 (예전 행은 해시 없이 텍스트로 비교)"""
+    return existing is not None and (existing[1] == new_hash or (existing[1] is None and existing[0] == text))
+
+def _stored_rows(conn, diary_ids):
+    """{str(diary_id): (text, text_hash, embedding)}"""
+    diary_ids = list(dict.fromkeys(d for d in diary_ids if d is not None))
+    stored = {}
+    # SQLite 바인딩 변수 개수 제한을 넘지 않도록 나누어 조회
+    for start in range(0, len(diary_ids), 500):
+        chunk = diary_ids[start:start + 500]
+        for diary_id, text, hash_value, blob in conn.execute(
+            f"SELECT diary_id, text, text_hash, embedding FROM diary_embeddings WHERE diary_id IN ({','.join('?' * len(chunk))})",
+            chunk
+        ).fetchall():
+            stored[str(diary_id)] = (text, hash_value, blob)
+    return stored
 
-def upsert_diary(diary_data):
-    """일기 데이터를 벡터 DB에 저장/업데이트"""
+def _encode_changed(prepared, stored, encoded):
+    """저장된 텍스트와 다르고 아직 인코딩하지 않은 일기를 한 번의 배치로 인코딩해 encoded에 추가"""
+    to_encode = {}
+    for _, diary_data, text, new_hash in prepared:
+        if not _text_unchanged(stored.get(str(diary_data['id'])), text, new_hash) and new_hash not in encoded:
+            to_encode[new_hash] = text
+    if not to_encode:
+        return
     try:
-        # 텍스트 준비 (날짜 + 제목 + 내용 + [비공개 캡션])
-        date_str = diary_data.get('date', '')
-        title = diary_data.get('title', '')
-        content = diary_data.get('content', '')
-        captions = diary_data.get('captions') or []
-        if isinstance(captions, str):
-            # 잘못 전달된 경우 문자열을 리스트로 처리
-            captions = [captions]
-        if not isinstance(captions, list):
-            captions = []
-        
-        if date_str:
-            base_text = f"{date_str} : {content}".strip()
-        else:
-            base_text = f"{title} {content}".strip()
-        captions_text = " ".join([str(c).strip() for c in captions if str(c).strip()])
-        text = base_text if not captions_text else f"{base_text} {captions_text}".strip()
-        if not text:
-            return {"success": False, "message": "텍스트가 비어있습니다."}
-        
-        # 벡터 임베딩 생성
-        embedding = get_embedding(text)
-        if embedding is None:
-            return {"success": False, "message": "임베딩 생성 실패"}
-        
-        # SQLite DB에 저장 (간단한 벡터 저장소)
-        db_path = os.path.join(os.path.dirname(__file__), 'my_local_qdrant_db', 'diary_embeddings.db')
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # 테이블 생성
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS diary_embeddings (
-                id INTEGER PRIMARY KEY,
-                diary_id INTEGER UNIQUE,
-                text TEXT,
-                embedding BLOB,
-                date TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # 마이그레이션: parent_id, child_id 컬럼 없으면 추가
-        try:
-            cursor.execute('ALTER TABLE diary_embeddings ADD COLUMN parent_id INTEGER')
-        except Exception:
-            pass
-        try:
-            cursor.execute('ALTER TABLE diary_embeddings ADD COLUMN child_id INTEGER')
-        except Exception:
-            pass
-        
-        # 기존 데이터 확인
-        cursor.execute('SELECT id FROM diary_embeddings WHERE diary_id = ?', (diary_data['id'],))
-        existing = cursor.fetchone()
-        
-        parent_id = diary_data.get('parent_id')
-        child_id = diary_data.get('child_id')
-
-        if existing:
-            # 업데이트
-            cursor.execute('''
-                UPDATE diary_embeddings 
-                SET text = ?, embedding = ?, date = ?, parent_id = ?, child_id = ?, created_at = CURRENT_TIMESTAMP
-                WHERE diary_id = ?
-            ''', (text, json.dumps(embedding), diary_data.get('date', ''), parent_id, child_id, diary_data['id']))
-            action = "updated"
-        else:
-            # 새로 생성
-            cursor.execute('''
-                INSERT INTO diary_embeddings (diary_id, text, embedding, date, parent_id, child_id)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (diary_data['id'], text, json.dumps(embedding), diary_data.get('date', ''), parent_id, child_id))
-            action = "created"
-        
-        conn.commit()
-        conn.close()
-        
+        encoded.update(zip(to_encode, embed_texts(list(to_encode.values()))))
+    except Exception as e:
+        print(f"임베딩 생성 실패: {e}", file=sys.stderr)
+        # 배치 인코딩에 실패하면 일기별로 다시 시도
+        if len(to_encode) > 1:
+            encoded.update((new_hash, get_chunked_embedding(text)) for new_hash, text in to_encode.items())
+
+def _write_diary(conn, diary_data, text, new_hash, existing, encoded):
+    """쓰기 트랜잭션 안에서 일기 하나를 기록 → (결과, 세그먼트 항목, (무효화할 아이 목록, 부모 목록))
+
+    existing: 같은 트랜잭션에서 읽은 (text, text_hash, embedding), encoded: {텍스트 해시: (일기 벡터, 청크 목록)}
+    세그먼트 항목/무효화 대상이 없으면 None입니다.
+    """
+    diary_id = diary_data['id']
+    date = diary_data.get('date', '')
+    parent_id = diary_data.get('parent_id')
+    child_id = diary_data.get('child_id')
+
+    if _text_unchanged(existing, text, new_hash):
+        # 텍스트가 같으면 임베딩 생략, 메타데이터만 갱신
+        previous = conn.execute(
+            'SELECT date, parent_id, child_id FROM diary_embeddings WHERE diary_id = ?', (diary_id,)
+        ).fetchone()
+        conn.execute(UPDATE_METADATA_SQL, (date, parent_id, child_id, new_hash, diary_id))
+        affected = None
+        if previous and tuple(previous) != (date, parent_id, child_id):
+            # 검색 결과 캐시 무효화 대상 (이전 아이/부모 포함)
+            affected = ([child_id, previous[2]], [parent_id, previous[1]])
+            if (previous[1], previous[2]) != (parent_id, child_id):
+                # 아이/부모가 바뀌면 KDST 문항별 목록도 옮김 (저장된 일기/청크 벡터로 다시 채점)
+                chunk_blobs = conn.execute(
+                    'SELECT embedding FROM diary_chunks WHERE diary_id = ? ORDER BY chunk_index', (diary_id,)
+                ).fetchall()
+                kdst_topk.update_diary(
+                    conn, diary_id, decode_embedding(existing[2]),
+                    [decode_embedding(blob) for blob, in chunk_blobs], child_id, parent_id
+                )
         return {
             "success": True, 
-            "message": f"벡터 임베딩 {action} 완료",
-            "diary_id": diary_data['id'],
+            "message": "벡터 임베딩 메타데이터 갱신 완료 (텍스트 변경 없음)",
+            "diary_id": diary_id,
             "text_length": len(text),
-            "embedding_dim": len(embedding)
-        }
-        
+            "embedding_dim": len(decode_embedding(existing[2])),
+            "embedding_skipped": True
+        }, None, affected
+
+    embedding, chunks = encoded.get(new_hash, (None, []))
+    if embedding is None:
+        return {"success": False, "diary_id": diary_id, "message": "임베딩 생성 실패"}, None, None
+
+    previous = conn.execute(
+        'SELECT parent_id, child_id FROM diary_embeddings WHERE diary_id = ?', (diary_id,)
+    ).fetchone()
+    conn.execute(UPSERT_EMBEDDING_SQL, (
+        diary_id, text, encode_embedding(embedding), date, parent_id, child_id, new_hash
+    ))
+    # 청크와 BM25 색인도 같은 트랜잭션에서 갱신 (짧은 일기는 이전 청크만 삭제)
+    replace_chunks(conn, diary_id, [(chunk, encode_embedding(vec)) for chunk, vec in chunks])
+    index_document(conn, diary_id, text)
+    # KDST 문항별 상위 일기 목록 갱신 ((문항 수 × 차원) 행렬-벡터 곱 한 번)
+    kdst_topk.update_diary(conn, diary_id, embedding, [vec for _, vec in chunks], child_id, parent_id)
+    action = "updated" if previous else "created"
+    return {
+        "success": True, 
+        "message": f"벡터 임베딩 {action} 완료",
+        "diary_id": diary_id,
+        "text_length": len(text),
+        "embedding_dim": len(embedding),
+        "chunks": max(len(chunks), 1),
+        "embedding_skipped": False
+    }, (diary_id, embedding), (
+        [child_id] + ([previous[1]] if previous else []), [parent_id] + ([previous[0]] if previous else [])
+    )
+
+def upsert_diaries(batch, precomputed=None):
+    """여러 일기를 한 트랜잭션으로 저장/업데이트. 결과는 입력 순서대로
+
+    저장된 텍스트 해시와 같으면 임베딩을 다시 계산하지 않고 메타데이터만 갱신하며,
+    텍스트가 바뀐 일기들은 트랜잭션을 시작하기 전에 한 번의 배치로 인코딩합니다.
+    저장된 행은 쓰기 트랜잭션 안에서 다시 읽어 판단하므로, 그 사이 다른 쓰기가 텍스트를 바꿨으면 그 일기만 안에서 인코딩합니다.
+    일기 하나의 저장이 실패하면 그 일기만 SAVEPOINT로 되돌리고 나머지는 커밋합니다.
+    precomputed: {텍스트 해시: (일기 벡터, 청크 목록)} (미리 인코딩한 결과)
+    """
+    results = [None] * len(batch)
+    prepared = []
+    for position, diary_data in enumerate(batch):
+        if not isinstance(diary_data, dict) or diary_data.get('id') in (None, ''):
+            results[position] = {"success": False, "message": "일기 ID(id)가 제공되지 않았습니다."}
+            continue
+        text = compose_diary_text(diary_data)
+        if not text:
+            results[position] = {"success": False, "diary_id": diary_data['id'], "message": "텍스트가 비어있습니다."}
+            continue
+        prepared.append((position, diary_data, text, text_hash(text)))
+    if not prepared:
+        return results
+
+    try:
+        diary_ids = [diary_data['id'] for _, diary_data, _, _ in prepared]
+        encoded = dict(precomputed or {})
+        # 인코딩할 일기 고르기 (인코딩하는 동안 쓰기 잠금을 잡지 않도록 트랜잭션 밖에서 먼저 읽음)
+        if os.path.exists(EMBEDDING_DB_PATH):
+            with connection(EMBEDDING_DB_PATH) as conn:
+                stored = _stored_rows(conn, diary_ids)
+        else:
+            stored = {}
+        _encode_changed(prepared, stored, encoded)
+
+        children, parents = [], []
+        changed = False
+        # 메모리 맵 세그먼트 행은 segment_entries에 모아 두면 커밋 직전에 덧붙임 (롤백되면 덧붙이지 않음)
+        with request_timings.span('write'), vector_segments.write_transaction(EMBEDDING_DB_PATH, compact_if_needed=True) as (conn, segment_entries):
+            # 잠금을 잡은 뒤 다시 읽음 (위에서 읽은 뒤 다른 쓰기가 텍스트를 바꿨으면 그 일기만 여기서 인코딩)
+            stored = _stored_rows(conn, diary_ids)
+            _encode_changed(prepared, stored, encoded)
+            for position, diary_data, text, new_hash in prepared:
+                conn.execute('SAVEPOINT upsert_item')
+                try:
+                    result, segment_entry, affected = _write_diary(
+                        conn, diary_data, text, new_hash, stored.get(str(diary_data['id'])), encoded
+                    )
+                except Exception as e:
+                    conn.execute('ROLLBACK TO upsert_item')
+                    result, segment_entry, affected = {
+                        "success": False, "diary_id": diary_data['id'], "message": f"벡터 DB 저장 실패: {str(e)}"
+                    }, None, None
+                conn.execute('RELEASE upsert_item')
+                results[position] = result
+                if segment_entry is not None:
+                    segment_entries.append(segment_entry)
+                if affected is not None:
+                    changed = True
+                    children += affected[0]
+                    parents += affected[1]
+            if changed:
+                bump_generations(conn, children, parents)
     except Exception as e:
-        return {"success": False, "message": f"벡터 DB 저장 실패: {str(e)}"}
+        for position, diary_data, _, _ in prepared:
+            results[position] = {"success": False, "diary_id": diary_data['id'], "message": f"벡터 DB 저장 실패: {str(e)}"}
+    return results
+
+def upsert_diary(diary_data, precomputed=None):
+    """일기 데이터를 벡터 DB에 저장/업데이트 (upsert_diaries에 일기 하나를 넘긴 결과)"""
+    return upsert_diaries([diary_data], precomputed)[0]
+
+def diary_batch(payload):
+    """요청이 여러 일기(JSON 배열 또는 {"diaries": [...]})이면 일기 목록, 일기 하나이면 None"""
+    if isinstance(payload, list):
+        return payload
+    if isinstance(payload, dict) and isinstance(payload.get('diaries'), list):
+        return payload['diaries']
+    return None
+
+def batch_response(results):
+    """일기별 결과 목록 → 일괄 저장 응답 (모든 일기가 성공했을 때만 success)"""
+    succeeded = sum(1 for result in results if result.get('success'))
+    return {
+        "success": succeeded == len(results),
+        "message": f"일기 {len(results)}개 중 {succeeded}개 저장 완료",
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    }
+
+def upsert_requests(batch):
+    """--stream 배치: 일기 하나짜리 요청과 {"diaries": [...]} 요청의 일기를 모두 한 번에 인코딩하고 한 트랜잭션으로 저장
+
+    결과는 요청 순서대로 (여러 일기 요청은 batch_response 형태)
+    """
+    groups = [diary_batch(payload) for payload in batch]
+    diaries = []
+    for payload, group in zip(batch, groups):
+        diaries.extend([payload] if group is None else group)
+    results = iter(upsert_diaries(diaries))
+    return [
+        next(results) if group is None else batch_response([next(results) for _ in group])
+        for group in groups
+    ]
 
 def main():
     """메인 함수"""
+    if STREAM_MODE:
+        run_stream(upsert_requests, 'upsert')
+        return
     try:
         # stdin에서 JSON 데이터 읽기
         input_data = sys.stdin.read().strip()
@@ -131,14 +287,18 @@ def main():
             print(json.dumps({"success": False, "message": "입력 데이터가 없습니다."}))
             return
         
-        # JSON 파싱
-        diary_data = json.loads(input_data)
-        
-        # 벡터 DB에 저장/업데이트
-        result = upsert_diary(diary_data)
-        
-        # 결과 출력
-        print(json.dumps(result, ensure_ascii=False))
+        with request_timings.request('upsert') as timings:
+            # JSON 파싱
+            with request_timings.span('parse'):
+                payload = json.loads(input_data)
+            timings.report = request_timings.requested(payload)
+            
+            # 벡터 DB에 저장/업데이트 (여러 일기면 한 번에 인코딩하고 한 트랜잭션으로 저장)
+            batch = diary_batch(payload)
+            result = upsert_diary(payload) if batch is None else batch_response(upsert_diaries(batch))
+            
+            # 결과 출력 (--profile-startup이면 시작 시간 보고서, --timings/"timings": true이면 단계별 소요 시간 포함)
+            print(request_timings.dumps(startup_profile.attach(result), ensure_ascii=False))
         
     except json.JSONDecodeError as e:
         print(json.dumps({"success": False, "message": f"JSON 파싱 실패: {str(e)}"}))
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+공용 벡터 검색 코어
+정규화된 (N, D) float32 행렬 하나에 대해 행렬곱 한 번으로 전체 점수를 계산하고,
+argpartition으로 상위 k개만 골라 정렬합니다.
+search_diaries.py와 kdst_rag_module.py가 함께 사용합니다.
+"""
+
+import numpy as np
+
+from request_timings import record_scan
+
+
+def normalize_rows(matrix):
+    """각 행을 L2 정규화 (노름이 0인 행은 0 벡터로 유지)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores, k, score_threshold=None, mask=None):
+    """1차원 점수 배열에서 상위 k개의 인덱스를 점수 내림차순으로 반환 (mask가 False인 행은 제외)"""
+    if score_threshold is not None:
+        keep = scores >= score_threshold
+        candidates = np.flatnonzero(keep if mask is None else keep & mask)
+    elif mask is not None:
+        candidates = np.flatnonzero(mask)
+    else:
+        candidates = np.arange(scores.shape[0])
+    if k is None or k <= 0 or candidates.size == 0:
+        return candidates[:0]
+    if candidates.size > k:
+        part = np.argpartition(scores[candidates], -k)[-k:]
+        candidates = candidates[part]
+    order = np.argsort(-scores[candidates], kind='stable')
+    return candidates[order]
+
+
+class VectorIndex:
+    """정규화된 임베딩 행렬과 행별 메타데이터(items)를 함께 보관하는 검색 인덱스"""
+
+    # 검색 대상 행 마스크 (None이면 모든 행)
+    mask = None
+    # 근사 검색 백엔드 (ann_index.IVFFlatIndex 등, None이면 정확 검색)
+    ann = None
+
+    def __init__(self, vectors, items):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.size == 0:
+            vectors = vectors.reshape(0, 0)
+        self.matrix = normalize_rows(vectors) if len(vectors) else vectors
+        self.items = list(items)
+
+    @classmethod
+    def from_items(cls, data, vector_key='vector'):
+        """'vector' 키를 가진 dict 목록으로 인덱스 생성 (벡터 없는 항목과 차원이 다른 항목은 제외)"""
+        vectors = []
+        items = []
+        dim = None
+        for item in data or []:
+            vec = item.get(vector_key)
+            if vec is None or len(vec) == 0:
+                continue
+            vec = np.asarray(vec, dtype=np.float32).reshape(-1)
+            if dim is None:
+                dim = vec.shape[0]
+            elif vec.shape[0] != dim:
+                continue
+            vectors.append(vec)
+            items.append(item)
+        return cls(np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32), items)
+
+    @classmethod
+    def from_normalized(cls, matrix, items, mask=None):
+        """이미 행별로 정규화된 행렬(예: 세그먼트 memmap)을 복사 없이 그대로 사용"""
+        index = cls.__new__(cls)
+        index.matrix = matrix
+        index.items = list(items)
+        if mask is not None:
+            index.mask = mask
+        return index
+
+    def __len__(self):
+        return len(self.items)
+
+    def scores(self, query_vector):
+        """쿼리 벡터와 전체 행의 코사인 유사도"""
+        query = normalize_rows(query_vector)[0]
+        return self.matrix @ query
+
+    def rows_for_ids(self, ids):
+        """item['id'] 목록 → 행 번호 목록 (인덱스에 없는 id는 제외)"""
+        row_of = getattr(self, 'row_of', None)
+        if row_of is None:
+            # 변하지 않는 인덱스이므로 처음 한 번만 구성
+            row_of = self.row_of = {item['id']: row for row, item in enumerate(self.items) if item is not None}
+        return [row_of[i] for i in ids if i in row_of]
+
+    def score_rows(self, query_vector, rows):
+        """지정한 행들만 쿼리와의 코사인 유사도 계산"""
+        query = normalize_rows(query_vector)[0]
+        rows = np.asarray(rows, dtype=np.int64)
+        return self.matrix[rows] @ query if rows.size else np.zeros(0, dtype=np.float32)
+
+    def search_rows(self, query_vector, rows, top_k, score_threshold=None):
+        """후보 행들만 채점하여 상위 k개의 (item, similarity) 목록 반환 (어휘 후보 필터용)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        scores = self.score_rows(query_vector, rows)
+        record_scan(rows.size)
+        return [(self.items[rows[i]], float(scores[i])) for i in top_k_indices(scores, top_k, score_threshold)]
+
+    def rescore(self, hits, overrides, top_k, score_threshold=None, allowed_ids=None):
+        """후보 (item, similarity) 목록의 점수를 {id: score}로 덮어쓴 뒤 다시 상위 k개를 고름
+
+        overrides에만 있는 id(긴 일기의 청크 점수 등)도 인덱스에 있으면 후보에 추가합니다.
+        allowed_ids가 있으면 그 id만 남깁니다.
+        """
+        scored = {item['id']: (item, similarity) for item, similarity in hits}
+        extra = [i for i in overrides if i not in scored and (allowed_ids is None or i in allowed_ids)]
+        for row in self.rows_for_ids(extra):
+            item = self.items[row]
+            scored[item['id']] = (item, 0.0)
+        ranked = sorted(
+            ((item, float(overrides.get(key, similarity))) for key, (item, similarity) in scored.items()),
+            key=lambda hit: -hit[1]
+        )
+        if score_threshold is not None:
+            ranked = [hit for hit in ranked if hit[1] >= score_threshold]
+        return ranked[:top_k] if top_k and top_k > 0 else []
+
+    def search(self, query_vector, top_k, score_threshold=None):
+        """상위 k개의 (item, similarity) 목록을 유사도 내림차순으로 반환"""
+        if len(self) == 0:
+            return []
+        if self.ann is not None:
+            return self.ann.search(query_vector, top_k, score_threshold)
+        scores = self.scores(query_vector)
+        record_scan(len(self))
+        hits = top_k_indices(scores, top_k, score_threshold, self.mask)
+        return [(self.items[i], float(scores[i])) for i in hits]
+
+    def search_batch(self, query_vectors, top_k, score_threshold=None):
+        """여러 쿼리를 (Q, D)·(D, N) 행렬곱 한 번으로 채점하여 쿼리별 search 결과 목록을 반환"""
+        queries = normalize_rows(query_vectors)
+        if len(self) == 0:
+            return [[] for _ in range(queries.shape[0])]
+        if self.ann is not None:
+            return self.ann.search_batch(queries, top_k, score_threshold)
+        scores = queries @ self.matrix.T
+        record_scan(len(self) * queries.shape[0], queries.shape[0])
+        mask = self.mask
+        results = []
+        for row in scores:
+            results.append([(self.items[i], float(row[i])) for i in top_k_indices(row, top_k, score_threshold, mask)])
+        return results
+
+
+class LiveVectorIndex(VectorIndex):
+    """키(diary_id) 기준 단일 행 삽입/갱신/삭제를 O(dim)에 반영하는 검색 인덱스
+
+    삭제는 행을 tombstone으로 표시만 하고, tombstone이 쌓이면 compact()로 정리합니다.
+    각 행에는 스탬프(vector_store.row_stamp: 텍스트 해시, 메타데이터, 저장 시각)를 함께 보관하여
+    DB와의 일관성 검사에 사용합니다.
+    변경 메서드는 스레드 안전하지 않으므로, 동시에 검색하는 쪽과는 호출한 쪽이 잠금으로 분리해야 합니다
+    (search_server의 index_lock).
+    """
+
+    def __init__(self, dim=None, capacity=64):
+        self.dim = dim
+        self._capacity = 0
+        self._size = 0
+        self._matrix = np.zeros((0, dim or 0), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self.keys = []
+        self.items = []
+        self.stamps = []
+        self.row_of = {}
+        self.tombstones = 0
+        if dim:
+            self._grow(capacity)
+
+    def _grow(self, capacity):
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        alive = np.zeros(capacity, dtype=bool)
+        if self._size:
+            matrix[:self._size] = self._matrix[:self._size]
+            alive[:self._size] = self._alive[:self._size]
+        self._matrix, self._alive, self._capacity = matrix, alive, capacity
+
+    @property
+    def matrix(self):
+        return self._matrix[:self._size]
+
+    @property
+    def mask(self):
+        return self._alive[:self._size] if self.tombstones else None
+
+    def __len__(self):
+        return len(self.row_of)
+
+    def __contains__(self, key):
+        return key in self.row_of
+
+    def upsert(self, key, vector, item, stamp=None):
+        """행 삽입 또는 제자리 갱신 (용량이 부족하면 두 배로 늘림)"""
+        vec = normalize_rows(vector)[0]
+        if self.dim is None:
+            self.dim = vec.shape[0]
+            self._grow(64)
+        elif vec.shape[0] != self.dim:
+            raise ValueError(f"임베딩 차원 불일치: {vec.shape[0]} != {self.dim}")
+
+        row = self.row_of.get(key)
+        if row is None:
+            if self._size == self._capacity:
+                self._grow(max(64, self._capacity * 2))
+            row = self._size
+            # 행 내용을 모두 채운 뒤에 크기를 늘림 (크기 안의 행은 항상 완성된 상태)
+            self._matrix[row] = vec
+            self._alive[row] = True
+            self.keys.append(key)
+            self.items.append(item)
+            self.stamps.append(stamp)
+            self._size += 1
+            self.row_of[key] = row
+        else:
+            self.items[row] = item
+            self.stamps[row] = stamp
+            self._matrix[row] = vec
+            self._alive[row] = True
+        if self.ann is not None:
+            self.ann.add(row)
+        return row
+
+    def remove(self, key):
+        """행을 tombstone으로 표시 (존재하지 않으면 False)"""
+        row = self.row_of.pop(key, None)
+        if row is None:
+            return False
+        self._alive[row] = False
+        self.items[row] = None
+        self.tombstones += 1
+        return True
+
+    def needs_compaction(self, ratio=0.25, minimum=64):
+        return self.tombstones >= max(minimum, int(self._size * ratio))
+
+    def compact(self):
+        """tombstone 행을 제거하고 살아 있는 행만 앞으로 모읍니다"""
+        if not self.tombstones:
+            return
+        live = np.flatnonzero(self._alive[:self._size])
+        capacity = max(64, self._capacity)
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:live.size] = self._matrix[live]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:live.size] = True
+        self.keys = [self.keys[i] for i in live]
+        self.items = [self.items[i] for i in live]
+        self.stamps = [self.stamps[i] for i in live]
+        self.row_of = {key: row for row, key in enumerate(self.keys)}
+        self._matrix, self._alive, self._size = matrix, alive, live.size
+        self.tombstones = 0
+        if self.ann is not None:
+            self.ann.reindex(live)
+
+    def stamp_map(self):
+        """살아 있는 행의 {key: stamp}"""
+        return {key: self.stamps[row] for key, row in self.row_of.items()}
+
+
+class ChunkIndex:
+    """긴 일기의 청크 벡터 (diary_id별로 연속 배치)와 일기 단위 점수 집계"""
+
+    def __init__(self, vectors, diary_ids):
+        diary_ids = np.asarray(diary_ids)
+        order = np.argsort(diary_ids, kind='stable')
+        self.matrix = normalize_rows(np.vstack(vectors)[order])
+        self.diary_ids, self.starts = np.unique(diary_ids[order], return_index=True)
+        self.counts = np.diff(np.append(self.starts, len(order)))
+
+    def __len__(self):
+        return int(self.matrix.shape[0])
+
+    def aggregate(self, query_vector, method='max', top_m=2):
+        """{diary_id: 청크 유사도 집계} (max: 최댓값, mean: 상위 top_m개 평균)"""
+        return self.aggregate_batch(normalize_rows(query_vector), method, top_m)[0]
+
+    def aggregate_batch(self, query_vectors, method='max', top_m=2):
+        """여러 쿼리를 행렬곱 한 번으로 채점하여 쿼리별 {diary_id: score} 목록 반환"""
+        scores = normalize_rows(query_vectors) @ self.matrix.T
+        if method == 'max' or top_m <= 1:
+            aggregated = np.maximum.reduceat(scores, self.starts, axis=1)
+        else:
+            aggregated = np.empty((scores.shape[0], len(self.starts)), dtype=np.float32)
+            for g, (start, count) in enumerate(zip(self.starts, self.counts)):
+                group = np.sort(scores[:, start:start + count], axis=1)[:, -min(top_m, count):]
+                aggregated[:, g] = group.mean(axis=1)
+        ids = self.diary_ids.tolist()
+        return [dict(zip(ids, row.tolist())) for row in aggregated]
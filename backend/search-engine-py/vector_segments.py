@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+메모리 맵 벡터 세그먼트 (my_local_qdrant_db/segments/)
+
+diary_embeddings.db와 별도로, 정규화된 float32 행렬을 append-only 세그먼트 파일에 유지합니다.
+검색 스크립트는 이 파일을 np.memmap으로 열기 때문에, 여러 프로세스가 동시에 검색해도
+각자 힙에 전체 임베딩을 복사하지 않고 OS 페이지 캐시를 공유합니다.
+
+  manifest.json      현재 세그먼트 이름, 유효 행 수(rows), 차원(dim)
+  seg-NNNNNN.vec     rows × dim float32 (little-endian, 행별 L2 정규화)
+  seg-NNNNNN.ids     rows개 int64 diary_id
+  seg-NNNNNN.flags   rows개 uint8 (1: 저장, 0: 삭제 표시)
+
+- 같은 diary_id는 마지막 행이 유효하며, 마지막 행이 삭제 표시면 삭제된 일기입니다.
+- 쓰기(upsert_diary/delete_diary/백필)는 write_transaction()으로 diary_embeddings.db 쓰기 잠금을 잡은 채
+  커밋 직전에 행을 덧붙이고 manifest를 임시 파일 + os.replace로 교체합니다. 롤백된 쓰기는 덧붙이지 않으며,
+  덧붙인 뒤 커밋이 실패하면 세그먼트 사용을 중지합니다. 읽는 쪽은 manifest의 rows까지만 보므로
+  덧붙이는 중인 행이나 반쯤 쓰인 파일을 보지 않습니다.
+- 압축(compact)은 유효한 행만 새 세그먼트에 쓴 뒤 manifest 교체 한 번으로 전환합니다.
+- 세그먼트는 manifest가 있을 때만 사용/유지됩니다. 처음 한 번 rebuild로 만들어 주세요.
+
+이 모듈은 delete_diary.py에서도 사용하므로 numpy는 필요한 함수 안에서만 import합니다.
+
+실행:
+  python vector_segments.py rebuild   # diary_embeddings.db 전체로 세그먼트 새로 생성
+  python vector_segments.py compact   # 덮어쓰기/삭제된 행 정리
+  python vector_segments.py status
+  python vector_segments.py drop      # 세그먼트 사용 중지 (manifest 삭제)
+"""
+
+import json
+import os
+import sys
+from contextlib import contextmanager
+
+from sqlite_pool import DEFAULT_DB_PATH, VECTOR_DB_DIR, connection, transaction
+
+SEGMENT_DIR = os.path.join(VECTOR_DB_DIR, 'segments')
+MANIFEST_PATH = os.path.join(SEGMENT_DIR, 'manifest.json')
+
+SEGMENT_VERSION = 1
+
+# 마지막 압축 이후 덧붙인 행이 이 비율을 넘으면 압축
+COMPACTION_RATIO = 0.25
+COMPACTION_MIN_ROWS = 1024
+
+
+def segment_paths(name):
+    base = os.path.join(SEGMENT_DIR, name)
+    return base + '.vec', base + '.ids', base + '.flags'
+
+
+def read_manifest():
+    """현재 manifest (세그먼트가 없으면 None)"""
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return manifest if manifest.get('version') == SEGMENT_VERSION else None
+
+
+def _write_manifest(manifest):
+    """임시 파일에 쓰고 fsync 후 os.replace로 원자적으로 교체"""
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def invalidate():
+    """세그먼트 사용 중지 (쓰기 실패로 DB와 어긋날 수 있을 때). 읽는 쪽은 DB에서 로드합니다."""
+    try:
+        os.remove(MANIFEST_PATH)
+    except FileNotFoundError:
+        pass
+
+
+def _next_segment_name(manifest):
+    number = int(manifest['segment'].split('-')[1]) + 1 if manifest else 1
+    return f'seg-{number:06d}'
+
+
+def _row_bytes(vector, dim):
+    """행 하나의 float32 바이트 (None이면 삭제 표시용 0 벡터)"""
+    if vector is None:
+        return bytes(4 * dim)
+    import numpy as np
+
+    vec = np.asarray(vector, dtype='<f4').reshape(-1)
+    if vec.shape[0] != dim:
+        raise ValueError(f"세그먼트 차원 불일치: {vec.shape[0]} != {dim}")
+    norm = float(np.linalg.norm(vec))
+    return (vec / norm if norm else vec).astype('<f4').tobytes()
+
+
+def _fit_file(f, size):
+    """이전 쓰기가 중간에 실패해 manifest보다 길어진 꼬리를 버리고 끝으로 이동"""
+    f.seek(0, os.SEEK_END)
+    if f.tell() > size:
+        f.truncate(size)
+    f.seek(size)
+
+
+def append_entries(entries, compact_if_needed=False):
+    """(diary_id, vector 또는 None) 목록을 현재 세그먼트에 덧붙임
+
+    diary_embeddings.db의 쓰기 트랜잭션을 잡은 상태에서 호출해야 쓰기가 직렬화됩니다
+    (보통 write_transaction()이 커밋 직전에 호출). 세그먼트가 없으면 아무것도 하지 않고 False를 반환합니다.
+    """
+    manifest = read_manifest()
+    if manifest is None or not entries:
+        return False
+    dim = manifest['dim']
+    rows = manifest['rows']
+    vec_path, ids_path, flags_path = segment_paths(manifest['segment'])
+
+    vec_data = b''.join(_row_bytes(vector, dim) for _, vector in entries)
+    ids_data = b''.join(int(diary_id).to_bytes(8, 'little', signed=True) for diary_id, _ in entries)
+    flags_data = bytes(0 if vector is None else 1 for _, vector in entries)
+
+    for path, data, size in ((vec_path, vec_data, rows * dim * 4), (ids_path, ids_data, rows * 8), (flags_path, flags_data, rows)):
+        with open(path, 'r+b') as f:
+            _fit_file(f, size)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    manifest['rows'] = rows + len(entries)
+    _write_manifest(manifest)
+
+    if compact_if_needed and needs_compaction(manifest):
+        compact()
+    return True
+
+
+@contextmanager
+def write_transaction(db_path=DEFAULT_DB_PATH, compact_if_needed=False):
+    """diary_embeddings.db 쓰기 트랜잭션 → (conn, 세그먼트에 덧붙일 (diary_id, vector 또는 None) 목록)
+
+    블록이 정상적으로 끝나면 쓰기 잠금을 잡은 채 커밋 직전에 목록을 덧붙이고, 블록에서 예외가 나 롤백하면
+    덧붙이지 않습니다. 덧붙이기가 실패하거나 덧붙인 뒤 커밋이 실패하면 세그먼트가 DB와 어긋나므로 사용을 중지합니다.
+    """
+    entries = []
+    appended = False
+    try:
+        with transaction(db_path) as conn:
+            yield conn, entries
+            if entries:
+                try:
+                    appended = append_entries(entries, compact_if_needed)
+                except Exception as e:
+                    # 세그먼트만 실패하면 DB 쓰기는 그대로 커밋
+                    print(f"세그먼트 갱신 실패, 세그먼트 사용 중지: {e}", file=sys.stderr)
+                    invalidate()
+    except BaseException as e:
+        if appended:
+            print(f"세그먼트 갱신 후 커밋 실패, 세그먼트 사용 중지: {e}", file=sys.stderr)
+            invalidate()
+        raise
+
+
+def needs_compaction(manifest):
+    appended = manifest['rows'] - manifest.get('compacted_rows', 0)
+    return appended >= max(COMPACTION_MIN_ROWS, int(manifest.get('compacted_rows', 0) * COMPACTION_RATIO))
+
+
+class SegmentSnapshot:
+    """manifest 한 시점의 세그먼트 (vec는 memmap, 유효 행은 diary_id별 마지막 저장 행)"""
+
+    def __init__(self, manifest):
+        import numpy as np
+
+        self.manifest = manifest
+        rows, dim = manifest['rows'], manifest['dim']
+        vec_path, ids_path, flags_path = segment_paths(manifest['segment'])
+        if rows:
+            self.matrix = np.memmap(vec_path, dtype='<f4', mode='r', shape=(rows, dim))
+        else:
+            self.matrix = np.zeros((0, dim), dtype='<f4')
+        self.ids = np.fromfile(ids_path, dtype='<i8', count=rows)
+        flags = np.fromfile(flags_path, dtype=np.uint8, count=rows)
+        if self.ids.shape[0] != rows or flags.shape[0] != rows:
+            raise ValueError('세그먼트 파일이 manifest보다 짧습니다.')
+
+        # diary_id별 마지막 행, 그중 삭제 표시가 아닌 행만 유효
+        _, last_from_end = np.unique(self.ids[::-1], return_index=True)
+        last = rows - 1 - last_from_end
+        self.live_rows = np.sort(last[flags[last] == 1])
+        live_ids = self.ids[self.live_rows]
+        order = np.argsort(live_ids)
+        self._sorted_ids = live_ids[order]
+        self._sorted_rows = self.live_rows[order]
+
+    def rows_for(self, diary_ids):
+        """diary_id 배열 → 세그먼트 행 배열 (세그먼트에 없는 id는 -1)"""
+        import numpy as np
+
+        diary_ids = np.asarray(diary_ids, dtype=np.int64)
+        if self._sorted_ids.shape[0] == 0:
+            return np.full(diary_ids.shape[0], -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted_ids, diary_ids), self._sorted_ids.shape[0] - 1)
+        return np.where(self._sorted_ids[pos] == diary_ids, self._sorted_rows[pos], -1)
+
+
+def open_snapshot():
+    """현재 세그먼트를 memmap으로 열기 (없거나 압축 중 교체되어 열 수 없으면 None)"""
+    for _ in range(2):
+        manifest = read_manifest()
+        if manifest is None:
+            return None
+        try:
+            return SegmentSnapshot(manifest)
+        except (FileNotFoundError, ValueError):
+            # 읽는 사이 압축으로 세그먼트가 교체되었으면 새 manifest로 한 번 더 시도
+            continue
+    return None
+
+
+def _write_segment(name, chunks):
+    """(diary_ids, 정규화 float32 행렬) 청크들로 새 세그먼트 파일을 쓰고 행 수를 반환"""
+    import numpy as np
+
+    os.makedirs(SEGMENT_DIR, exist_ok=True)
+    vec_path, ids_path, flags_path = segment_paths(name)
+    rows = 0
+    with open(vec_path, 'wb') as fv, open(ids_path, 'wb') as fi, open(flags_path, 'wb') as ff:
+        for diary_ids, matrix in chunks:
+            fv.write(np.ascontiguousarray(matrix, dtype='<f4').tobytes())
+            fi.write(np.asarray(diary_ids, dtype='<i8').tobytes())
+            ff.write(bytes([1]) * len(diary_ids))
+            rows += len(diary_ids)
+        for f in (fv, fi, ff):
+            f.flush()
+            os.fsync(f.fileno())
+    return rows
+
+
+def _swap_segment(old_manifest, name, rows, dim):
+    """manifest 교체로 새 세그먼트로 전환하고, 이전 세그먼트 파일은 가능한 경우 삭제"""
+    _write_manifest({
+        'version': SEGMENT_VERSION,
+        'segment': name,
+        'rows': rows,
+        'dim': dim,
+        'compacted_rows': rows
+    })
+    if old_manifest and old_manifest['segment'] != name:
+        for path in segment_paths(old_manifest['segment']):
+            try:
+                os.remove(path)
+            except OSError:
+                # Windows에서 아직 memmap으로 열려 있으면 다음 압축 때 정리
+                pass
+    _remove_orphans(name)
+
+
+def _remove_orphans(current):
+    for filename in os.listdir(SEGMENT_DIR):
+        if filename.startswith('seg-') and not filename.startswith(current + '.'):
+            try:
+                os.remove(os.path.join(SEGMENT_DIR, filename))
+            except OSError:
+                pass
+
+
+def compact(chunk_rows=8192):
+    """유효한 행만 새 세그먼트로 옮기고 원자적으로 교체 (쓰기 트랜잭션 안에서 호출)"""
+    snapshot = open_snapshot()
+    if snapshot is None:
+        return None
+    manifest = snapshot.manifest
+    live = snapshot.live_rows
+    name = _next_segment_name(manifest)
+    chunks = (
+        (snapshot.ids[live[start:start + chunk_rows]], snapshot.matrix[live[start:start + chunk_rows]])
+        for start in range(0, live.shape[0], chunk_rows)
+    )
+    rows = _write_segment(name, chunks)
+    del chunks, snapshot
+    _swap_segment(manifest, name, rows, manifest['dim'])
+    return {'segment': name, 'rows_before': manifest['rows'], 'rows_after': rows}
+
+
+def rebuild(db_path=DEFAULT_DB_PATH, batch_size=4096):
+    """diary_embeddings.db 전체로 세그먼트를 새로 생성 (쓰기 잠금을 잡아 그동안의 업서트는 대기)"""
+    from vector_search import normalize_rows
+    from vector_store import decode_embedding
+
+    with transaction(db_path) as conn:
+        manifest = read_manifest()
+        name = _next_segment_name(manifest)
+        dim = {}
+
+        def chunks():
+            cursor = conn.execute('SELECT diary_id, embedding FROM diary_embeddings ORDER BY diary_id')
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    return
+                ids, vectors = [], []
+                for diary_id, blob in batch:
+                    try:
+                        vec = decode_embedding(blob)
+                    except Exception:
+                        continue
+                    dim.setdefault('dim', vec.shape[0])
+                    if vec.shape[0] != dim['dim']:
+                        continue
+                    ids.append(diary_id)
+                    vectors.append(vec)
+                if vectors:
+                    yield ids, normalize_rows(vectors)
+
+        rows = _write_segment(name, chunks())
+        if not dim:
+            raise ValueError('세그먼트로 만들 임베딩이 없습니다.')
+        _swap_segment(manifest, name, rows, dim['dim'])
+    return {'segment': name, 'rows': rows, 'dim': dim['dim']}
+
+
+def load_segment_index(scope=None, db_path=DEFAULT_DB_PATH):
+    """세그먼트 memmap 위에 VectorIndex를 구성 (세그먼트가 없거나 DB와 어긋나면 None)
+
+    범위가 없으면 memmap 행렬을 그대로 쓰고 유효하지 않은 행은 mask로 제외합니다(복사 없음).
+    범위가 있으면 해당 행만 골라 복사합니다. 메타데이터(text/date)는 DB에서 임베딩 없이 조회합니다.
+    """
+    import numpy as np
+    from vector_search import VectorIndex
+    from vector_store import scope_where_clause
+
+    snapshot = open_snapshot()
+    if snapshot is None or not os.path.exists(db_path):
+        return None
+    with connection(db_path) as conn:
+        where, params = scope_where_clause(scope)
+        rows = conn.execute('SELECT diary_id, text, date FROM diary_embeddings' + where, params).fetchall()
+    if not rows:
+        return None
+
+    segment_rows = snapshot.rows_for([row[0] for row in rows])
+    if (segment_rows < 0).any():
+        # DB에는 있지만 세그먼트에는 없는 일기 → 세그먼트가 오래됨, DB에서 로드
+        return None
+    items = [{'id': diary_id, 'text': text, 'date': date, 'combined_text': text} for diary_id, text, date in rows]
+
+    if scope:
+        return VectorIndex.from_normalized(snapshot.matrix[segment_rows], items)
+    full_items = [None] * snapshot.matrix.shape[0]
+    for row, item in zip(segment_rows.tolist(), items):
+        full_items[row] = item
+    mask = np.zeros(snapshot.matrix.shape[0], dtype=bool)
+    mask[segment_rows] = True
+    return VectorIndex.from_normalized(snapshot.matrix, full_items, mask)
+
+
+def main():
+    """메인 함수"""
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    try:
+        if command == 'rebuild':
+            result = {"success": True, "message": "세그먼트 생성 완료", **rebuild()}
+        elif command == 'compact':
+            # 압축 중 덧붙이는 행이 manifest 교체로 사라지지 않도록 쓰기 잠금을 잡음
+            with transaction(DEFAULT_DB_PATH):
+                compacted = compact()
+            result = {"success": compacted is not None, "message": "세그먼트 압축 완료" if compacted else "세그먼트가 없습니다.", **(compacted or {})}
+        elif command == 'drop':
+            invalidate()
+            result = {"success": True, "message": "세그먼트 사용 중지"}
+        else:
+            snapshot = open_snapshot()
+            if snapshot is None:
+                result = {"success": True, "enabled": False}
+            else:
+                result = {
+                    "success": True,
+                    "enabled": True,
+                    **snapshot.manifest,
+                    "live_rows": int(snapshot.live_rows.shape[0]),
+                    "needs_compaction": needs_compaction(snapshot.manifest)
+                }
+    except Exception as e:
+        result = {"success": False, "message": f"세그먼트 작업 실패: {str(e)}"}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+diary_embeddings.db 벡터 직렬화 유틸리티
+
+임베딩은 헤더 + little-endian float32 바이트로 저장합니다.
+  헤더(12바이트): 매직 b'EMB1' | dtype 코드(uint32) | 차원(uint32)
+예전 형식(json.dumps 텍스트)도 읽을 수 있으며, migrate_embeddings.py로 일괄 변환합니다.
+"""
+
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+# EMBEDDING_DB_PATH: 스크립트들이 쓰는 일기 임베딩 DB 경로 (sqlite_pool.DEFAULT_DB_PATH)
+# ensure_schema: 기존 스크립트 호환
+from sqlite_pool import DEFAULT_DB_PATH as EMBEDDING_DB_PATH, VECTOR_DB_DIR, connection, ensure_schema
+from vector_search import LiveVectorIndex
+
+EMBEDDING_MAGIC = b'EMB1'
+EMBEDDING_HEADER = struct.Struct('<4sII')
+DTYPE_CODES = {1: np.dtype('<f4')}
+DTYPE_FLOAT32 = 1
+
+
+# 검색 범위 필터 (요청 JSON 키 → diary_embeddings 조건)
+SCOPE_KEYS = ('child_id', 'parent_id', 'date_from', 'date_to')
+SCOPE_CONDITIONS = {
+    'child_id': 'child_id = ?',
+    'parent_id': 'parent_id = ?',
+    'date_from': 'date >= ?',
+    'date_to': 'date <= ?',
+}
+
+
+def text_hash(text):
+    """임베딩 대상 텍스트의 해시 (앞뒤 공백 제거 후 SHA-256)"""
+    return hashlib.sha256(str(text).strip().encode('utf-8')).hexdigest()
+
+
+def extract_scope(data_input):
+    """요청 JSON에서 검색 범위(child_id/parent_id/date_from/date_to)만 추출"""
+    if not isinstance(data_input, dict):
+        return {}
+    return {key: data_input[key] for key in SCOPE_KEYS if data_input.get(key) not in (None, '')}
+
+
+def scope_where_clause(scope):
+    """검색 범위를 SQL WHERE 절과 파라미터로 변환 (범위가 없으면 빈 문자열)"""
+    conditions = []
+    params = []
+    for key in SCOPE_KEYS:
+        if scope and scope.get(key) not in (None, ''):
+            conditions.append(SCOPE_CONDITIONS[key])
+            params.append(scope[key])
+    if not conditions:
+        return '', []
+    return ' WHERE ' + ' AND '.join(conditions), params
+
+
+def fetch_embedding_rows(cursor, scope=None, diary_ids=None):
+    """임베딩 행을 dict 목록으로 조회 (scope 또는 diary_ids로 한정 가능)"""
+    where, params = scope_where_clause(scope)
+    if diary_ids is not None:
+        diary_ids = list(diary_ids)
+        if not diary_ids:
+            return []
+        condition = f"diary_id IN ({','.join('?' * len(diary_ids))})"
+        where = f"{where} AND {condition}" if where else f" WHERE {condition}"
+        params = params + diary_ids
+    cursor.execute(
+        'SELECT diary_id, text, embedding, date, created_at, child_id, parent_id, text_hash FROM diary_embeddings' + where,
+        params
+    )
+    columns = ('diary_id', 'text', 'embedding', 'date', 'created_at', 'child_id', 'parent_id', 'text_hash')
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def load_embedding_vectors(diary_ids, db_path=EMBEDDING_DB_PATH):
+    """diary_id 목록의 float32 임베딩을 같은 순서의 (len(diary_ids), D) 행렬로 조회"""
+    diary_ids = list(diary_ids)
+    vectors = {}
+    with connection(db_path) as conn:
+        # SQLite 바인딩 변수 개수 제한을 넘지 않도록 나누어 조회
+        for start in range(0, len(diary_ids), 500):
+            chunk = diary_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT diary_id, embedding FROM diary_embeddings WHERE diary_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            for diary_id, blob in rows:
+                vectors[diary_id] = decode_embedding(blob)
+    missing = [diary_id for diary_id in diary_ids if diary_id not in vectors]
+    if missing:
+        raise KeyError(f"임베딩이 없는 diary_id: {missing[:10]}")
+    return np.vstack([vectors[diary_id] for diary_id in diary_ids]) if diary_ids else np.zeros((0, 0), dtype=np.float32)
+
+
+def row_stamp(row):
+    """행이 바뀌었는지 비교할 값 (created_at은 초 단위라 같은 초의 쓰기를 구분하지 못하므로 텍스트 해시와 메타데이터도 포함)"""
+    return (row.get('text_hash'), row.get('date'), row.get('child_id'), row.get('parent_id'), row.get('created_at'))
+
+
+def embedding_row_item(row):
+    """fetch_embedding_rows의 행을 검색 결과용 메타데이터로 변환"""
+    return {
+        'id': row['diary_id'],
+        'text': row['text'],
+        'date': row['date'],
+        'combined_text': row['text'],
+    }
+
+
+def load_live_index(db_path=EMBEDDING_DB_PATH, scope=None):
+    """diary_embeddings.db(의 범위)를 LiveVectorIndex로 로드 (깨진 행은 건너뜀)"""
+    index = LiveVectorIndex()
+    if not os.path.exists(db_path):
+        return index
+    with connection(db_path) as conn:
+        for row in fetch_embedding_rows(conn.cursor(), scope):
+            try:
+                index.upsert(row['diary_id'], decode_embedding(row['embedding']), embedding_row_item(row), row_stamp(row))
+            except Exception:
+                continue
+    return index
+
+
+def row_in_scope(row, scope):
+    """fetch_embedding_rows의 행이 검색 범위에 속하는지 (scope_where_clause와 같은 조건)"""
+    if not scope:
+        return True
+    if scope.get('child_id') not in (None, '') and str(row.get('child_id')) != str(scope['child_id']):
+        return False
+    if scope.get('parent_id') not in (None, '') and str(row.get('parent_id')) != str(scope['parent_id']):
+        return False
+    date = row.get('date') or ''
+    if scope.get('date_from') not in (None, '') and date < str(scope['date_from']):
+        return False
+    if scope.get('date_to') not in (None, '') and date > str(scope['date_to']):
+        return False
+    return True
+
+
+def encode_embedding(embedding):
+    """벡터를 헤더 + float32 바이트(BLOB)로 변환"""
+    vec = np.ascontiguousarray(embedding, dtype='<f4').reshape(-1)
+    header = EMBEDDING_HEADER.pack(EMBEDDING_MAGIC, DTYPE_FLOAT32, vec.shape[0])
+    return header + vec.tobytes()
+
+
+def is_binary_embedding(blob):
+    """BLOB이 바이너리(헤더 포함) 형식인지 확인"""
+    return isinstance(blob, (bytes, bytearray, memoryview)) and bytes(blob[:4]) == EMBEDDING_MAGIC
+
+
+def decode_embedding(blob):
+    """BLOB을 float32 벡터로 변환 (바이너리는 복사 없이 np.frombuffer로 읽음)"""
+    if is_binary_embedding(blob):
+        _, dtype_code, dim = EMBEDDING_HEADER.unpack_from(blob, 0)
+        dtype = DTYPE_CODES.get(dtype_code)
+        if dtype is None:
+            raise ValueError(f"지원하지 않는 임베딩 dtype 코드: {dtype_code}")
+        return np.frombuffer(blob, dtype=dtype, count=dim, offset=EMBEDDING_HEADER.size)
+
+    # 예전 형식: json.dumps(list) 텍스트
+    if isinstance(blob, (bytes, bytearray, memoryview)):
+        blob = bytes(blob).decode('utf-8')
+    return np.asarray(json.loads(blob), dtype=np.float32)
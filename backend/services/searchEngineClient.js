@@ -0,0 +1,44 @@
+/**
+ * 상주형 검색 엔진 서버(search-engine-py/search_server.py) 클라이언트
+ * SEARCH_ENGINE_URL이 설정되지 않았거나 서버에 연결할 수 없으면 null을 반환하므로,
+ * 호출하는 쪽에서는 기존 Python 스크립트 실행으로 대체하면 됩니다.
+ */
+
+const axios = require('axios');
+const config = require('../config');
+
+async function callSearchEngine(endpoint, payload) {
+  const baseUrl = config.searchEngine.url;
+  if (!baseUrl) return null;
+  try {
+    const response = await axios.post(`${baseUrl.replace(/\/$/, '')}/${endpoint}`, payload, {
+      timeout: config.searchEngine.timeoutMs,
+      // 4xx/5xx 응답도 스크립트와 같은 JSON 계약이므로 그대로 사용
+      validateStatus: () => true,
+    });
+    if (response.data && typeof response.data === 'object') return response.data;
+    return null;
+  } catch (error) {
+    console.error(`[searchEngine] ${endpoint} 호출 실패, 스크립트 실행으로 대체:`, error.message);
+    return null;
+  }
+}
+
+// 요청 본문에서 검색 범위(아이/부모/기간)만 추출 (camelCase도 허용)
+function pickSearchScope(body = {}) {
+  const scope = {
+    child_id: body.child_id ?? body.childId,
+    parent_id: body.parent_id ?? body.parentId,
+    date_from: body.date_from ?? body.dateFrom,
+    date_to: body.date_to ?? body.dateTo,
+  };
+  Object.keys(scope).forEach((key) => {
+    if (scope[key] === undefined || scope[key] === null || scope[key] === '') delete scope[key];
+  });
+  return scope;
+}
+
+module.exports = {
+  callSearchEngine,
+  pickSearchScope,
+};